@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Benchmarks for the query, JSON output and KML/KMZ pipelines.
+
+Each case runs in its own subprocess so its peak RSS is measured in
+isolation. Results are compared against ``benchmarks/baseline.json`` with
+``--check``, which fails when a case gets slower than the tolerance allows
+or issues more requests than the baseline.
+
+Examples:
+    python benchmarks/run_benchmarks.py --sizes 10000
+    python benchmarks/run_benchmarks.py --sizes 10000 --check
+    python benchmarks/run_benchmarks.py --sizes 10000,100000,1000000 --geometries point,polygon
+    python benchmarks/run_benchmarks.py --sizes 10000 --update-baseline
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+CASES = ['query', 'output_json', 'convert_kml', 'count_vertices', 'split_kml', 'create_kmz']
+POLYGON_VERTICES = 64
+DEFAULT_TOLERANCE = 2.0
+# Cases faster than this are too noisy to compare against the baseline
+MIN_COMPARED_SECONDS = 0.05
+
+
+def make_features(size, geometry):
+    from src.esri_client.mock_server import SyntheticLayer
+
+    layer = SyntheticLayer('bench', size, geometry, POLYGON_VERTICES)
+    return {'type': 'FeatureCollection',
+            'features': [layer.geojson_feature(oid, None, True) for oid in range(1, size + 1)]}
+
+
+def run_case(case, size, geometry):
+    """Run one benchmark case in this process and return its measurements."""
+    import cli
+    from argparse import Namespace
+    from src.esri_client import EsriClient
+    from src.esri_client.mock_server import build_server
+
+    result = {'case': case, 'size': size, 'geometry': geometry}
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        output = os.path.join(tmp, 'bench.kml')
+        args = Namespace(output=output, format='kml')
+
+        if case == 'query':
+            with build_server(size, geometry, POLYGON_VERTICES, max_record_count=2000) as server:
+                layer = EsriClient(server.url).get_layer('Synthetic/MapServer', 0)
+                server.reset_stats()
+                start = time.perf_counter()
+                data = layer.query(format='geojson', strategy='auto')
+                elapsed = time.perf_counter() - start
+                result['requests'] = server.request_count
+                result['connections'] = server.connection_count
+            assert len(data['features']) == size
+        else:
+            data = make_features(size, geometry)
+            kml = cli.convert_json_to_kml(data, 'NAME') if case in ('count_vertices', 'split_kml', 'create_kmz') else None
+            kml_files = None
+            if case == 'create_kmz':
+                vertices = cli.count_kml_vertices(kml)
+                kml_files = cli.split_kml_files(kml, data, args, vertices, 'NAME')
+
+            start = time.perf_counter()
+            if case == 'output_json':
+                cli.output_result(data, Namespace(output=os.path.join(tmp, 'bench.json'), format='pjson'))
+            elif case == 'convert_kml':
+                cli.convert_json_to_kml(data, 'NAME')
+            elif case == 'count_vertices':
+                result['vertices'] = cli.count_kml_vertices(kml)
+            elif case == 'split_kml':
+                result['files'] = len(cli.split_kml_files(kml, data, args, cli.count_kml_vertices(kml), 'NAME'))
+            elif case == 'create_kmz':
+                cli.create_kmz(kml_files, args)
+            elapsed = time.perf_counter() - start
+
+    result['seconds'] = round(elapsed, 4)
+    result['features_per_second'] = round(size / elapsed) if elapsed else None
+    result['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return result
+
+
+def run_isolated(case, size, geometry):
+    """Run a case in a fresh interpreter and return its measurements."""
+    command = [sys.executable, os.path.abspath(__file__), '--run-case', case, '--sizes', str(size),
+               '--geometries', geometry]
+    completed = subprocess.run(command, capture_output=True, text=True, cwd=ROOT)
+    if completed.returncode != 0:
+        return {'case': case, 'size': size, 'geometry': geometry, 'error': completed.stderr.strip().splitlines()[-1:]}
+    return json.loads(completed.stdout)
+
+
+def key(result):
+    return f"{result['case']}/{result['geometry']}/{result['size']}"
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regression messages."""
+    regressions = []
+    for result in results:
+        reference = baseline.get(key(result))
+        if 'error' in result:
+            regressions.append(f"{key(result)} failed: {result['error']}")
+            continue
+        if not reference:
+            continue
+        if reference['seconds'] >= MIN_COMPARED_SECONDS and result['seconds'] > reference['seconds'] * tolerance:
+            regressions.append(f"{key(result)} took {result['seconds']}s, baseline {reference['seconds']}s")
+        if 'requests' in reference and result.get('requests', 0) > reference['requests']:
+            regressions.append(f"{key(result)} issued {result['requests']} requests, baseline {reference['requests']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run esri-cli pipeline benchmarks')
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='Comma separated feature counts')
+    parser.add_argument('--geometries', default='point,polygon', help='Comma separated geometry types')
+    parser.add_argument('--cases', default=','.join(CASES), help='Comma separated benchmark cases')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    parser.add_argument('--check', action='store_true', help='Fail if results regress against the baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='Allowed slowdown factor')
+    parser.add_argument('--update-baseline', action='store_true', help='Store results as the new baseline')
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    geometries = args.geometries.split(',')
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, sizes[0], geometries[0])))
+        return
+
+    results = []
+    for size in sizes:
+        for geometry in geometries:
+            for case in args.cases.split(','):
+                result = run_isolated(case, size, geometry)
+                results.append(result)
+                print(json.dumps(result), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+
+    if args.update_baseline:
+        baseline.update({key(r): r for r in results if 'error' not in r})
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(dict(sorted(baseline.items())), f, indent=2)
+            f.write('\n')
+
+    if args.check:
+        regressions = compare(results, baseline, args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION: {message}")
+        if regressions:
+            sys.exit(1)
+        print(f"{len(results)} benchmarks within {args.tolerance}x of baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,9 +3,10 @@ import sys
 import json
 import argparse
 import logging
-import html
-from src.esri_client import EsriClient
-from requests.exceptions import RequestException, ConnectionError, Timeout, HTTPError
+import time
+from src.esri_client.kml import (convert_json_to_kml, count_kml_vertices, MAX_KML_VERTICES,
+                                 KML_HEADER, KML_FOOTER, PlacemarkRenderer)
+from src.esri_client.profiling import Profiler, phase
 
 # Constants
 DEFAULT_WHERE = '1=1'
@@ -14,6 +15,17 @@ DEFAULT_SPATIAL_REL = 'esriSpatialRelIntersects'
 DEFAULT_UNITS = 'esriSRUnit_Foot'
 DEFAULT_ENCODING = 'esriDefault'
 DEFAULT_FORMAT = 'pjson'
+DEFAULT_STRATEGY = 'auto'
+DEFAULT_WORKERS = 4
+DEFAULT_CACHE_MAX_MB = 512
+DEFAULT_BATCH_CONCURRENCY = 4
+
+# Parsed arguments that control the CLI itself rather than the layer query
+CLI_ONLY_ARGS = ['command', 'url', 'folder', 'service', 'id', 'name', 'output', 'debug', 'progress',
+                 'strategy', 'workers', 'cache_dir', 'cache_max_mb', 'explain', 'stats',
+                 'profile', 'cprofile', 'trace_memory', 'adaptive', 'pipeline', 'processes',
+                 'max_memory', 'spill_dir', 'simplify', 'regionate', 'with_related', 'related_fields',
+                 'related_where']
 
 logger = logging.getLogger(__name__)
 
@@ -25,8 +37,22 @@ def add_common_args(parser):
     """
     parser.add_argument('--url', required=True, help='Base URL of the ArcGIS server')
     parser.add_argument('--output', help='Output file path')
-    parser.add_argument('--debug', action='store_true', help='Enable debug logging')
     parser.add_argument('--progress', action='store_true', help='Show progress during queries')
+    add_reporting_args(parser)
+
+def add_reporting_args(parser):
+    """Add debug logging, metrics and profiling arguments to a parser.
+    
+    Args:
+        parser: ArgumentParser to add arguments to
+    """
+    parser.add_argument('--debug', action='store_true', help='Enable debug logging')
+    parser.add_argument('--stats', nargs='?', const='-', metavar='PATH',
+                        help='Report request metrics as JSON to stderr, or to PATH if given')
+    parser.add_argument('--profile', nargs='?', const='-', metavar='PATH',
+                        help='Report time spent per pipeline phase as JSON to stderr, or to PATH if given')
+    parser.add_argument('--cprofile', metavar='PATH', help='Write cProfile stats to PATH (implies --profile)')
+    parser.add_argument('--trace-memory', action='store_true', help='Report peak Python memory (implies --profile)')
 
 def add_service_args(parser):
     """Add service-related arguments to a parser.
@@ -46,91 +72,267 @@ def add_layer_args(parser):
     parser.add_argument('--id', type=int, help='Layer ID')
     parser.add_argument('--name', help='Layer name')
 
-def main():
-    """Main entry point for the CLI application.
+def configure_folders_parser(parser):
+    add_common_args(parser)
+
+def configure_folder_parser(parser):
+    parser.add_argument('folder_name', help='Folder name')
+    add_common_args(parser)
+
+def configure_services_parser(parser):
+    add_common_args(parser)
+    parser.add_argument('--folder', help='Folder name')
+
+def configure_service_parser(parser):
+    parser.add_argument('service_name', help='Service name')
+    add_common_args(parser)
+    parser.add_argument('--folder', help='Folder name')
+
+def configure_layers_parser(parser):
+    add_common_args(parser)
+    add_service_args(parser)
+
+def configure_layer_parser(parser):
+    add_common_args(parser)
+    add_service_args(parser)
+    add_layer_args(parser)
+
+def configure_query_parser(parser):
+    add_common_args(parser)
+    add_service_args(parser)
+    add_layer_args(parser)
+    parser.add_argument('--where', default=DEFAULT_WHERE, help='Where clause')
+    parser.add_argument('--text', help='Text search')
+    parser.add_argument('--objectIds', help='Object IDs')
+    parser.add_argument('--time', help='Time')
+    parser.add_argument('--timeRelation', help='Time relation')
+    parser.add_argument('--geometry', help='Geometry')
+    parser.add_argument('--geometryType', default=DEFAULT_GEOMETRY_TYPE, help='Geometry type')
+    parser.add_argument('--inSR', help='Input spatial reference')
+    parser.add_argument('--spatialRel', default=DEFAULT_SPATIAL_REL, help='Spatial relationship')
+    parser.add_argument('--distance', help='Distance')
+    parser.add_argument('--units', default=DEFAULT_UNITS, help='Units')
+    parser.add_argument('--relationParam', help='Relation parameter')
+    parser.add_argument('--outFields', default='', help='Output fields')
+    parser.add_argument('--returnGeometry', default='true', help='Return geometry')
+    parser.add_argument('--returnTrueCurves', default='false', help='Return true curves')
+    parser.add_argument('--maxAllowableOffset', help='Max allowable offset')
+    parser.add_argument('--geometryPrecision', help='Geometry precision')
+    parser.add_argument('--outSR', help='Output spatial reference')
+    parser.add_argument('--havingClause', help='Having clause')
+    parser.add_argument('--returnIdsOnly', default='false', help='Return IDs only')
+    parser.add_argument('--returnCountOnly', default='false', help='Return count only')
+    parser.add_argument('--orderByFields', help='Order by fields')
+    parser.add_argument('--groupByFieldsForStatistics', help='Group by fields for statistics')
+    parser.add_argument('--outStatistics', help='Output statistics')
+    parser.add_argument('--returnZ', default='false', help='Return Z values')
+    parser.add_argument('--returnM', default='false', help='Return M values')
+    parser.add_argument('--gdbVersion', help='Geodatabase version')
+    parser.add_argument('--historicMoment', help='Historic moment')
+    parser.add_argument('--returnDistinctValues', default='false', help='Return distinct values')
+    parser.add_argument('--resultOffset', help='Result offset')
+    parser.add_argument('--resultRecordCount', help='Records per page')
+    parser.add_argument('--returnExtentOnly', default='false', help='Return extent only')
+    parser.add_argument('--sqlFormat', help='SQL format')
+    parser.add_argument('--datumTransformation', help='Datum transformation')
+    parser.add_argument('--parameterValues', help='Parameter values')
+    parser.add_argument('--rangeValues', help='Range values')
+    parser.add_argument('--quantizationParameters', help='Quantization parameters')
+    parser.add_argument('--featureEncoding', default=DEFAULT_ENCODING, help='Feature encoding')
+    parser.add_argument('--format', default=DEFAULT_FORMAT, help='Output format (pjson, geojson, kml, or kmz)')
+    parser.add_argument('--strategy', default=DEFAULT_STRATEGY, choices=['auto', 'offset', 'objectids', 'tiles', 'time'],
+                        help='Retrieval strategy: planned from layer capabilities (auto), offset paging, '
+                             'OBJECTID chunks, spatial tiles or time windows')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Maximum concurrent requests')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Tune the page size from response times and sizes while paging, and split failed pages')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Stream pages through concurrent download, multi-process conversion and an ordered writer')
+    parser.add_argument('--processes', type=int, help='Conversion processes for --pipeline (default: CPU count)')
+    parser.add_argument('--max-memory', type=float, metavar='MB',
+                        help='Approximate memory budget for features; pages beyond it spill to a temporary file')
+    parser.add_argument('--spill-dir', help='Directory for the --max-memory spill file (default: system temp dir)')
+    parser.add_argument('--simplify', type=int, nargs='?', const=MAX_KML_VERTICES, metavar='VERTICES',
+                        help='Simplify line and polygon geometries to fit a vertex budget '
+                             f'(default {MAX_KML_VERTICES}) instead of splitting KML output')
+    parser.add_argument('--regionate', type=int, nargs='?', const=1000, metavar='FEATURES_PER_NODE',
+                        help='With --format kmz, write a level-of-detail quadtree of KML files instead of '
+                             'part files (default 1000 features per node)')
+    parser.add_argument('--with-related', action='append', metavar='RELATIONSHIP',
+                        help='Add the related records of each feature for a relationship id or name '
+                             '(repeatable; pjson, json or geojson output)')
+    parser.add_argument('--related-fields', default='*', help='Related table fields for --with-related')
+    parser.add_argument('--related-where', help='Where clause applied to the related records')
+    parser.add_argument('--explain', action='store_true',
+                        help='Print the query plan and its estimated request count without running it')
+    parser.add_argument('--cache-dir', help='Directory for cached query results, reused until the layer is edited')
+    parser.add_argument('--cache-max-mb', type=int, default=DEFAULT_CACHE_MAX_MB, help='Maximum query cache size in MB')
+
+def configure_sync_parser(parser):
+    add_common_args(parser)
+    add_service_args(parser)
+    add_layer_args(parser)
+    parser.add_argument('--db', required=True, help='SQLite database file holding the local copy')
+    parser.add_argument('--where', default=DEFAULT_WHERE, help='Where clause')
+    parser.add_argument('--outFields', help='Output fields')
+    parser.add_argument('--format', default='geojson', choices=['geojson', 'pjson'], help='Stored feature format')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Concurrent requests')
+
+def configure_stats_parser(parser):
+    add_common_args(parser)
+    add_service_args(parser)
+    add_layer_args(parser)
+    parser.add_argument('--stat', action='append', required=True, metavar='TYPE:FIELD[:NAME]',
+                        help='Statistic to compute: count, sum, min, max, avg, stddev or var (repeatable)')
+    parser.add_argument('--group-by', help='Comma-separated fields to group by')
+    parser.add_argument('--where', default=DEFAULT_WHERE, help='Where clause')
+    parser.add_argument('--having', help='Having clause (server-side statistics only)')
+    parser.add_argument('--order-by', help='Order rows by FIELD [ASC|DESC], ...')
+    parser.add_argument('--local', action='store_true',
+                        help='Aggregate streamed features locally instead of asking the server')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Concurrent requests')
+
+def configure_attachments_parser(parser):
+    add_common_args(parser)
+    add_service_args(parser)
+    add_layer_args(parser)
+    parser.add_argument('--where', default=DEFAULT_WHERE, help='Where clause selecting the features')
+    parser.add_argument('--objectIds', help='Comma-separated object IDs instead of --where')
+    parser.add_argument('--verify', choices=['size', 'checksum'], default='size',
+                        help='Skip files already downloaded when their size (or SHA-256) matches')
+    parser.add_argument('--manifest', help='Manifest file (default: <output>/manifest.jsonl)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Concurrent downloads')
+
+def configure_tiles_parser(parser):
+    add_common_args(parser)
+    add_service_args(parser)
+    parser.add_argument('--bbox', required=True, metavar='WEST,SOUTH,EAST,NORTH',
+                        help='Area to download in longitude/latitude')
+    parser.add_argument('--min-zoom', type=int, default=0, help='First zoom level')
+    parser.add_argument('--max-zoom', type=int, required=True, help='Last zoom level')
+    parser.add_argument('--export', action='store_true',
+                        help='Render tiles with the export endpoint even if the service is cached')
+    parser.add_argument('--image-format', choices=['png', 'jpg'], default='png', help='Format of exported tiles')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent requests')
+
+def configure_lookup_parser(parser):
+    add_common_args(parser)
+    add_service_args(parser)
+    add_layer_args(parser)
+    parser.add_argument('--points', required=True, help='CSV file of points to look up, one per row')
+    parser.add_argument('--x-field', help='CSV column holding x/longitude (default: x, lon, lng or longitude)')
+    parser.add_argument('--y-field', help='CSV column holding y/latitude (default: y, lat or latitude)')
+    parser.add_argument('--inSR', default='4326', help='Spatial reference of the points')
+    parser.add_argument('--where', default=DEFAULT_WHERE, help='Where clause applied to the polygons')
+    parser.add_argument('--outFields', default='*', help='Polygon fields added to each row')
+    parser.add_argument('--cluster-size', type=int, default=256,
+                        help='Points per envelope query (default 256)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Concurrent requests')
+
+def configure_index_parser(parser):
+    index_commands = parser.add_subparsers(dest='index_command', required=True)
+    build = index_commands.add_parser('build', help='Download a layer into an offline spatial index file')
+    build.add_argument('index', help='Index file to write')
+    add_common_args(build)
+    add_service_args(build)
+    add_layer_args(build)
+    build.add_argument('--where', default=DEFAULT_WHERE, help='Where clause')
+    build.add_argument('--outFields', default='*', help='Fields stored with each feature')
+    build.add_argument('--outSR', help='Spatial reference of the indexed geometries (default: the layer\'s)')
+    build.add_argument('--node-capacity', type=int, default=16, help='Entries per R-tree node')
+    build.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Concurrent requests')
+
+    query = index_commands.add_parser('query', help='Look up points in an index file without the server')
+    query.add_argument('index', help='Index file built by "index build"')
+    query.add_argument('--point', action='append', metavar='X,Y', help='Point to look up (repeatable)')
+    query.add_argument('--points', help='CSV file of points to look up, one per row')
+    query.add_argument('--x-field', help='CSV column holding x/longitude (default: x, lon, lng or longitude)')
+    query.add_argument('--y-field', help='CSV column holding y/latitude (default: y, lat or latitude)')
+    query.add_argument('--nearest', type=int, metavar='K', help='Match the K nearest features instead')
+    query.add_argument('--output', help='Output file path')
+    query.add_argument('--debug', action='store_true', help='Enable debug logging')
+
+def configure_batch_parser(parser):
+    parser.add_argument('manifest', help='YAML or JSON manifest listing the query jobs')
+    parser.add_argument('--url', help='Base URL of the ArcGIS server (overrides the manifest)')
+    parser.add_argument('--concurrency', type=int, help='Number of jobs run at once (overrides the manifest)')
+    parser.add_argument('--connections', type=int,
+                        help='Maximum concurrent HTTP connections shared by all jobs (overrides the manifest)')
+    parser.add_argument('--summary', help='Write the JSON results summary to this file instead of stdout')
+    add_reporting_args(parser)
+
+def configure_serve_parser(parser):
+    parser.add_argument('--upstream', action='append', required=True, metavar='NAME=URL',
+                        help='ArcGIS server to proxy, served under /NAME (repeatable)')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on')
+    parser.add_argument('--ttl', type=float, default=300, help='Seconds to cache query results')
+    parser.add_argument('--metadata-ttl', type=float, default=3600,
+                        help='Seconds to cache catalog, service and layer metadata')
+    parser.add_argument('--cache-mb', type=int, default=256, help='Maximum size of the in-memory cache in MB')
+    parser.add_argument('--cache-entry-mb', type=float, default=8,
+                        help='Largest attachment or image response to cache in MB')
+    parser.add_argument('--connections', type=int, default=16, help='Upstream connections kept open per server')
+    parser.add_argument('--debug', action='store_true', help='Enable debug logging')
+
+# Command name -> (help text, parser configuration function)
+COMMAND_PARSERS = {
+    'folders': ('List all folders', configure_folders_parser),
+    'folder': ('Get folder details', configure_folder_parser),
+    'services': ('List services', configure_services_parser),
+    'service': ('Get service details', configure_service_parser),
+    'layers': ('List layers in a service', configure_layers_parser),
+    'layer': ('Get layer details', configure_layer_parser),
+    'query': ('Query a layer', configure_query_parser),
+    'sync': ('Incrementally sync a layer into a local SQLite store', configure_sync_parser),
+    'stats': ('Compute grouped statistics of a layer', configure_stats_parser),
+    'attachments': ('Download the attachments of a layer', configure_attachments_parser),
+    'tiles': ('Download map tiles of a MapServer into an MBTiles file', configure_tiles_parser),
+    'lookup': ('Find the polygon containing each point of a CSV file', configure_lookup_parser),
+    'index': ('Build or query an offline spatial index of a layer', configure_index_parser),
+    'batch': ('Run the query jobs in a manifest with a shared client', configure_batch_parser),
+    'serve': ('Run a local caching proxy in front of ArcGIS servers', configure_serve_parser),
+}
+
+def build_parser(argv):
+    """Build the argument parser, configuring only the command named in argv.
     
-    Sets up argument parsing and dispatches to command handlers.
+    Every command is registered so top-level help lists them all, but only the
+    selected command's arguments are built.
+    
+    Args:
+        argv: Command line arguments without the program name
+        
+    Returns:
+        ArgumentParser
     """
     parser = argparse.ArgumentParser(description='ESRI ArcGIS REST API CLI')
     subparsers = parser.add_subparsers(dest='command', help='Commands', required=True)
+    selected = next((arg for arg in argv if not arg.startswith('-')), None)
+    for name, (help_text, configure) in COMMAND_PARSERS.items():
+        command_parser = subparsers.add_parser(name, help=help_text)
+        if name == selected:
+            configure(command_parser)
+    return parser
+
+def get_client_class():
+    """Return EsriClient, importing the client (and requests) on first use."""
+    return getattr(sys.modules[__name__], 'EsriClient')
+
+def __getattr__(name):
+    # The client package is imported lazily so that help output and argument
+    # errors do not pay for importing requests
+    if name == 'EsriClient':
+        from src.esri_client import EsriClient
+        return EsriClient
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def main():
+    """Main entry point for the CLI application.
     
-    # folders command
-    folders_parser = subparsers.add_parser('folders', help='List all folders')
-    add_common_args(folders_parser)
-
-    # folder command
-    folder_parser = subparsers.add_parser('folder', help='Get folder details')
-    folder_parser.add_argument('folder_name', help='Folder name')
-    add_common_args(folder_parser)
-    
-    # services command
-    services_parser = subparsers.add_parser('services', help='List services')
-    add_common_args(services_parser)
-    services_parser.add_argument('--folder', help='Folder name')
-
-    # service command
-    service_parser = subparsers.add_parser('service', help='Get service details')
-    service_parser.add_argument('service_name', help='Service name')
-    add_common_args(service_parser)
-    service_parser.add_argument('--folder', help='Folder name')
-    
-    # layers command
-    layers_parser = subparsers.add_parser('layers', help='List layers in a service')
-    add_common_args(layers_parser)
-    add_service_args(layers_parser)
-    
-    # layer command
-    layer_parser = subparsers.add_parser('layer', help='Get layer details')
-    add_common_args(layer_parser)
-    add_service_args(layer_parser)
-    add_layer_args(layer_parser)
-    
-    # query command
-    query_parser = subparsers.add_parser('query', help='Query a layer')
-    add_common_args(query_parser)
-    add_service_args(query_parser)
-    add_layer_args(query_parser)
-    query_parser.add_argument('--where', default=DEFAULT_WHERE, help='Where clause')
-    query_parser.add_argument('--text', help='Text search')
-    query_parser.add_argument('--objectIds', help='Object IDs')
-    query_parser.add_argument('--time', help='Time')
-    query_parser.add_argument('--timeRelation', help='Time relation')
-    query_parser.add_argument('--geometry', help='Geometry')
-    query_parser.add_argument('--geometryType', default=DEFAULT_GEOMETRY_TYPE, help='Geometry type')
-    query_parser.add_argument('--inSR', help='Input spatial reference')
-    query_parser.add_argument('--spatialRel', default=DEFAULT_SPATIAL_REL, help='Spatial relationship')
-    query_parser.add_argument('--distance', help='Distance')
-    query_parser.add_argument('--units', default=DEFAULT_UNITS, help='Units')
-    query_parser.add_argument('--relationParam', help='Relation parameter')
-    query_parser.add_argument('--outFields', default='', help='Output fields')
-    query_parser.add_argument('--returnGeometry', default='true', help='Return geometry')
-    query_parser.add_argument('--returnTrueCurves', default='false', help='Return true curves')
-    query_parser.add_argument('--maxAllowableOffset', help='Max allowable offset')
-    query_parser.add_argument('--geometryPrecision', help='Geometry precision')
-    query_parser.add_argument('--outSR', help='Output spatial reference')
-    query_parser.add_argument('--havingClause', help='Having clause')
-    query_parser.add_argument('--returnIdsOnly', default='false', help='Return IDs only')
-    query_parser.add_argument('--returnCountOnly', default='false', help='Return count only')
-    query_parser.add_argument('--orderByFields', help='Order by fields')
-    query_parser.add_argument('--groupByFieldsForStatistics', help='Group by fields for statistics')
-    query_parser.add_argument('--outStatistics', help='Output statistics')
-    query_parser.add_argument('--returnZ', default='false', help='Return Z values')
-    query_parser.add_argument('--returnM', default='false', help='Return M values')
-    query_parser.add_argument('--gdbVersion', help='Geodatabase version')
-    query_parser.add_argument('--historicMoment', help='Historic moment')
-    query_parser.add_argument('--returnDistinctValues', default='false', help='Return distinct values')
-    query_parser.add_argument('--resultOffset', help='Result offset')
-    query_parser.add_argument('--resultRecordCount', help='Records per page')
-    query_parser.add_argument('--returnExtentOnly', default='false', help='Return extent only')
-    query_parser.add_argument('--sqlFormat', help='SQL format')
-    query_parser.add_argument('--datumTransformation', help='Datum transformation')
-    query_parser.add_argument('--parameterValues', help='Parameter values')
-    query_parser.add_argument('--rangeValues', help='Range values')
-    query_parser.add_argument('--quantizationParameters', help='Quantization parameters')
-    query_parser.add_argument('--featureEncoding', default=DEFAULT_ENCODING, help='Feature encoding')
-    query_parser.add_argument('--format', default=DEFAULT_FORMAT, help='Output format (pjson, geojson, kml, or kmz)')
-    
-    args = parser.parse_args()
+    Sets up argument parsing and dispatches to command handlers.
+    """
+    args = build_parser(sys.argv[1:]).parse_args()
     
     # Configure logging based on debug flag
     if args.debug:
@@ -138,7 +340,33 @@ def main():
     else:
         logging.basicConfig(level=logging.WARNING)
     
-    client = EsriClient(args.url)
+    if args.command == 'serve':
+        handle_serve_command(args)
+        return
+    if args.command == 'index' and args.index_command == 'query':
+        handle_index_query_command(args)
+        return
+
+    from requests.exceptions import RequestException, ConnectionError, Timeout, HTTPError
+    if args.command == 'batch':
+        try:
+            load_batch_manifest(args)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        client = get_client_class()(args.url, max_connections=args.connections, cache_metadata=True)
+    elif args.command == 'tiles':
+        client = get_client_class()(args.url, max_connections=args.workers)
+    else:
+        client = get_client_class()(args.url)
+    collector = None
+    if args.stats:
+        from src.esri_client.metrics import MetricsCollector
+        collector = MetricsCollector()
+        client.add_observer(collector)
+    profiler = None
+    if args.profile or args.cprofile or args.trace_memory:
+        profiler = Profiler(cprofile_path=args.cprofile, trace_memory=args.trace_memory).start()
     
     try:
         command_handlers = {
@@ -149,6 +377,13 @@ def main():
             'service': handle_service_command,
             'layer': handle_layer_command,
             'query': handle_query_command,
+            'sync': handle_sync_command,
+            'stats': handle_stats_command,
+            'lookup': handle_lookup_command,
+            'attachments': handle_attachments_command,
+            'tiles': handle_tiles_command,
+            'index': handle_index_command,
+            'batch': handle_batch_command,
         }
         handler = command_handlers.get(args.command)
         if handler:
@@ -168,7 +403,27 @@ def main():
     except Exception as e:
         print(f"Unexpected Error: {e}")
         sys.exit(1)
-        
+    finally:
+        if collector:
+            write_stats(collector.summary(), args.stats)
+        if profiler:
+            profiler.stop()
+            write_stats(profiler.report(), args.profile or '-')
+
+def write_stats(summary, path):
+    """Write a metrics or profiling summary to stderr ('-') or a file.
+
+    Args:
+        summary: Summary dictionary
+        path: Output path, or '-' for stderr
+    """
+    stats_str = json.dumps(summary, indent=2)
+    if path == '-':
+        print(stats_str, file=sys.stderr)
+    else:
+        with open(path, 'w') as f:
+            f.write(stats_str)
+
 def get_service_path(client, folder_name, service_name):
     """Get full service path from folder and service names.
     
@@ -346,18 +601,660 @@ def handle_query_command(args, client):
         print("Error: either --id or --name is required for query command")
         sys.exit(1)
     
-    if args.folder:
-        layer_obj, service_obj = get_layer_from_folder(args, client)
-    else:
-        layer_obj, service_obj = get_layer_from_root(args, client)
+    with phase('catalog'):
+        if args.folder:
+            layer_obj, service_obj = get_layer_from_folder(args, client)
+        else:
+            layer_obj, service_obj = get_layer_from_root(args, client)
     
     if layer_obj:
-        query_params = {k: v for k, v in vars(args).items() if k not in ['command', 'url', 'folder', 'service', 'id', 'name', 'output', 'debug', 'progress'] and v is not None}
-        results = layer_obj.query(progress=args.progress, **query_params)
+        query_params = {k: v for k, v in vars(args).items() if k not in CLI_ONLY_ARGS and v is not None}
+        if args.explain:
+            plan = layer_obj.plan(max_workers=args.workers, strategy=args.strategy, **query_params)
+            output_result(plan.to_dict(), args)
+            return plan.to_dict()
+
+        if args.with_related:
+            return export_with_related(layer_obj, args, query_params)
+        if args.pipeline:
+            return export_with_pipeline(layer_obj, args, query_params)
+
+        cache = None
+        if args.cache_dir:
+            from src.esri_client.cache import QueryCache
+            cache = QueryCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
+        if args.simplify:
+            add_simplification_params(layer_obj, args, query_params)
+        results = layer_obj.query(progress=args.progress, strategy=args.strategy, max_workers=args.workers,
+                                  cache=cache, adaptive=args.adaptive,
+                                  max_memory=int(args.max_memory * 1024 * 1024) if args.max_memory else None,
+                                  spill_dir=args.spill_dir, **query_params)
         
+        if args.simplify:
+            simplify_result(results, args)
+
         # Get display field from layer if available
         display_field = layer_obj.data.get('displayField') if layer_obj else None
         output_result(results, args, display_field)
+        return results
+
+def add_simplification_params(layer_obj, args, query_params):
+    """Ask the server to generalize geometries toward the --simplify vertex budget.
+    
+    Sets maxAllowableOffset (and geometryPrecision) from a sampled estimate
+    unless the user already passed maxAllowableOffset.
+    
+    Args:
+        layer_obj: Layer to query
+        args: Parsed command line arguments
+        query_params: Layer query parameters, updated in place
+    """
+    from src.esri_client.simplify import geometry_precision
+
+    if 'maxAllowableOffset' in query_params:
+        return
+    # The output format is not a query parameter: the sample is always fetched as json
+    sample_params = {k: v for k, v in query_params.items() if k != 'format'}
+    offset = layer_obj.simplification_offset(args.simplify, **sample_params)
+    if offset:
+        query_params['maxAllowableOffset'] = offset
+        query_params.setdefault('geometryPrecision', geometry_precision(offset))
+        print(f"Requesting maxAllowableOffset={offset:.6g} from the server")
+
+def simplify_result(results, args):
+    """Simplify the query result locally to the --simplify vertex budget and report it.
+    
+    Args:
+        results: Query result, updated in place
+        args: Parsed command line arguments
+    """
+    from src.esri_client.simplify import simplify_features
+
+    features = results.get('features')
+    if not isinstance(features, list):
+        print("Skipping local simplification of a spilled result")
+        return
+    report = simplify_features(features, args.simplify)
+    print(f"Simplified geometries: {report['verticesRemoved']} of {report['verticesBefore']} vertices removed, "
+          f"{report['verticesAfter']} remain")
+
+def export_with_pipeline(layer_obj, args, query_params):
+    """Export a query with the pipelined fetch/convert/write engine.
+    
+    Args:
+        layer_obj: Layer to query
+        args: Parsed command line arguments
+        query_params: Layer query parameters
+        
+    Returns:
+        Export summary dictionary
+    """
+    from src.esri_client.pipeline import export_layer
+
+    summary = export_layer(layer_obj, args.output, display_field=layer_obj.data.get('displayField'),
+                           max_workers=args.workers, processes=args.processes, **query_params)
+    if args.format == 'kmz' and args.output:
+        with phase('kmz'):
+            create_kmz(summary['files'], args)
+    if args.output:
+        print(f"Exported {summary['features']} features in {summary['pages']} pages")
+    return summary
+
+def export_with_related(layer_obj, args, query_params):
+    """Stream a query joined with the related records of each feature.
+    
+    Each page of features is joined as soon as it arrives: its objectIds go
+    to Layer.query_related for every --with-related relationship, and the
+    records are added to each feature as ``relatedRecords``, keyed by
+    relationship name.
+    
+    Args:
+        layer_obj: Layer to query
+        args: Parsed command line arguments
+        query_params: Layer query parameters
+        
+    Returns:
+        Export summary dictionary
+    """
+    from src.esri_client.layer import _feature_oid
+    from src.esri_client.pipeline import JsonWriter, render_page
+
+    if args.format in ('kml', 'kmz'):
+        print("Error: --with-related needs pjson, json or geojson output")
+        sys.exit(1)
+    unsupported = [option for option, value in (('--pipeline', args.pipeline), ('--simplify', args.simplify),
+                                                ('--cache-dir', args.cache_dir), ('--max-memory', args.max_memory),
+                                                ('--regionate', args.regionate)) if value]
+    if unsupported:
+        print(f"Error: --with-related cannot be combined with {', '.join(unsupported)}")
+        sys.exit(1)
+    try:
+        relationships = [layer_obj.relationship(r) for r in args.with_related]
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    oid_field = layer_obj.object_id_field
+    fields = query_params.get('outFields')
+    if fields and fields != '*' and oid_field not in fields.split(','):
+        query_params['outFields'] = f"{fields},{oid_field}"
+
+    writer = JsonWriter(args.output)
+    summary = {'features': 0, 'pages': 0, 'relatedRecords': 0}
+    for page in layer_obj.iter_pages(max_workers=args.workers, strategy=args.strategy, **query_params):
+        if not summary['pages']:
+            writer.begin(page)
+        summary['pages'] += 1
+        features = page.get('features', [])
+        object_ids = [_feature_oid(feature, oid_field) for feature in features]
+        for feature in features:
+            feature['relatedRecords'] = {}
+        for relationship in relationships:
+            groups = layer_obj.query_related(relationship['id'], (oid for oid in object_ids if oid is not None),
+                                             out_fields=args.related_fields,
+                                             definition_expression=args.related_where, max_workers=args.workers)
+            records = {group['objectId']: group['relatedRecords'] for group in groups}
+            for feature, oid in zip(features, object_ids):
+                related = [record.get('attributes', record) for record in records.get(oid, [])]
+                feature['relatedRecords'][relationship.get('name', str(relationship['id']))] = related
+                summary['relatedRecords'] += len(related)
+        with phase('json encoding'):
+            rendered = render_page(features, args.format)
+        with phase('file write'):
+            writer.write(rendered)
+        summary['features'] += len(features)
+        if args.progress:
+            print(f"Progress: {summary['features']} features, {summary['relatedRecords']} related records")
+    if not summary['pages']:
+        writer.begin({})
+    writer.close()
+    if args.output:
+        print(f"Exported {summary['features']} features with {summary['relatedRecords']} related records")
+    return summary
+
+def handle_sync_command(args, client):
+    """Handle the sync command to update a local copy of a layer.
+
+    Args:
+        args: Parsed command line arguments
+        client: EsriClient instance
+    """
+    if args.id is None and not args.name:
+        print("Error: either --id or --name is required for sync command")
+        sys.exit(1)
+
+    with phase('catalog'):
+        if args.folder:
+            layer_obj, service_obj = get_layer_from_folder(args, client)
+        else:
+            layer_obj, service_obj = get_layer_from_root(args, client)
+
+    if layer_obj:
+        sync_params = {'outFields': args.outFields} if args.outFields else {}
+        summary = layer_obj.sync(args.db, where=args.where, format=args.format, max_workers=args.workers, **sync_params)
+        output_result(summary, args)
+
+def handle_stats_command(args, client):
+    """Handle the stats command to compute grouped statistics of a layer.
+    
+    Args:
+        args: Parsed command line arguments
+        client: EsriClient instance
+    """
+    if args.id is None and not args.name:
+        print("Error: either --id or --name is required for stats command")
+        sys.exit(1)
+
+    with phase('catalog'):
+        if args.folder:
+            layer_obj, service_obj = get_layer_from_folder(args, client)
+        else:
+            layer_obj, service_obj = get_layer_from_root(args, client)
+    if not layer_obj:
+        return
+
+    group_by = [field.strip() for field in (args.group_by or '').split(',') if field.strip()]
+    try:
+        rows = layer_obj.statistics(args.stat, group_by, where=args.where, having=args.having,
+                                    order_by=args.order_by, local=True if args.local else None,
+                                    max_workers=args.workers)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    output_result(rows, args)
+
+def handle_attachments_command(args, client):
+    """Handle the attachments command to download a layer's attachments.
+    
+    Attachments are written under ``--output`` (default ``attachments``) as
+    ``<objectId>/<attachmentId>_<name>``. Exits with status 1 if any
+    download failed.
+    
+    Args:
+        args: Parsed command line arguments
+        client: EsriClient instance
+    """
+    from src.esri_client.attachments import download_attachments
+
+    if args.id is None and not args.name:
+        print("Error: either --id or --name is required for attachments command")
+        sys.exit(1)
+
+    with phase('catalog'):
+        if args.folder:
+            layer_obj, service_obj = get_layer_from_folder(args, client)
+        else:
+            layer_obj, service_obj = get_layer_from_root(args, client)
+    if not layer_obj:
+        return
+
+    directory = args.output or 'attachments'
+    object_ids = [int(oid) for oid in args.objectIds.split(',') if oid.strip()] if args.objectIds else None
+    try:
+        summary = download_attachments(layer_obj, directory, where=args.where, object_ids=object_ids,
+                                       max_workers=args.workers, verify=args.verify, manifest=args.manifest,
+                                       progress=args.progress)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print(f"Downloaded {summary['downloaded']} of {summary['attachments']} attachments ({summary['bytes']} bytes) "
+          f"to {directory}, skipped {summary['skipped']}, failed {summary['failed']}; "
+          f"manifest: {summary['manifest']}")
+    if summary['failed']:
+        sys.exit(1)
+
+def handle_tiles_command(args, client):
+    """Handle the tiles command to download map tiles into an MBTiles file.
+    
+    Cached services are read from their tile cache, other services are
+    rendered through export. The file (default ``<service>.mbtiles``) is
+    extended if it exists; tiles already in it are skipped. Exits with
+    status 1 if any tile failed.
+    
+    Args:
+        args: Parsed command line arguments
+        client: EsriClient instance
+    """
+    from src.esri_client.tiles import download_tiles
+
+    try:
+        bbox = [float(value) for value in args.bbox.split(',')]
+        if len(bbox) != 4:
+            raise ValueError(f"Invalid bbox '{args.bbox}', expected WEST,SOUTH,EAST,NORTH")
+        with phase('catalog'):
+            service = client.get_service(get_service_path(client, args.folder, args.service))
+        path = args.output or f"{args.service}.mbtiles"
+        summary = download_tiles(service, path, bbox, args.min_zoom, args.max_zoom, max_workers=args.workers,
+                                 export=True if args.export else None, image_format=args.image_format,
+                                 progress=args.progress)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print(f"Downloaded {summary['downloaded']} of {summary['tiles']} tiles ({summary['bytes']} bytes) "
+          f"from the {summary['source']} to {path}, skipped {summary['skipped']}, "
+          f"missing {summary['missing']}, failed {summary['failed']}")
+    if summary['failed']:
+        sys.exit(1)
+
+def handle_lookup_command(args, client):
+    """Handle the lookup command to find the polygon containing each point.
+    
+    Args:
+        args: Parsed command line arguments
+        client: EsriClient instance
+    """
+    from src.esri_client.lookup import lookup_points
+
+    if args.id is None and not args.name:
+        print("Error: either --id or --name is required for lookup command")
+        sys.exit(1)
+
+    columns, rows, valid, points = read_points_csv(args)
+
+    with phase('catalog'):
+        if args.folder:
+            layer_obj, service_obj = get_layer_from_folder(args, client)
+        else:
+            layer_obj, service_obj = get_layer_from_root(args, client)
+    if not layer_obj:
+        return
+
+    matches = lookup_points(layer_obj, points, where=args.where, out_fields=args.outFields, in_sr=args.inSR,
+                            max_points=args.cluster_size, max_workers=args.workers, progress=args.progress)
+    write_point_matches(args, columns, rows, valid, matches)
+
+def read_points_csv(args):
+    """Read the points CSV named by ``args.points``.
+    
+    Coordinates come from ``args.x_field``/``args.y_field`` or the first
+    x/lon/lng/longitude and y/lat/latitude columns. Exits if they are missing.
+    
+    Args:
+        args: Parsed command line arguments
+        
+    Returns:
+        Tuple of (columns, rows, indices of rows with valid coordinates,
+        (x, y) points of those rows)
+    """
+    import csv
+
+    with open(args.points, newline='') as f:
+        reader = csv.DictReader(f)
+        columns = list(reader.fieldnames or [])
+        rows = list(reader)
+    x_field = args.x_field or _find_column(columns, ('x', 'lon', 'lng', 'longitude'))
+    y_field = args.y_field or _find_column(columns, ('y', 'lat', 'latitude'))
+    if x_field not in columns or y_field not in columns:
+        print(f"Error: x and y columns not found in {args.points}, use --x-field and --y-field")
+        sys.exit(1)
+
+    # Rows without valid coordinates are written without a match
+    valid, points = [], []
+    for index, row in enumerate(rows):
+        try:
+            points.append((float(row[x_field]), float(row[y_field])))
+            valid.append(index)
+        except (TypeError, ValueError):
+            continue
+    return columns, rows, valid, points
+
+def write_point_matches(args, columns, rows, valid, matches):
+    """Write the points CSV with each match's fields appended, to ``args.output`` or stdout.
+    
+    Rows without a match get empty fields. Match fields named like an input
+    column are prefixed with ``match_``.
+    
+    Args:
+        args: Parsed command line arguments
+        columns: Input CSV columns
+        rows: Input CSV rows
+        valid: Indices of the rows that were looked up
+        matches: Match attributes (or None) for each looked-up row
+    """
+    import csv
+
+    row_matches = [None] * len(rows)
+    for index, match in zip(valid, matches):
+        row_matches[index] = match
+
+    match_fields = []
+    for match in matches:
+        for field in match or {}:
+            if field not in match_fields:
+                match_fields.append(field)
+    headers = [f"match_{field}" if field in columns else field for field in match_fields]
+
+    with phase('file write'):
+        output = open(args.output, 'w', newline='') if args.output else sys.stdout
+        try:
+            writer = csv.writer(output)
+            writer.writerow(columns + headers)
+            for row, match in zip(rows, row_matches):
+                writer.writerow([row.get(column) for column in columns] +
+                                [(match or {}).get(field) for field in match_fields])
+        finally:
+            if args.output:
+                output.close()
+    if args.output:
+        matched = sum(1 for match in row_matches if match is not None)
+        print(f"Matched {matched} of {len(rows)} points, results saved to {args.output}")
+
+def _find_column(columns, names):
+    """Return the first column whose lowercased name is in names."""
+    return next((column for column in columns if column.lower() in names), None)
+
+def handle_index_command(args, client):
+    """Handle ``index build``: download a layer into an offline spatial index.
+    
+    Args:
+        args: Parsed command line arguments
+        client: EsriClient instance
+    """
+    from src.esri_client.spatial_index import build_index
+
+    if args.id is None and not args.name:
+        print("Error: either --id or --name is required for index build")
+        sys.exit(1)
+
+    with phase('catalog'):
+        if args.folder:
+            layer_obj, service_obj = get_layer_from_folder(args, client)
+        else:
+            layer_obj, service_obj = get_layer_from_root(args, client)
+    if not layer_obj:
+        return
+
+    query_params = {'outFields': args.outFields}
+    if args.outSR:
+        query_params['outSR'] = args.outSR
+    pages = layer_obj.iter_pages(args.where, 'json', args.workers, **query_params)
+    features = (feature for page in pages for feature in page.get('features', []))
+    metadata = {'url': layer_obj.url, 'name': layer_obj.data.get('name'), 'outSR': args.outSR}
+    with phase('index'):
+        summary = build_index(features, args.index, args.node_capacity, metadata)
+    print(f"Indexed {summary['features']} features into {args.index} ({summary['bytes']} bytes)")
+
+def handle_index_query_command(args):
+    """Handle ``index query``: look up points in an offline spatial index.
+    
+    With ``--points`` the CSV is written like the lookup command's output,
+    otherwise the matches for each ``--point`` are printed as JSON. With
+    ``--nearest K`` the K nearest features are matched instead of the
+    containing polygon, with their distance.
+    
+    Args:
+        args: Parsed command line arguments
+    """
+    from src.esri_client.spatial_index import SpatialIndex
+
+    if args.points:
+        columns, rows, valid, points = read_points_csv(args)
+    elif args.point:
+        try:
+            points = [tuple(float(c) for c in point.split(',')) for point in args.point]
+        except ValueError:
+            points = []
+        if not points or any(len(point) != 2 for point in points):
+            print("Error: --point takes X,Y")
+            sys.exit(1)
+    else:
+        print("Error: either --points or --point is required for index query")
+        sys.exit(1)
+
+    try:
+        index = SpatialIndex(args.index)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    with index:
+        if args.nearest:
+            matches = [[dict(index.attributes(feature), distance=distance)
+                        for feature, distance in index.nearest(x, y, args.nearest)] for x, y in points]
+        else:
+            matches = [[index.attributes(feature) for feature in index.containing(x, y)] for x, y in points]
+
+    if args.points:
+        write_point_matches(args, columns, rows, valid, [found[0] if found else None for found in matches])
+    else:
+        output_result([{'point': list(point), 'matches': found} for point, found in zip(points, matches)], args)
+
+def load_batch_manifest(args):
+    """Read a batch manifest and resolve its settings into args.
+    
+    The manifest is a mapping with ``url``, optional ``concurrency``,
+    ``connections`` and ``defaults``, and a ``jobs`` list. Each job takes the
+    ``query`` command's options by name (``service``, ``id``, ``where``,
+    ``format``, ``output`` ...) plus an optional ``name``; ``defaults`` apply
+    to every job. Sets ``args.url``, ``args.concurrency``,
+    ``args.connections`` and ``args.jobs`` (a list of (name, Namespace)).
+    
+    Args:
+        args: Parsed batch command arguments
+        
+    Raises:
+        ValueError: If the manifest or one of its jobs is invalid
+    """
+    with open(args.manifest) as f:
+        if args.manifest.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("PyYAML is required to read YAML manifests; use JSON or install pyyaml")
+            try:
+                manifest = yaml.safe_load(f)
+            except yaml.YAMLError as e:
+                raise ValueError(f"Invalid YAML manifest {args.manifest}: {e}")
+        else:
+            manifest = json.load(f)
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('jobs'), list):
+        raise ValueError(f"Manifest {args.manifest} must be a mapping with a jobs list")
+
+    args.url = args.url or manifest.get('url')
+    if not args.url:
+        raise ValueError("Manifest has no url and --url was not given")
+    args.concurrency = args.concurrency or int(manifest.get('concurrency', DEFAULT_BATCH_CONCURRENCY))
+    args.connections = args.connections or manifest.get('connections') or args.concurrency * DEFAULT_WORKERS
+    defaults = manifest.get('defaults') or {}
+    args.jobs = []
+    for index, job in enumerate(manifest['jobs']):
+        job = {**defaults, **job}
+        name = str(job.pop('name', index))
+        args.jobs.append((name, parse_batch_job(name, job, args.url)))
+
+def parse_batch_job(name, job, url):
+    """Parse one manifest job with the query command's argument parser.
+    
+    Args:
+        name: Job name used in error messages
+        job: Mapping of query option names to values
+        url: Base URL of the ArcGIS server
+        
+    Returns:
+        Namespace of query command arguments
+        
+    Raises:
+        ValueError: If the job's options are invalid
+    """
+    parser = argparse.ArgumentParser(prog=f"batch job {name}", add_help=False)
+    configure_query_parser(parser)
+    argv = ['--url', url]
+    for key, value in job.items():
+        flag = f"--{key.replace('_', '-')}"
+        action = parser._option_string_actions.get(flag)
+        if action is None:
+            raise ValueError(f"Job {name}: unknown option {key}")
+        if action.nargs == 0:
+            if value:
+                argv.append(flag)
+            continue
+        if isinstance(value, bool):
+            value = str(value).lower()
+        elif isinstance(value, list):
+            value = ','.join(str(v) for v in value)
+        argv.extend([flag, str(value)])
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit:
+        raise ValueError(f"Job {name}: invalid options {job}")
+    args.command = 'query'
+    if args.id is None and not args.name:
+        raise ValueError(f"Job {name}: either id or name is required")
+    if not args.output:
+        raise ValueError(f"Job {name}: output is required")
+    return args
+
+def run_batch_job(name, job_args, client):
+    """Run one batch job and return its result record.
+    
+    Args:
+        name: Job name
+        job_args: Parsed query command arguments for the job
+        client: Shared EsriClient instance
+        
+    Returns:
+        Dictionary with the job's name, status, output, features (or the
+        plan of an explain job), seconds and error
+    """
+    started = time.perf_counter()
+    result = {'name': name, 'status': 'ok', 'output': job_args.output}
+    try:
+        results = handle_query_command(job_args, client)
+        if results is None:
+            raise ValueError(f"Layer {job_args.id if job_args.id is not None else job_args.name} "
+                             f"not found in service {job_args.service}")
+        if job_args.explain:
+            result['plan'] = results
+        else:
+            # Streamed exports (--pipeline, --with-related) return a summary with the feature count
+            features = results.get('features') or []
+            result['features'] = features if isinstance(features, int) else len(features)
+    except SystemExit as e:
+        # A handler rejecting the job's options must not end the whole batch
+        logger.debug(f"Batch job {name} exited with status {e.code}")
+        result['status'] = 'error'
+        result['error'] = f"Job exited with status {e.code}"
+    except Exception as e:
+        logger.debug(f"Batch job {name} failed: {e}")
+        result['status'] = 'error'
+        result['error'] = str(e)
+    result['seconds'] = round(time.perf_counter() - started, 4)
+    return result
+
+def handle_batch_command(args, client):
+    """Handle the batch command to run every job in a manifest.
+    
+    Jobs run concurrently up to args.concurrency and share one client, so
+    connections and catalog metadata are reused between them. Exits with
+    status 1 if any job failed.
+    
+    Args:
+        args: Parsed command line arguments with args.jobs loaded
+        client: EsriClient instance shared by all jobs
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda job: run_batch_job(job[0], job[1], client), args.jobs))
+    failed = sum(1 for r in results if r['status'] != 'ok')
+    summary = {
+        'jobs': results,
+        'succeeded': len(results) - failed,
+        'failed': failed,
+        'seconds': round(time.perf_counter() - started, 4),
+    }
+    summary_str = json.dumps(summary, indent=2)
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            f.write(summary_str)
+    else:
+        print(summary_str)
+    if failed:
+        sys.exit(1)
+
+def handle_serve_command(args):
+    """Handle the serve command to run the caching proxy until interrupted.
+    
+    Args:
+        args: Parsed command line arguments
+    """
+    from src.esri_client.proxy import CachingProxy, parse_upstreams
+
+    try:
+        upstreams = parse_upstreams(args.upstream)
+        proxy = CachingProxy(upstreams, host=args.host, port=args.port, ttl=args.ttl,
+                             metadata_ttl=args.metadata_ttl, max_bytes=args.cache_mb * 1024 * 1024,
+                             max_connections=args.connections,
+                             max_entry_bytes=int(args.cache_entry_mb * 1024 * 1024))
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    for name, url in proxy.upstreams.items():
+        print(f"Proxying {url} at {proxy.url_for(name)}")
+    try:
+        proxy.serve_forever()
+    except KeyboardInterrupt:
+        proxy.stop()
+        print(json.dumps(proxy.stats, indent=2))
 
 def get_layer_from_folder(args, client):
     """Get layer object from a folder service.
@@ -433,13 +1330,21 @@ def output_result(data, args, display_field=None):
         display_field: Display field name from service
     """
     # logger.debug(f"Outputting results for {len(data['features'])} features")
+    if getattr(args, 'regionate', None) and args.format == 'kmz' and isinstance(data, dict) and 'features' in data:
+        write_regionated_result(data, args, display_field)
+        return
+    if isinstance(data, dict) and hasattr(data.get('features'), 'iter_pages'):
+        write_streamed_result(data, args, display_field)
+        return
     if hasattr(args, 'format') and args.format in ['kml', 'kmz'] and isinstance(data, dict) and 'features' in data:
         # logger.debug("Outputting as KML")
-        kml_content = convert_json_to_kml(data, display_field)
+        with phase('kml conversion'):
+            kml_content = convert_json_to_kml(data, display_field)
         
         # Count vertices and split if necessary
-        vertex_count = count_kml_vertices(kml_content)
-        if vertex_count > 200000:
+        with phase('vertex counting'):
+            vertex_count = count_kml_vertices(kml_content)
+        if vertex_count > MAX_KML_VERTICES:
             kml_files = split_kml_files(kml_content, data, args, vertex_count, display_field)
         else:
             if args.output:
@@ -447,7 +1352,7 @@ def output_result(data, args, display_field=None):
                 base_name = args.output.rsplit('.', 1)[0]
                 os.makedirs(base_name, exist_ok=True)
                 filename = os.path.join(base_name, os.path.basename(args.output).replace('.kmz', '.kml'))
-                with open(filename, 'w') as f:
+                with phase('file write'), open(filename, 'w') as f:
                     f.write(kml_content)
                 kml_files = [filename]
             else:
@@ -456,127 +1361,65 @@ def output_result(data, args, display_field=None):
         
         # Create KMZ if requested
         if args.format == 'kmz':
-            create_kmz(kml_files, args)
+            with phase('kmz'):
+                create_kmz(kml_files, args)
         return
     
-    json_str = json.dumps(data, indent=2)
+    with phase('json encoding'):
+        json_str = json.dumps(data, indent=2)
     if args.output:
-        with open(args.output, 'w') as f:
+        with phase('file write'), open(args.output, 'w') as f:
             f.write(json_str)
     else:
         print(json_str)
 
-def convert_json_to_kml(json_data, display_field=None):
-    features = json_data.get('features', [])
-    # logger.debug(f"Converting {len(features)} features to KML")
+def write_regionated_result(data, args, display_field=None):
+    """Write a regionated KMZ super-overlay for the query result.
     
-    kml_parts = [
-        '<?xml version="1.0" encoding="UTF-8"?>',
-        '<kml xmlns="http://www.opengis.net/kml/2.2">',
-        '<Document>'
-    ]
-    
-    for feature in features:
-        # logger.debug(f"Processing feature: {feature.get('id')}")
-        placemark = create_kml_placemark(feature, display_field)
-        if placemark:
-            kml_parts.extend(placemark)
-    
-    kml_parts.extend(['</Document>', '</kml>'])
-    return '\n'.join(kml_parts)
-
-def create_kml_placemark(feature, display_field=None):
-    # logger.debug(f"Creating KML placemark for feature: {feature.get('id')}")
-    geom = feature.get('geometry', {})
-    if not geom:
-        # logger.debug("Feature has no geometry")
-        return None
-    props = feature.get('properties', {})
-    
-    name = get_feature_name(props, display_field)
-    # logger.debug(f"Feature name is {name}")
-    description = create_feature_description(props)
-    # logger.debug(f"Feature description is {description}")
-    
-    if geom.get('type') == 'Point':
-        # logger.debug("Feature is a Point")
-        return create_point_placemark(name, description, geom)
-    elif geom.get('type') == 'Polygon':
-        # logger.debug("Feature is a Polygon")
-        return create_polygon_placemark(name, description, geom)
-    
-    return None
-
-def get_feature_name(props, display_field=None):
-    if display_field and display_field in props:
-        return html.escape(str(props[display_field])) if props[display_field] else ''
-    for key, value in props.items():
-        if key.lower() == 'name':
-            return html.escape(str(value)) if value else ''
-    return ''
-
-def create_feature_description(props):
-    table_rows = []
-    for key, value in props.items():
-        if key.lower() != 'name':
-            escaped_key = html.escape(str(key))
-            escaped_value = html.escape(str(value)) if value is not None else ''
-            table_rows.append(f'<tr><td>{escaped_key}</td><td>{escaped_value}</td></tr>')
-    
-    return f'<![CDATA[<table border="1"><tr><th>Attribute</th><th>Value</th></tr>{"".join(table_rows)}</table>]]>'
-
-def create_point_placemark(name, description, geom):
-    coords = geom.get('coordinates', [])
-    if len(coords) >= 2:
-        return [
-            '<Placemark>',
-            f'<name>{name}</name>',
-            f'<description>{description}</description>',
-            '<Point>',
-            f'<coordinates>{coords[0]},{coords[1]}</coordinates>',
-            '</Point>',
-            '</Placemark>'
-        ]
-    return None
-
-def create_polygon_placemark(name, description, geom):
-    coords = geom.get('coordinates', [])
-    if coords and len(coords) > 0:
-        coord_str = ' '.join([f'{coord[0]},{coord[1]},0' for coord in coords[0]])
-        return [
-            '<Placemark>',
-            f'<name>{name}</name>',
-            f'<description>{description}</description>',
-            '<Polygon>',
-            '<outerBoundaryIs>',
-            '<LinearRing>',
-            f'<coordinates>{coord_str}</coordinates>',
-            '</LinearRing>',
-            '</outerBoundaryIs>',
-            '</Polygon>',
-            '</Placemark>'
-        ]
-    return None
-
-def count_kml_vertices(kml_content):
-    """Count vertices in KML content.
-    
-    Args:
-        kml_content: KML content string
-        
-    Returns:
-        int: Number of vertices
+    Args:
+        data: Query result with GeoJSON features
+        args: Parsed command line arguments
+        display_field: Display field name from service
     """
-    import re
-    coord_pattern = r'<coordinates>(.*?)</coordinates>'
-    coord_blocks = re.findall(coord_pattern, kml_content, re.DOTALL)
+    from src.esri_client.regionate import write_regionated_kmz
+
+    kmz_filename = args.output.replace('.kml', '.kmz') if args.output else 'output.kmz'
+    features = data['features']
+    with phase('kmz'):
+        summary = write_regionated_kmz(features if isinstance(features, list) else list(features),
+                                       kmz_filename, display_field, args.regionate)
+    print(f"Created regionated KMZ file: {kmz_filename} with {summary['features']} features "
+          f"in {summary['nodes']} regions")
+
+def write_streamed_result(data, args, display_field=None):
+    """Write a result whose features are a SpillingFeatureList, one page at a time.
     
-    total_vertices = 0
-    for block in coord_blocks:
-        coords = [c.strip() for c in block.split() if c.strip()]
-        total_vertices += len(coords)
+    Produces the same files as output_result (KML split at the vertex limit,
+    KMZ packaging) without materializing the features or the document.
     
-    return total_vertices
+    Args:
+        data: Query result with spilled features
+        args: Parsed command line arguments
+        display_field: Display field name from service
+    """
+    from src.esri_client.pipeline import JsonWriter, KmlWriter, render_page
+
+    features = data['features']
+    is_kml = args.format in ('kml', 'kmz')
+    writer = KmlWriter(args.output) if is_kml else JsonWriter(args.output)
+    writer.begin(data)
+    try:
+        for page in features.iter_pages():
+            with phase('kml conversion' if is_kml else 'json encoding'):
+                rendered = render_page(page, args.format, display_field)
+            with phase('file write'):
+                writer.write(rendered)
+        writer.close()
+    finally:
+        features.close()
+    if args.format == 'kmz' and args.output:
+        with phase('kmz'):
+            create_kmz(writer.files, args)
 
 def split_kml_files(kml_content, data, args, total_vertices, display_field=None):
     """Split KML into multiple files if vertex count exceeds limit.
@@ -603,19 +1446,19 @@ def split_kml_files(kml_content, data, args, total_vertices, display_field=None)
     current_vertices = 0
     file_count = 1
     kml_files = []
+    renderer = PlacemarkRenderer(display_field)
     
     for feature in features:
-        # Convert single feature to KML to count its vertices
-        feature_kml = convert_json_to_kml({'features': [feature]}, display_field)
-        feature_vertices = count_kml_vertices(feature_kml)
+        # Render each feature once; its text is reused when the part is written
+        placemark = renderer.render(feature)
+        feature_vertices = placemark[1] if placemark else 0
         
         # If adding this feature would exceed limit, save current batch
-        if current_vertices + feature_vertices > 200000 and current_features:
-            chunk_data = {'features': current_features}
-            chunk_kml = convert_json_to_kml(chunk_data, display_field)
+        if current_vertices + feature_vertices > MAX_KML_VERTICES and current_features:
+            chunk_kml = '\n'.join(KML_HEADER + [text for text in current_features if text] + KML_FOOTER)
             
             filename = os.path.join(base_name, f"{os.path.basename(base_name)}_part{file_count}.kml")
-            with open(filename, 'w') as f:
+            with phase('file write'), open(filename, 'w') as f:
                 f.write(chunk_kml)
             kml_files.append(filename)
             
@@ -625,16 +1468,15 @@ def split_kml_files(kml_content, data, args, total_vertices, display_field=None)
             current_vertices = 0
             file_count += 1
         
-        current_features.append(feature)
+        current_features.append(placemark[0] if placemark else None)
         current_vertices += feature_vertices
     
     # Save remaining features
     if current_features:
-        chunk_data = {'features': current_features}
-        chunk_kml = convert_json_to_kml(chunk_data, display_field)
+        chunk_kml = '\n'.join(KML_HEADER + [text for text in current_features if text] + KML_FOOTER)
         
         filename = os.path.join(base_name, f"{os.path.basename(base_name)}_part{file_count}.kml")
-        with open(filename, 'w') as f:
+        with phase('file write'), open(filename, 'w') as f:
             f.write(chunk_kml)
         kml_files.append(filename)
         
@@ -691,4 +1533,6 @@ def create_kmz(kml_files, args):
     print(f"Created KMZ file: {kmz_filename}")
 
 if __name__ == '__main__':
+    import multiprocessing
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
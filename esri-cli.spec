@@ -1,12 +1,20 @@
 # -*- mode: python ; coding: utf-8 -*-
+# Set ESRI_CLI_ONEDIR=1 to build an unpacked dist/esri-cli/ directory instead of
+# a one-file executable. The one-dir build starts faster because nothing is
+# extracted to a temporary directory on each run.
+import os
 
+from PyInstaller.utils.hooks import collect_submodules
+
+onedir = os.environ.get('ESRI_CLI_ONEDIR') == '1'
 
 a = Analysis(
     ['cli.py'],
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=[],
+    # src.esri_client loads its modules lazily, so the analysis cannot see them
+    hiddenimports=collect_submodules('src.esri_client'),
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -16,23 +24,51 @@ a = Analysis(
 )
 pyz = PYZ(a.pure)
 
-exe = EXE(
-    pyz,
-    a.scripts,
-    a.binaries,
-    a.datas,
-    [],
-    name='esri-cli',
-    debug=False,
-    bootloader_ignore_signals=False,
-    strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
-    console=True,
-    disable_windowed_traceback=False,
-    argv_emulation=False,
-    target_arch=None,
-    codesign_identity=None,
-    entitlements_file=None,
-)
+if onedir:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        [],
+        exclude_binaries=True,
+        name='esri-cli',
+        debug=False,
+        bootloader_ignore_signals=False,
+        strip=False,
+        upx=True,
+        console=True,
+        disable_windowed_traceback=False,
+        argv_emulation=False,
+        target_arch=None,
+        codesign_identity=None,
+        entitlements_file=None,
+    )
+    coll = COLLECT(
+        exe,
+        a.binaries,
+        a.datas,
+        strip=False,
+        upx=True,
+        upx_exclude=[],
+        name='esri-cli',
+    )
+else:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        a.binaries,
+        a.datas,
+        [],
+        name='esri-cli',
+        debug=False,
+        bootloader_ignore_signals=False,
+        strip=False,
+        upx=True,
+        upx_exclude=[],
+        runtime_tmpdir=None,
+        console=True,
+        disable_windowed_traceback=False,
+        argv_emulation=False,
+        target_arch=None,
+        codesign_identity=None,
+        entitlements_file=None,
+    )
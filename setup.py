@@ -6,7 +6,7 @@ setup(
     package_dir={"": "src"},
     packages=find_packages(where="src"),
     install_requires=["requests>=2.25.0"],
-    extras_require={"test": ["pytest>=6.0.0"]},
+    extras_require={"test": ["pytest>=6.0.0"], "yaml": ["PyYAML>=5.1"]},
     entry_points={
         "console_scripts": [
             "esri-cli=cli:main",
@@ -1,7 +1,34 @@
-from .client import EsriClient
-from .services import Services
-from .folder import Folder
-from .service import Service
-from .layer import Layer
+"""Client for ESRI ArcGIS REST services.
 
-__all__ = ['EsriClient', 'Services', 'Folder', 'Service', 'Layer']
\ No newline at end of file
+Classes are imported from their submodules on first access, so importing the
+package does not pull in requests or sqlite3 until they are used.
+"""
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .client import EsriClient
+    from .services import Services
+    from .folder import Folder
+    from .service import Service
+    from .layer import Layer
+    from .sync import FeatureStore
+
+_EXPORTS = {
+    'EsriClient': 'client',
+    'Services': 'services',
+    'Folder': 'folder',
+    'Service': 'service',
+    'Layer': 'layer',
+    'FeatureStore': 'sync',
+}
+
+__all__ = ['EsriClient', 'Services', 'Folder', 'Service', 'Layer', 'FeatureStore']
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,169 @@
+"""Bulk attachment downloads.
+
+download_attachments walks ``Layer.iter_attachments`` and streams each
+attachment to ``<directory>/<objectId>/<attachmentId>_<name>`` on a bounded
+thread pool: listing stays at most ``2 x max_workers`` attachments ahead of
+the downloads, and each body goes to disk chunk by chunk. Attachments whose
+file is already present are skipped, by size or by the SHA-256 recorded in
+the previous run's manifest, so an interrupted archive download resumes where
+it stopped. The manifest is a JSON Lines file with one entry per attachment;
+entries go to ``<manifest>.part`` as downloads finish and the file replaces
+the manifest at the end, so an interrupted run's entries are read back from
+there.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple, TYPE_CHECKING
+
+from requests.exceptions import RequestException
+
+from .layer import DEFAULT_MAX_WORKERS
+
+if TYPE_CHECKING:
+    from .layer import Layer
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.jsonl'
+VERIFY_MODES = ('size', 'checksum')
+UNSAFE_FILENAME = re.compile(r'[^\w.\-]+')
+
+
+def download_attachments(layer: 'Layer', directory: str, where: str = "1=1",
+                         object_ids: Optional[Iterable[int]] = None, max_workers: int = DEFAULT_MAX_WORKERS,
+                         verify: str = 'size', manifest: Optional[str] = None, progress: bool = False) -> Dict:
+    """Download the attachments of a layer's matching features.
+
+    Args:
+        layer: Layer with attachments
+        directory: Directory to download into
+        where: SQL where clause selecting the features
+        object_ids: Features to download instead of the where clause
+        max_workers: Number of concurrent downloads
+        verify: How to recognise files downloaded before: ``size`` compares
+            the file size with the attachment's, ``checksum`` also compares
+            the file's SHA-256 with the previous manifest
+        manifest: Manifest path (default ``<directory>/manifest.jsonl``)
+        progress: Print progress as attachments complete
+
+    Returns:
+        Dictionary with the number of attachments, downloaded, skipped and
+        failed ones, the bytes downloaded and the manifest path
+
+    Raises:
+        RequestException: If listing the attachments fails
+        ValueError: If verify is unknown or the layer has no attachments
+    """
+    if verify not in VERIFY_MODES:
+        raise ValueError(f"Unknown verify mode '{verify}', expected one of {', '.join(VERIFY_MODES)}")
+    manifest = manifest or os.path.join(directory, MANIFEST_NAME)
+    partial_manifest = f"{manifest}.part"
+    previous = _read_manifest(manifest)
+    os.makedirs(directory, exist_ok=True)
+    if os.path.exists(partial_manifest):
+        # Keep the interrupted run's entries before this run starts a new partial manifest
+        _write_manifest(manifest, previous.values())
+
+    summary = {'attachments': 0, 'downloaded': 0, 'skipped': 0, 'failed': 0, 'bytes': 0, 'manifest': manifest}
+
+    def fetch(attachment: Dict) -> Dict:
+        path = os.path.join(directory, str(attachment['objectId']), attachment_filename(attachment))
+        entry = {k: v for k, v in attachment.items() if k != 'url'}
+        entry['path'] = os.path.relpath(path, directory)
+        known = previous.get((attachment['objectId'], attachment['id']))
+        if _is_current(path, attachment, known, verify):
+            return dict(entry, status='skipped', sha256=(known or {}).get('sha256'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            result = layer.client._download(attachment['url'], path)
+        except RequestException as e:
+            logger.warning(f"Attachment {attachment['id']} of feature {attachment['objectId']} failed: {e}")
+            return dict(entry, status='failed', error=str(e))
+        return dict(entry, status='downloaded', sha256=result['sha256'], bytes=result['bytes'])
+
+    # Line buffered, so the entries survive a run that is killed
+    with open(partial_manifest, 'w', buffering=1) as out, ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending: 'deque[Future]' = deque()
+
+        def record(entry: Dict):
+            out.write(json.dumps(entry) + '\n')
+            summary['attachments'] += 1
+            summary[entry['status']] += 1
+            summary['bytes'] += entry.get('bytes', 0)
+            if progress:
+                print(f"Progress: {summary['attachments']} attachments, {summary['downloaded']} downloaded, "
+                      f"{summary['skipped']} skipped, {summary['failed']} failed")
+
+        try:
+            for attachment in layer.iter_attachments(where, object_ids):
+                pending.append(pool.submit(fetch, attachment))
+                if len(pending) >= 2 * max_workers:
+                    record(pending.popleft().result())
+            while pending:
+                record(pending.popleft().result())
+        finally:
+            for future in pending:
+                future.cancel()
+    os.replace(partial_manifest, manifest)
+    logger.debug(f"Attachments: {summary}")
+    return summary
+
+
+def attachment_filename(attachment: Dict) -> str:
+    """File name for an attachment: its id and its name with unsafe characters replaced."""
+    name = UNSAFE_FILENAME.sub('_', os.path.basename(str(attachment.get('name') or ''))).strip('._')
+    return f"{attachment['id']}_{name}" if name else str(attachment['id'])
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _is_current(path: str, attachment: Dict, known: Optional[Dict], verify: str) -> bool:
+    """Whether the file at path already holds the attachment."""
+    if not os.path.exists(path):
+        return False
+    size = attachment.get('size')
+    if size is not None and os.path.getsize(path) != size:
+        return False
+    if verify == 'size':
+        return size is not None
+    return bool(known and known.get('sha256')) and file_sha256(path) == known['sha256']
+
+
+def _read_manifest(path: str) -> Dict[Tuple, Dict]:
+    """Load a previous manifest keyed by (objectId, attachment id).
+
+    Entries of an interrupted run's ``<path>.part`` file take precedence over
+    the manifest's.
+    """
+    entries = {}
+    for manifest in (path, f"{path}.part"):
+        if not os.path.exists(manifest):
+            continue
+        with open(manifest) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by the interruption
+                    continue
+                entries[(entry.get('objectId'), entry.get('id'))] = entry
+    return entries
+
+
+def _write_manifest(path: str, entries: Iterable[Dict]):
+    """Atomically replace the manifest at path with entries."""
+    with open(f"{path}.tmp", 'w') as out:
+        for entry in entries:
+            out.write(json.dumps(entry) + '\n')
+    os.replace(f"{path}.tmp", path)
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class QueryCache:
+    """On-disk cache of query results, validated against a layer's lastEditDate.
+
+    Each entry is one JSON file named after a hash of the layer URL and the
+    normalized query parameters. An entry is only served while the layer's
+    ``editingInfo.lastEditDate`` matches the one it was stored with, and the
+    least recently used entries are evicted once the directory grows past
+    ``max_bytes``.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, url: str, params: Dict) -> str:
+        """Return the cache key for a query URL and its parameters."""
+        normalized = {k: str(v).strip() for k, v in params.items() if v is not None and str(v).strip() != ''}
+        payload = json.dumps({'url': url.rstrip('/'), 'params': normalized}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str, last_edit_date: int) -> Optional[Dict]:
+        """Return a cached result, or None if missing or stale."""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('lastEditDate') != last_edit_date:
+            logger.debug(f"Cache entry {key} is stale")
+            _remove(path)
+            return None
+        # Refresh the mtime so eviction treats this entry as recently used;
+        # another process sharing the directory may have evicted it already
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        logger.debug(f"Cache hit for {key}")
+        return entry['result']
+
+    def put(self, key: str, last_edit_date: int, result: Dict):
+        """Store a result and evict old entries if over budget."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'lastEditDate': last_edit_date, 'result': result}, f)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            _remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    # Removed by another process sharing the directory
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            _remove(os.path.join(self.directory, name))
+            total -= size
+            logger.debug(f"Evicted cache entry {name}")
+
+
+def _remove(path: str):
+    """Remove a file that another process sharing the cache may have removed first."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -1,29 +1,74 @@
 import requests
 import logging
-from typing import Dict, TYPE_CHECKING
-from requests.exceptions import RequestException, HTTPError, ConnectionError, Timeout
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional, TYPE_CHECKING
+from requests.exceptions import RequestException, HTTPError, ConnectionError, Timeout, ChunkedEncodingError
+from .profiling import phase
 
 if TYPE_CHECKING:
     from .services import Services
     from .folder import Folder
     from .service import Service
     from .layer import Layer
+    from .metrics import RequestMetric
 
 logger = logging.getLogger(__name__)
 
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
 
 class EsriClient:
-    def __init__(self, base_url: str):
+    def __init__(self, base_url: str, max_connections: Optional[int] = None, cache_metadata: bool = False):
+        """Create a client for an ArcGIS server.
+
+        Args:
+            base_url: Base URL of the ArcGIS server
+            max_connections: Size of the HTTP connection pool; requests block
+                while all connections are in use, which caps concurrent
+                requests across every thread sharing the client
+            cache_metadata: Keep catalog, service and layer metadata for the
+                life of the client instead of fetching it on every lookup
+        """
         self.base_url = base_url.rstrip('/')
         self.session = requests.Session()
         self.session.timeout = 30
+        if max_connections:
+            adapter = requests.adapters.HTTPAdapter(pool_connections=max_connections,
+                                                    pool_maxsize=max_connections, pool_block=True)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+        self.observers = []
+        self.metadata_cache = {} if cache_metadata else None
+        self._metadata_lock = threading.Lock()
+
+    def add_observer(self, observer: Callable[['RequestMetric'], None]):
+        """Register a callable that receives a RequestMetric after every request.
+
+        Args:
+            observer: Callable taking a RequestMetric, e.g. a MetricsCollector
+        """
+        self.observers.append(observer)
+
+    def remove_observer(self, observer: Callable[['RequestMetric'], None]):
+        self.observers.remove(observer)
 
-    def _get_json(self, url: str, params: Dict = None) -> Dict:
+    def _notify(self, metric: 'RequestMetric'):
+        for observer in self.observers:
+            try:
+                observer(metric)
+            except Exception as e:
+                logger.debug(f"Request observer failed: {e}")
+
+    def _get_json(self, url: str, params: Dict = None, metric: Optional['RequestMetric'] = None) -> Dict:
         """Make HTTP request with comprehensive error handling and retries.
         
         Args:
             url: URL to request
             params: Query parameters
+            metric: RequestMetric to fill in for this request; one is created
+                automatically when observers are registered
             
         Returns:
             JSON response as dictionary
@@ -36,30 +81,93 @@ class EsriClient:
         params = params or {}
         if 'f' not in params:
             params['f'] = 'pjson'
-        
+
+        def read(response: requests.Response, metric: Optional['RequestMetric']) -> Dict:
+            # Check if response is valid JSON
+            try:
+                if metric:
+                    decode_started = time.perf_counter()
+                with phase('decode'):
+                    json_data = response.json()
+                if metric:
+                    metric.decode_time = time.perf_counter() - decode_started
+            except ValueError as e:
+                raise RequestException(f"Invalid JSON response from {url}: {e}")
+
+            # Check for ESRI-specific errors
+            _raise_esri_error(json_data)
+            if metric:
+                metric.features = len(json_data.get('features') or [])
+            return json_data
+
+        return self._request(url, params, read, metric)
+
+    def _request(self, url: str, params: Optional[Dict], read: Callable, metric: Optional['RequestMetric'] = None,
+                 missing_ok: bool = False, **kwargs):
+        """Send a GET request with retries and hand the response to read.
+
+        Connection errors, timeouts and server errors are retried; the
+        request's RequestMetric is filled in and passed to the observers.
+
+        Args:
+            url: URL to request
+            params: Query parameters
+            read: Called with the response and the metric (or None) to turn
+                the response into the result; it may raise RequestException
+            metric: RequestMetric to fill in for this request; one is created
+                automatically when observers are registered
+            missing_ok: Return None instead of raising if the server answers 404
+            **kwargs: Additional arguments for ``session.get``, such as ``stream``
+
+        Returns:
+            The result of read
+
+        Raises:
+            ConnectionError: Network connection issues
+            HTTPError: HTTP status errors
+            RequestException: Other request-related errors
+        """
+        if metric is None and self.observers:
+            from .metrics import RequestMetric, classify_url
+            metric = RequestMetric(url, classify_url(url, params or {}))
+        if metric:
+            started = time.perf_counter()
+        try:
+            return self._request_with_retries(url, params, read, metric, missing_ok, kwargs)
+        except RequestException as e:
+            if metric:
+                metric.error = str(e)
+            raise
+        finally:
+            if metric:
+                metric.latency = time.perf_counter() - started
+                self._notify(metric)
+
+    def _request_with_retries(self, url: str, params: Optional[Dict], read: Callable,
+                              metric: Optional['RequestMetric'], missing_ok: bool, kwargs: Dict):
         max_retries = 3
         for attempt in range(max_retries):
+            if metric:
+                metric.retries = attempt
             try:
-                response = self.session.get(url, params=params, timeout=30)
-                logger.debug(f"Request URL: {response.url}")
-                logger.debug(f"Response status: {response.status_code}")
-                response.raise_for_status()
-                
-                # Check if response is valid JSON
+                response = self.session.get(url, params=params, timeout=30, **kwargs)
                 try:
-                    json_data = response.json()
-                except ValueError as e:
-                    raise RequestException(f"Invalid JSON response from {url}: {e}")
-                
-                # Check for ESRI-specific errors
-                if 'error' in json_data:
-                    error_info = json_data['error']
-                    error_msg = error_info.get('message', 'Unknown ESRI error')
-                    raise RequestException(f"ESRI API error: {error_msg}")
-                
-                return json_data
-                
-            except (ConnectionError, Timeout) as e:
+                    logger.debug(f"Request URL: {response.url}")
+                    logger.debug(f"Response status: {response.status_code}")
+                    if metric:
+                        metric.status = response.status_code
+                        metric.ttfb = response.elapsed.total_seconds()
+                        if not kwargs.get('stream'):
+                            metric.bytes = len(response.content)
+                    if missing_ok and response.status_code == 404:
+                        return None
+                    response.raise_for_status()
+                    return read(response, metric)
+                finally:
+                    if kwargs.get('stream'):
+                        response.close()
+
+            except (ConnectionError, Timeout, ChunkedEncodingError) as e:
                 if attempt < max_retries - 1:
                     logger.debug(f"Attempt {attempt + 1} failed, retrying: {e}")
                     continue
@@ -81,26 +189,135 @@ class EsriClient:
             except RequestException as e:
                 raise RequestException(f"Request failed for {url}: {e}")
 
+    def _download(self, url: str, path: str, params: Dict = None, chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> Dict:
+        """Stream a response body to a file with retries, hashing it on the way.
+
+        The body is written to ``<path>.part`` chunk by chunk and renamed to
+        path once complete, so an interrupted download never leaves a
+        truncated file at path.
+
+        Args:
+            url: URL to download
+            path: Destination file
+            params: Query parameters
+            chunk_size: Bytes read and written at a time
+
+        Returns:
+            Dictionary with the number of bytes written and their SHA-256
+
+        Raises:
+            ConnectionError: Network connection issues
+            HTTPError: HTTP status errors
+            RequestException: Other request-related errors
+        """
+        import hashlib
+        import os
+
+        partial = f"{path}.part"
+
+        def write(response: requests.Response, metric: Optional['RequestMetric']) -> Dict:
+            if response.headers.get('Content-Type', '').startswith('application/json'):
+                # ArcGIS reports errors on attachment URLs as JSON with status 200
+                try:
+                    _raise_esri_error(response.json())
+                except ValueError:
+                    pass
+            digest = hashlib.sha256()
+            size = 0
+            try:
+                with open(partial, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size):
+                        f.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+                os.replace(partial, path)
+            finally:
+                if os.path.exists(partial):
+                    os.remove(partial)
+            if metric:
+                metric.bytes = size
+            return {'bytes': size, 'sha256': digest.hexdigest()}
+
+        return self._request(url, params, write, stream=True)
+
+    def _get_bytes(self, url: str, params: Dict = None) -> Optional[bytes]:
+        """Fetch a binary response body, such as a map tile or exported image, with retries.
+
+        Args:
+            url: URL to request
+            params: Query parameters
+
+        Returns:
+            The response body, or None if the server has no such resource (404)
+
+        Raises:
+            ConnectionError: Network connection issues
+            HTTPError: HTTP status errors
+            RequestException: Other request-related errors
+        """
+        def read(response: requests.Response, metric: Optional['RequestMetric']) -> Optional[bytes]:
+            if response.headers.get('Content-Type', '').startswith('application/json'):
+                # ArcGIS reports errors on image endpoints as JSON with status 200
+                try:
+                    body = response.json()
+                except ValueError:
+                    body = None
+                if isinstance(body, dict) and isinstance(body.get('error'), dict) \
+                        and body['error'].get('code') == 404:
+                    return None
+                _raise_esri_error(body)
+            return response.content
+
+        return self._request(url, params, read, missing_ok=True)
+
+    def _get_metadata(self, url: str) -> Dict:
+        if self.metadata_cache is None:
+            return self._get_json(url)
+        # The lock only guards the cache itself: the first lookup of a URL
+        # fetches it outside the lock, and concurrent lookups of the same URL
+        # wait for its Future instead of repeating the request
+        with self._metadata_lock:
+            future = self.metadata_cache.get(url)
+            owner = future is None
+            if owner:
+                future = self.metadata_cache[url] = Future()
+        if owner:
+            try:
+                future.set_result(self._get_json(url))
+            except BaseException as e:
+                with self._metadata_lock:
+                    # Let a later lookup retry instead of caching the failure
+                    del self.metadata_cache[url]
+                future.set_exception(e)
+        return future.result()
+
     def get_services(self) -> 'Services':
         from .services import Services
         url = f"{self.base_url}/rest/services"
-        data = self._get_json(url)
+        data = self._get_metadata(url)
         return Services(data, self)
 
     def get_folder(self, folder_name: str) -> 'Folder':
         from .folder import Folder
         url = f"{self.base_url}/rest/services/{folder_name}"
-        data = self._get_json(url)
+        data = self._get_metadata(url)
         return Folder(data, self, folder_name)
 
     def get_service(self, service_path: str) -> 'Service':
         from .service import Service
         url = f"{self.base_url}/rest/services/{service_path}"
-        data = self._get_json(url)
+        data = self._get_metadata(url)
         return Service(data, self, service_path)
 
     def get_layer(self, service_path: str, layer_id: int) -> 'Layer':
         from .layer import Layer
         url = f"{self.base_url}/rest/services/{service_path}/{layer_id}"
-        data = self._get_json(url)
-        return Layer(data, self, service_path, layer_id)
\ No newline at end of file
+        data = self._get_metadata(url)
+        return Layer(data, self, service_path, layer_id)
+
+
+def _raise_esri_error(body):
+    """Raise the error ArcGIS reports in a JSON body with status 200, if any."""
+    if isinstance(body, dict) and isinstance(body.get('error'), dict):
+        message = body['error'].get('message', 'Unknown ESRI error')
+        raise RequestException(f"ESRI API error: {message}")
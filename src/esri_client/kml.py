@@ -0,0 +1,272 @@
+"""KML rendering for GeoJSON features.
+
+Used by the CLI's kml/kmz output and by the export pipeline, whose worker
+processes render pages of features with render_placemarks.
+
+The create_* functions render one feature from scratch. PlacemarkRenderer
+produces the same text but compiles each property schema (the ordered
+property keys) once: the name field and the escaped attribute cells are
+worked out for the first feature of a schema and reused for the rest, and
+vertices are counted from the geometry instead of re-parsing the output.
+
+All GeoJSON geometry types are rendered: Polygons with their holes, and
+Multi* geometries and GeometryCollections as a KML MultiGeometry.
+"""
+import html
+import re
+from typing import Dict, List, Optional, Tuple
+
+MAX_KML_VERTICES = 200000
+COORDINATES = re.compile(r'<coordinates>(.*?)</coordinates>', re.DOTALL)
+
+KML_HEADER = [
+    '<?xml version="1.0" encoding="UTF-8"?>',
+    '<kml xmlns="http://www.opengis.net/kml/2.2">',
+    '<Document>'
+]
+KML_FOOTER = ['</Document>', '</kml>']
+
+
+DESCRIPTION_HEAD = '<![CDATA[<table border="1"><tr><th>Attribute</th><th>Value</th></tr>'
+DESCRIPTION_TAIL = '</table>]]>'
+
+
+def convert_json_to_kml(json_data, display_field=None):
+    features = json_data.get('features', [])
+    # logger.debug(f"Converting {len(features)} features to KML")
+    
+    kml_parts = list(KML_HEADER)
+    renderer = PlacemarkRenderer(display_field)
+    
+    for feature in features:
+        # logger.debug(f"Processing feature: {feature.get('id')}")
+        placemark = renderer.render(feature)
+        if placemark:
+            kml_parts.append(placemark[0])
+    
+    kml_parts.extend(KML_FOOTER)
+    return '\n'.join(kml_parts)
+
+def create_kml_placemark(feature, display_field=None):
+    # logger.debug(f"Creating KML placemark for feature: {feature.get('id')}")
+    geom = feature.get('geometry', {})
+    if not geom:
+        # logger.debug("Feature has no geometry")
+        return None
+    props = feature.get('properties', {})
+    
+    name = get_feature_name(props, display_field)
+    # logger.debug(f"Feature name is {name}")
+    description = create_feature_description(props)
+    # logger.debug(f"Feature description is {description}")
+    
+    if geom.get('type') == 'Point':
+        # logger.debug("Feature is a Point")
+        return create_point_placemark(name, description, geom)
+    elif geom.get('type') == 'Polygon':
+        # logger.debug("Feature is a Polygon")
+        return create_polygon_placemark(name, description, geom)
+    
+    geometry = geometry_kml(geom)
+    if geometry:
+        return ['<Placemark>', f'<name>{name}</name>', f'<description>{description}</description>',
+                geometry[0], '</Placemark>']
+    return None
+
+def get_feature_name(props, display_field=None):
+    if display_field and display_field in props:
+        return html.escape(str(props[display_field])) if props[display_field] else ''
+    for key, value in props.items():
+        if key.lower() == 'name':
+            return html.escape(str(value)) if value else ''
+    return ''
+
+def create_feature_description(props):
+    table_rows = []
+    for key, value in props.items():
+        if key.lower() != 'name':
+            escaped_key = html.escape(str(key))
+            escaped_value = html.escape(str(value)) if value is not None else ''
+            table_rows.append(f'<tr><td>{escaped_key}</td><td>{escaped_value}</td></tr>')
+    
+    return f'{DESCRIPTION_HEAD}{"".join(table_rows)}{DESCRIPTION_TAIL}'
+
+def create_point_placemark(name, description, geom):
+    coords = geom.get('coordinates', [])
+    if len(coords) >= 2:
+        return [
+            '<Placemark>',
+            f'<name>{name}</name>',
+            f'<description>{description}</description>',
+            '<Point>',
+            f'<coordinates>{coords[0]},{coords[1]}</coordinates>',
+            '</Point>',
+            '</Placemark>'
+        ]
+    return None
+
+def create_polygon_placemark(name, description, geom):
+    coords = geom.get('coordinates', [])
+    if coords and len(coords) > 0:
+        polygon = []
+        _append_polygon(polygon, coords)
+        return [
+            '<Placemark>',
+            f'<name>{name}</name>',
+            f'<description>{description}</description>',
+            *polygon,
+            '</Placemark>'
+        ]
+    return None
+
+def geometry_kml(geom) -> Optional[Tuple[str, int]]:
+    """Render a GeoJSON geometry as a KML geometry element.
+    
+    Points, LineStrings and Polygons (with holes) map to their KML elements;
+    MultiPoint, MultiLineString, MultiPolygon and GeometryCollection become a
+    MultiGeometry of their members. Empty members are skipped.
+    
+    Args:
+        geom: GeoJSON geometry
+        
+    Returns:
+        Tuple of (KML text, vertex count), or None if nothing can be drawn
+    """
+    parts: List[str] = []
+    vertices = _append_geometry(parts, geom)
+    if not parts:
+        return None
+    return '\n'.join(parts), vertices
+
+def format_ring(ring):
+    """Format a ring as KML coordinates (``x,y,0`` separated by spaces)."""
+    if not ring:
+        return ''
+    # One join over "x,y" pairs; the shared ",0 " separator is written by join
+    return ',0 '.join([f'{coord[0]},{coord[1]}' for coord in ring]) + ',0'
+
+def _append_geometry(parts: List[str], geom) -> int:
+    """Append the KML lines of a geometry to parts and return its vertex count."""
+    geometry_type = geom.get('type')
+    if geometry_type == 'GeometryCollection':
+        return _append_multi(parts, geom.get('geometries') or [], _append_geometry)
+    coords = geom.get('coordinates') or []
+    if geometry_type in MULTI_GEOMETRIES:
+        return _append_multi(parts, coords, MULTI_GEOMETRIES[geometry_type])
+    append = SINGLE_GEOMETRIES.get(geometry_type)
+    return append(parts, coords) if append else 0
+
+def _append_multi(parts: List[str], members, append) -> int:
+    start = len(parts)
+    parts.append('<MultiGeometry>')
+    vertices = sum(append(parts, member) for member in members)
+    if len(parts) == start + 1:
+        del parts[start:]
+        return 0
+    parts.append('</MultiGeometry>')
+    return vertices
+
+def _append_point(parts: List[str], coords) -> int:
+    if len(coords) < 2:
+        return 0
+    parts.extend(['<Point>', f'<coordinates>{coords[0]},{coords[1]}</coordinates>', '</Point>'])
+    return 1
+
+def _append_line(parts: List[str], coords) -> int:
+    if len(coords) < 2:
+        return 0
+    parts.extend(['<LineString>', f'<coordinates>{format_ring(coords)}</coordinates>', '</LineString>'])
+    return len(coords)
+
+def _append_polygon(parts: List[str], rings) -> int:
+    if not rings:
+        return 0
+    parts.extend(['<Polygon>', '<outerBoundaryIs>', '<LinearRing>', f'<coordinates>{format_ring(rings[0])}</coordinates>',
+                  '</LinearRing>', '</outerBoundaryIs>'])
+    for hole in rings[1:]:
+        parts.extend(['<innerBoundaryIs>', '<LinearRing>', f'<coordinates>{format_ring(hole)}</coordinates>',
+                      '</LinearRing>', '</innerBoundaryIs>'])
+    parts.append('</Polygon>')
+    return sum(len(ring) for ring in rings)
+
+SINGLE_GEOMETRIES = {'Point': _append_point, 'LineString': _append_line, 'Polygon': _append_polygon}
+MULTI_GEOMETRIES = {'MultiPoint': _append_point, 'MultiLineString': _append_line, 'MultiPolygon': _append_polygon}
+
+def count_kml_vertices(kml_content):
+    """Count vertices in KML content.
+    
+    Args:
+        kml_content: KML content string
+        
+    Returns:
+        int: Number of vertices
+    """
+    coord_blocks = COORDINATES.findall(kml_content)
+    
+    total_vertices = 0
+    for block in coord_blocks:
+        coords = [c.strip() for c in block.split() if c.strip()]
+        total_vertices += len(coords)
+    
+    return total_vertices
+
+def render_placemarks(features: List[Dict], display_field=None) -> List[Tuple[str, int]]:
+    """Render features as KML placemarks with their vertex counts.
+    
+    Features without a supported geometry are skipped, as in convert_json_to_kml.
+    
+    Args:
+        features: GeoJSON features
+        display_field: Display field name from service
+        
+    Returns:
+        List of (placemark text, vertex count) tuples
+    """
+    renderer = PlacemarkRenderer(display_field)
+    return [placemark for placemark in map(renderer.render, features) if placemark]
+
+
+class PlacemarkRenderer:
+    """Renders features as placemark text, compiling each property schema once.
+    
+    Output is identical to joining create_kml_placemark's lines with newlines.
+    
+    Args:
+        display_field: Display field name from service
+    """
+
+    def __init__(self, display_field=None):
+        self.display_field = display_field
+        self.schemas: Dict[Tuple, Tuple[Optional[str], List[Tuple[str, str]]]] = {}
+
+    def compile(self, keys: Tuple) -> Tuple[Optional[str], List[Tuple[str, str]]]:
+        """Return the name key and the (key, escaped row prefix) cells for a property schema."""
+        schema = self.schemas.get(keys)
+        if schema is None:
+            if self.display_field and self.display_field in keys:
+                name_key = self.display_field
+            else:
+                name_key = next((key for key in keys if key.lower() == 'name'), None)
+            cells = [(key, f'<tr><td>{html.escape(str(key))}</td><td>') for key in keys if key.lower() != 'name']
+            schema = self.schemas[keys] = (name_key, cells)
+        return schema
+
+    def render(self, feature: Dict) -> Optional[Tuple[str, int]]:
+        """Render one feature as (placemark text, vertex count), or None without a supported geometry."""
+        geom = feature.get('geometry', {})
+        if not geom:
+            return None
+        geometry = geometry_kml(geom)
+        if geometry is None:
+            return None
+
+        props = feature.get('properties', {})
+        name_key, cells = self.compile(tuple(props))
+        name = props[name_key] if name_key is not None else None
+        escape = html.escape
+        rows = ''.join([f'{prefix}{escape(str(props[key])) if props[key] is not None else ""}</td></tr>'
+                        for key, prefix in cells])
+        head = (f'<Placemark>\n<name>{escape(str(name)) if name else ""}</name>\n'
+                f'<description>{DESCRIPTION_HEAD}{rows}{DESCRIPTION_TAIL}</description>\n')
+
+        return f'{head}{geometry[0]}\n</Placemark>', geometry[1]
@@ -1,12 +1,32 @@
+import json
 import logging
-from typing import Dict, TYPE_CHECKING
+import time
+from collections import deque
+from datetime import datetime, timezone
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union, TYPE_CHECKING
 from requests.exceptions import RequestException
+from .profiling import phase
 
 if TYPE_CHECKING:
+    from .cache import QueryCache
     from .client import EsriClient
+    from .planner import QueryPlan
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_MAX_RECORD_COUNT = 1000
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_TILE_GRID = 2
+MAX_TILE_DEPTH = 10
+MIN_TIME_WINDOW_MS = 1000
+OBJECT_ID_CHUNK_SIZE = 500
+SIMPLIFY_SAMPLE_SIZE = 500
+ATTACHMENT_CHUNK_SIZE = 100
+QUERY_STRATEGIES = ('offset', 'objectids', 'tiles', 'time', 'auto')
+
+
 class Layer:
     def __init__(self, data: Dict, client: 'EsriClient', service_path: str, layer_id: int):
         self.data = data
@@ -15,75 +35,1100 @@ class Layer:
         self.id = layer_id
         self.name = data.get('name', '')
 
-    def query(self, where: str = "1=1", format: str = "pjson", progress: bool = False, **kwargs) -> Dict:
+    @property
+    def url(self) -> str:
+        return f"{self.client.base_url}/rest/services/{self.service_path}/{self.id}"
+
+    @property
+    def max_record_count(self) -> int:
+        return int(self.data.get('maxRecordCount') or DEFAULT_MAX_RECORD_COUNT)
+
+    @property
+    def object_id_field(self) -> str:
+        """Name of the layer's OBJECTID field, falling back to ``OBJECTID``."""
+        if self.data.get('objectIdField'):
+            return self.data['objectIdField']
+        for field in self.data.get('fields') or []:
+            if field.get('type') == 'esriFieldTypeOID':
+                return field['name']
+        return 'OBJECTID'
+
+    def query(self, where: str = "1=1", format: str = "pjson", progress: bool = False,
+              strategy: str = "offset", max_workers: int = DEFAULT_MAX_WORKERS,
+              cache: Optional['QueryCache'] = None, adaptive: bool = False, max_memory: Optional[int] = None,
+              spill_dir: Optional[str] = None, **kwargs) -> Dict:
         """Query the layer with error handling.
         
         Args:
             where: SQL where clause
             format: Output format (pjson, geojson, kml)
+            progress: Print progress while paging
+            strategy: How to retrieve features: ``offset`` pages through the
+                result with resultOffset, ``objectids`` fetches the ids from
+                a returnIdsOnly query in chunks, ``tiles`` splits the layer
+                extent into a quadtree of tiles small enough to fetch in one
+                request, ``time`` splits the layer's time extent into windows
+                and ``auto`` lets plan() choose from the layer's capabilities
+            max_workers: Number of concurrent requests
+            cache: Optional QueryCache; results are reused while the layer's
+                ``editingInfo.lastEditDate`` is unchanged
+            adaptive: With offset paging, tune the page size during the run
+                from response times, sizes and failures, and retry failed
+                pages split in halves
+            max_memory: Approximate memory budget in bytes for the features;
+                pages beyond it spill to a temporary file and ``features``
+                is a SpillingFeatureList to iterate instead of a list. The
+                query is run page by page with iter_pages; the cache and
+                adaptive paging are not used
+            spill_dir: Directory for the spill file
             **kwargs: Additional query parameters
-            
+        
         Returns:
             Query results as dictionary
-            
+        
         Raises:
             RequestException: If query fails
+            ValueError: If the strategy is unknown or cannot be used
         """
-        url = f"{self.client.base_url}/rest/services/{self.service_path}/{self.id}/query"
-        
+        if strategy not in QUERY_STRATEGIES:
+            raise ValueError(f"Unknown query strategy '{strategy}', expected one of {', '.join(QUERY_STRATEGIES)}")
+
+        url = f"{self.url}/query"
+        params = self._query_params(where, format, kwargs)
+        if params.get('outStatistics'):
+            # Statistics come back as one row per group: there is nothing to count or page through
+            params.pop('resultRecordCount', None)
+            return self._statistics_query(url, params)
+
+        if max_memory is not None:
+            if cache is not None or adaptive:
+                logger.warning("The query cache and adaptive paging are not used with a memory budget")
+            return self._query_spilling(where, format, strategy, max_workers, max_memory, spill_dir, progress,
+                                        kwargs)
+
+        last_edit_date = (self.data.get('editingInfo') or {}).get('lastEditDate')
+        if cache is not None and last_edit_date is None:
+            logger.debug(f"Layer {self.id} has no lastEditDate, skipping the query cache")
+            cache = None
+        if cache is not None:
+            cache_key = cache.key(url, dict(params, strategy=strategy))
+            cached = cache.get(cache_key, last_edit_date)
+            if cached is not None:
+                print(f"Total features: {len(cached.get('features', []))} (cached)")
+                return cached
+
+        total_count = None
+        paginate = 'resultOffset' not in kwargs
+        if strategy == 'auto':
+            plan = self.plan(where, format, max_workers, **kwargs)
+            logger.debug(f"Query plan: {plan.to_dict()}")
+            strategy, max_workers, total_count = plan.strategy, plan.concurrency, plan.estimated_count
+            params['f'] = plan.format
+            if paginate:
+                params['resultRecordCount'] = plan.page_size
+
+        response = self._run_query(url, params, paginate, progress, strategy, max_workers, total_count, adaptive)
+        if cache is not None:
+            cache.put(cache_key, last_edit_date, response)
+        return response
+
+    def _query_spilling(self, where: str, format: str, strategy: str, max_workers: int, max_memory: int,
+                        spill_dir: Optional[str], progress: bool, kwargs: Dict) -> Dict:
+        """Collect the query's pages into a SpillingFeatureList."""
+        from .spill import SpillingFeatureList
+
+        features = SpillingFeatureList(max_memory, spill_dir)
+        response = {}
+        for page in self.iter_pages(where, format, max_workers, strategy=strategy, **kwargs):
+            features.extend(page.pop('features', []))
+            response = response or page
+            if progress:
+                print(f"Progress: {len(features)} features")
+        response.pop('exceededTransferLimit', None)
+        response['features'] = features
+        print(f"Total features: {len(features)}" + (f" ({features.spilled_bytes} bytes spilled to disk)"
+                                                    if features.spilled else ""))
+        return response
+
+    def plan(self, where: str = "1=1", format: str = "pjson", max_workers: int = DEFAULT_MAX_WORKERS,
+             strategy: str = "auto", **kwargs) -> 'QueryPlan':
+        """Choose how to run a query from the layer's capabilities and a count probe.
+
+        Args:
+            where: SQL where clause
+            format: Output format (pjson, geojson, kml)
+            max_workers: Upper bound on concurrent requests
+            strategy: Strategy to use instead of the planned one (see query)
+            **kwargs: Additional query parameters
+
+        Returns:
+            QueryPlan with the strategy, page size, encoding, concurrency
+            and estimated number of requests
+
+        Raises:
+            RequestException: If the count query fails
+            ValueError: If the strategy is unknown
+        """
+        from .planner import plan_query
+
+        if strategy not in QUERY_STRATEGIES:
+            raise ValueError(f"Unknown query strategy '{strategy}', expected one of {', '.join(QUERY_STRATEGIES)}")
+        params = self._query_params(where, format, kwargs)
+        try:
+            total_count = self._count(f"{self.url}/query", params)
+        except RequestException as e:
+            raise RequestException(f"Layer query failed for layer {self.id}: {e}")
+        page_size = params['resultRecordCount'] if 'resultRecordCount' in kwargs else None
+        plan = plan_query(self.data, total_count, format, max_workers, page_size)
+        if strategy != 'auto' and strategy != plan.strategy:
+            plan.reasons.append(f"strategy {strategy} requested instead of the planned {plan.strategy}")
+            plan.strategy = strategy
+        return plan
+
+    def iter_pages(self, where: str = "1=1", format: str = "pjson", max_workers: int = DEFAULT_MAX_WORKERS,
+                   prefetch: Optional[int] = None, strategy: str = "auto", **kwargs) -> Iterator[Dict]:
+        """Yield the query result page by page, in order, while later pages download.
+
+        Pages are fetched by up to ``max_workers`` threads, and no more than
+        ``prefetch`` pages are requested ahead of the consumer, so a slow
+        consumer holds back the downloads and memory stays bounded. The
+        strategy comes from plan(); strategies that cannot be streamed in
+        order (tiles, time windows) are run to completion and then yielded
+        in pages.
+
+        Args:
+            where: SQL where clause
+            format: Output format (pjson, geojson, kml)
+            max_workers: Number of concurrent requests
+            prefetch: Pages fetched ahead of the consumer (default 2 x max_workers)
+            strategy: Strategy to use instead of the planned one (see query)
+            **kwargs: Additional query parameters
+
+        Yields:
+            Query responses, each holding one page of features
+
+        Raises:
+            ValueError: If the strategy is unknown
+            RequestException: If a request fails
+        """
+        url = f"{self.url}/query"
+        plan = self.plan(where, format, max_workers, strategy, **kwargs)
+        params = self._query_params(where, format, kwargs)
+        params['f'] = plan.format
+        prefetch = prefetch or 2 * max_workers
+
+        try:
+            if 'resultOffset' in kwargs:
+                yield self.client._get_json(url, params)
+            elif plan.strategy == 'offset':
+                params['resultRecordCount'] = page_size = plan.page_size
+                count = plan.estimated_count or 0
+                offsets = range(0, max(count, 1), page_size)
+                page = {}
+                for page in self._prefetch_pages(url, (dict(params, resultOffset=o) for o in offsets),
+                                                 max_workers, prefetch):
+                    yield page
+                offset = offsets[-1] + page_size
+                # The count was stale; continue one page at a time until a short page
+                while len(page.get('features', [])) >= page_size:
+                    page = self.client._get_json(url, dict(params, resultOffset=offset))
+                    yield page
+                    offset += page_size
+            elif plan.strategy == 'objectids':
+                id_params = {k: v for k, v in params.items()
+                             if k not in ('f', 'resultOffset', 'resultRecordCount', 'outFields', 'returnCountOnly')}
+                object_ids = sorted(self.object_ids(**id_params))
+                fetch_params = {k: v for k, v in params.items() if k not in ('where', 'resultRecordCount')}
+                chunks = (object_ids[i:i + plan.page_size] for i in range(0, len(object_ids), plan.page_size))
+                yield from self._prefetch_pages(
+                    url, (dict(fetch_params, objectIds=','.join(str(oid) for oid in chunk)) for chunk in chunks),
+                    max_workers, prefetch)
+            else:
+                response = self._run_query(url, params, True, False, plan.strategy, max_workers,
+                                           plan.estimated_count)
+                features = response.pop('features', [])
+                for start in range(0, max(len(features), 1), plan.page_size):
+                    yield dict(response, features=features[start:start + plan.page_size])
+        except RequestException as e:
+            raise RequestException(f"Layer query failed for layer {self.id}: {e}")
+
+    def _prefetch_pages(self, url: str, page_params: Iterable[Dict], max_workers: int,
+                        prefetch: int) -> Iterator[Dict]:
+        """Fetch pages concurrently with at most ``prefetch`` outstanding, yielding them in order."""
+        page_params = iter(page_params)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            window = deque()
+            try:
+                for params in page_params:
+                    window.append(pool.submit(self.client._get_json, url, params))
+                    if len(window) >= prefetch:
+                        yield window.popleft().result()
+                while window:
+                    yield window.popleft().result()
+            finally:
+                for future in window:
+                    future.cancel()
+
+    def simplification_offset(self, max_vertices: int, where: str = "1=1", **kwargs) -> Optional[float]:
+        """Estimate a server-side ``maxAllowableOffset`` that fits a query into a vertex budget.
+
+        One page is fetched at full detail and the Douglas-Peucker tolerance
+        that fits that page into its share of the budget is returned, so the
+        server can drop vertices before they are downloaded.
+
+        Args:
+            max_vertices: Vertex budget for the whole query result
+            where: SQL where clause
+            **kwargs: Additional query parameters
+
+        Returns:
+            Offset in the layer's units, or None for point layers or when the
+            sample already fits the budget
+
+        Raises:
+            RequestException: If the sample query fails
+        """
+        from .simplify import simplify_features
+
+        if self.data.get('geometryType') not in ('esriGeometryPolygon', 'esriGeometryPolyline'):
+            return None
+        url = f"{self.url}/query"
+        params = self._query_params(where, 'json', kwargs)
+        params.pop('resultOffset', None)
+        params['resultRecordCount'] = min(self.max_record_count, SIMPLIFY_SAMPLE_SIZE)
+        try:
+            total_count = self._count(url, params)
+            sample = self.client._get_json(url, params).get('features', [])
+        except RequestException as e:
+            raise RequestException(f"Layer query failed for layer {self.id}: {e}")
+        if not sample:
+            return None
+        budget = int(max_vertices * len(sample) / max(total_count, len(sample)))
+        return simplify_features(sample, budget)['tolerance']
+
+    def _query_params(self, where: str, format: str, kwargs: Dict) -> Dict:
         # Handle KML/KMZ format by querying with geojson
         query_format = 'geojson' if format in ['kml', 'kmz'] else format
         
         # Set defaults
-        params = {'where': where, 'f': query_format, 'resultRecordCount': 100, **kwargs}
+        params = {'where': where, 'f': query_format, 'resultRecordCount': DEFAULT_PAGE_SIZE, **kwargs}
         
         # Convert string parameters to integers where needed
         if 'resultRecordCount' in params and isinstance(params['resultRecordCount'], str):
             params['resultRecordCount'] = int(params['resultRecordCount'])
         if 'resultOffset' in params and isinstance(params['resultOffset'], str):
             params['resultOffset'] = int(params['resultOffset'])
-        
+        return params
+
+    def _run_query(self, url: str, params: Dict, paginate: bool, progress: bool, strategy: str,
+                   max_workers: int, total_count: Optional[int] = None, adaptive: bool = False) -> Dict:
+        """Run a query with the given strategy and return the combined response."""
         try:
+            if strategy in ('tiles', 'time', 'objectids'):
+                query_partitions = {
+                    'tiles': self._query_tiles,
+                    'time': self._query_time_windows,
+                    'objectids': self._query_by_object_ids,
+                }[strategy]
+                with phase('pagination'):
+                    return query_partitions(url, params, progress, max_workers)
+
             # Get total count first
-            count_params = params.copy()
-            count_params['returnCountOnly'] = 'true'
-            count_response = self.client._get_json(url, count_params)
-            total_count = count_response.get('count', 0)
+            if total_count is None:
+                total_count = self._count(url, params)
             print(f"Total features: {total_count}")
             
             # Only paginate if resultOffset is not provided by the user
-            if 'resultOffset' not in kwargs:
-                all_features = []
-                offset = 0
-                
-                while True:
-                    params['resultOffset'] = offset
+            with phase('pagination'):
+                if paginate and adaptive:
+                    response = self._fetch_adaptive_pages(url, params, total_count, progress, max_workers)
+                elif paginate:
+                    response = self._fetch_offset_pages(url, params, total_count, progress, max_workers)
+                else:
+                    # Single page request
                     response = self.client._get_json(url, params)
-                    
+            
+            return response
+            
+        except RequestException as e:
+            raise RequestException(f"Layer query failed for layer {self.id}: {e}")
+
+    def _fetch_offset_pages(self, url: str, params: Dict, total_count: int, progress: bool,
+                            max_workers: int) -> Dict:
+        """Page through a query with resultOffset.
+
+        Pages known from the count are requested concurrently; if the last
+        of them comes back full (the count was stale) paging continues one
+        page at a time until a short page is returned.
+        """
+        page_size = params['resultRecordCount']
+        all_features = []
+        if max_workers > 1:
+            offsets = list(range(0, max(total_count, 1), page_size))
+        else:
+            offsets = [0]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while True:
+                page_params = [dict(params, resultOffset=offset) for offset in offsets]
+                for response in pool.map(lambda p: self.client._get_json(url, p), page_params):
                     features = response.get('features', [])
                     logger.debug(f"Query returned {len(features)} features")
                     all_features.extend(features)
-                    
+
                     if progress:
                         percent = (len(all_features) / total_count) * 100 if total_count > 0 else 0
                         print(f"Progress: {len(all_features)}/{total_count} ({percent:.1f}%)")
-                    
-                    logger.debug(f"Total features: {len(all_features)}")
-                    
-                    # Break if we got fewer records than requested
-                    if len(features) < params['resultRecordCount']:
-                        logger.debug("Reached last page")
+
+                logger.debug(f"Total features: {len(all_features)}")
+
+                # Break if we got fewer records than requested
+                if len(features) < page_size:
+                    logger.debug("Reached last page")
+                    break
+
+                offsets = [offsets[-1] + page_size]
+
+        # Return combined response
+        response['features'] = all_features
+        return response
+
+    def _fetch_adaptive_pages(self, url: str, params: Dict, total_count: int, progress: bool,
+                              max_workers: int) -> Dict:
+        """Page through a query with resultOffset, adapting the page size as it goes.
+
+        Each new page uses the current size from an AdaptivePageSize. A page
+        that fails is split in halves which are retried first; a page the
+        server truncated below the requested size has its remainder fetched
+        and caps the page size. Paging ends at the first short page.
+        """
+        from concurrent.futures import FIRST_COMPLETED, wait
+        from .metrics import RequestMetric
+        from .paging import AdaptivePageSize
+
+        sizer = AdaptivePageSize(params['resultRecordCount'], self.max_record_count)
+        pages = {}
+        retries = []
+        next_offset = 0
+        end = None
+        fetched = 0
+        response = {}
+
+        def fetch(offset: int, size: int) -> Tuple[Dict, RequestMetric]:
+            metric = RequestMetric(url, 'page')
+            page_params = dict(params, resultOffset=offset, resultRecordCount=size)
+            return self.client._get_json(url, page_params, metric), metric
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending = {}
+            while True:
+                while len(pending) < max_workers:
+                    if retries:
+                        offset, size = retries.pop(0)
+                    elif end is None and (next_offset < total_count or not pending):
+                        offset, size = next_offset, sizer.size
+                        next_offset += size
+                    else:
                         break
-                        
-                    offset += params['resultRecordCount']
-                
-                # Return combined response
-                response['features'] = all_features
-            else:
-                # Single page request
-                response = self.client._get_json(url, params)
-            
-            return response
-            
+                    pending[pool.submit(fetch, offset, size)] = (offset, size)
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    offset, size = pending.pop(future)
+                    try:
+                        page, metric = future.result()
+                    except RequestException as e:
+                        if size <= 1:
+                            raise
+                        logger.debug(f"Page of {size} at offset {offset} failed, splitting: {e}")
+                        sizer.failed(size)
+                        half = size // 2
+                        retries[:0] = [(offset, half), (offset + half, size - half)]
+                        continue
+
+                    features = page.get('features', [])
+                    pages[offset] = features
+                    response = page
+                    if len(features) < size:
+                        truncated = page.get('exceededTransferLimit') or \
+                            (page.get('properties') or {}).get('exceededTransferLimit')
+                        if truncated and features:
+                            sizer.cap(len(features))
+                            retries.insert(0, (offset + len(features), size - len(features)))
+                        elif end is None or offset + len(features) < end:
+                            end = offset + len(features)
+                    sizer.record(size, len(features), metric.latency, metric.bytes)
+
+                    fetched += len(features)
+                    if progress:
+                        percent = (fetched / total_count) * 100 if total_count > 0 else 0
+                        print(f"Progress: {fetched}/{total_count} ({percent:.1f}%) page size {sizer.size}")
+
+        logger.debug(f"Adaptive page sizes: {sizer.history}")
+        response['features'] = [feature for offset in sorted(pages) for feature in pages[offset]]
+        return response
+
+    def _query_by_object_ids(self, url: str, params: Dict, progress: bool, max_workers: int) -> Dict:
+        """Fetch every matching feature by OBJECTID for servers without pagination."""
+        id_params = {k: v for k, v in params.items()
+                     if k not in ('f', 'resultOffset', 'resultRecordCount', 'outFields', 'returnCountOnly')}
+        object_ids = sorted(self.object_ids(**id_params))
+        print(f"Total features: {len(object_ids)}")
+
+        fetch_params = {k: v for k, v in params.items() if k not in ('where', 'resultOffset', 'resultRecordCount')}
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            features = self._query_object_ids(pool, object_ids, fetch_params, progress)
+
+        response = {'type': 'FeatureCollection'} if params['f'] == 'geojson' else {}
+        response['features'] = features
+        return response
+
+    def object_ids(self, where: str = "1=1", **kwargs) -> List[int]:
+        """Return the OBJECTIDs matching a where clause with one returnIdsOnly request."""
+        params = {'where': where, **kwargs, 'returnIdsOnly': 'true'}
+        try:
+            response = self.client._get_json(f"{self.url}/query", params)
+        except RequestException as e:
+            raise RequestException(f"Object id query failed for layer {self.id}: {e}")
+        return response.get('objectIds') or []
+
+    def iter_attachments(self, where: str = "1=1", object_ids: Optional[Iterable[int]] = None,
+                         chunk_size: int = ATTACHMENT_CHUNK_SIZE) -> Iterator[Dict]:
+        """Yield the attachments of the matching features.
+
+        Features are listed with queryAttachments, ``chunk_size`` objectIds
+        per request; servers without queryAttachments are asked feature by
+        feature.
+
+        Args:
+            where: SQL where clause selecting the features
+            object_ids: Features to list instead of the where clause
+            chunk_size: objectIds per queryAttachments request
+
+        Yields:
+            Dictionaries with objectId, id, name, contentType, size and the
+            attachment's url
+
+        Raises:
+            RequestException: If a request fails
+            ValueError: If the layer has no attachments
+        """
+        if not self.data.get('hasAttachments'):
+            raise ValueError(f"Layer {self.id} has no attachments")
+        ids = sorted(object_ids) if object_ids is not None else sorted(self.object_ids(where))
+        capabilities = self.data.get('advancedQueryCapabilities') or {}
+        batched = capabilities.get('supportsQueryAttachments', self.data.get('supportsQueryAttachments'))
+        try:
+            for start in range(0, len(ids), chunk_size if batched else 1):
+                chunk = ids[start:start + chunk_size] if batched else ids[start:start + 1]
+                if batched:
+                    response = self.client._get_json(f"{self.url}/queryAttachments",
+                                                     {'objectIds': ','.join(str(oid) for oid in chunk), 'f': 'json'})
+                    groups = response.get('attachmentGroups') or []
+                else:
+                    response = self.client._get_json(f"{self.url}/{chunk[0]}/attachments", {'f': 'json'})
+                    groups = [{'parentObjectId': chunk[0], 'attachmentInfos': response.get('attachmentInfos') or []}]
+                for group in groups:
+                    object_id = group.get('parentObjectId')
+                    for info in group.get('attachmentInfos') or []:
+                        yield {'objectId': object_id, 'id': info.get('id'), 'name': info.get('name'),
+                               'contentType': info.get('contentType'), 'size': info.get('size'),
+                               'url': f"{self.url}/{object_id}/attachments/{info.get('id')}"}
         except RequestException as e:
-            raise RequestException(f"Layer query failed for layer {self.id}: {e}")
\ No newline at end of file
+            raise RequestException(f"Attachment query failed for layer {self.id}: {e}")
+
+    def relationship(self, relationship: Union[int, str]) -> Dict:
+        """Return a relationship from the layer's ``relationships`` metadata by id or name.
+
+        Raises:
+            ValueError: If the layer has no such relationship
+        """
+        for candidate in self.data.get('relationships') or []:
+            if str(candidate.get('id')) == str(relationship) or candidate.get('name') == relationship:
+                return candidate
+        names = ', '.join(f"{r.get('id')} ({r.get('name')})" for r in self.data.get('relationships') or [])
+        raise ValueError(f"Layer {self.id} has no relationship '{relationship}'"
+                         f"{f', expected one of {names}' if names else ''}")
+
+    def query_related(self, relationship_id: Union[int, str], object_ids: Iterable[int], out_fields: str = "*",
+                      definition_expression: Optional[str] = None, return_geometry: bool = False,
+                      max_workers: int = DEFAULT_MAX_WORKERS, chunk_size: int = OBJECT_ID_CHUNK_SIZE,
+                      **kwargs) -> Iterator[Dict]:
+        """Yield the related records of features, in the order of object_ids.
+
+        objectIds are sent to queryRelatedRecords ``chunk_size`` at a time and
+        up to ``max_workers`` chunks run concurrently, at most two per worker
+        ahead of the consumer. object_ids is read lazily, so it can itself be
+        a stream. A chunk whose related records exceed the related table's
+        maxRecordCount is split in halves, and later chunks shrink to the
+        size that fit; a single feature's records are paged with resultOffset
+        when the server supports it.
+
+        Args:
+            relationship_id: Relationship id or name from the layer metadata
+            object_ids: Features whose related records to fetch
+            out_fields: Related table fields to return
+            definition_expression: SQL where clause applied to the related records
+            return_geometry: Return the related features' geometries
+            max_workers: Number of concurrent requests
+            chunk_size: Largest number of objectIds per request
+            **kwargs: Additional queryRelatedRecords parameters
+
+        Yields:
+            One dictionary per object id with objectId and its relatedRecords
+            (empty when it has none)
+
+        Raises:
+            RequestException: If a request fails
+            ValueError: If the layer has no such relationship
+        """
+        relationship = self.relationship(relationship_id)
+        url = f"{self.url}/queryRelatedRecords"
+        params = {'relationshipId': relationship['id'], 'outFields': out_fields,
+                  'returnGeometry': 'true' if return_geometry else 'false', 'f': 'json', **kwargs}
+        if definition_expression:
+            params['definitionExpression'] = definition_expression
+        capabilities = self.data.get('advancedQueryCapabilities') or {}
+        paginated = capabilities.get('supportsQueryRelatedPagination', False)
+        limit = [max(chunk_size, 1)]
+
+        def fetch(chunk: List[int]) -> Dict[int, List[Dict]]:
+            response = self.client._get_json(url, dict(params, objectIds=','.join(str(oid) for oid in chunk)))
+            if response.get('exceededTransferLimit'):
+                if len(chunk) > 1:
+                    half = len(chunk) // 2
+                    limit[0] = min(limit[0], half)
+                    return {**fetch(chunk[:half]), **fetch(chunk[half:])}
+                if paginated:
+                    return {chunk[0]: self._related_pages(url, dict(params, objectIds=chunk[0]), response)}
+                logger.warning(f"Related records of feature {chunk[0]} exceed maxRecordCount, "
+                               f"results may be incomplete")
+            return {group.get('objectId'): group.get('relatedRecords') or []
+                    for group in response.get('relatedRecordGroups') or []}
+
+        def chunks() -> Iterator[List[int]]:
+            ids = iter(object_ids)
+            seen = set()
+            while True:
+                chunk = []
+                for oid in ids:
+                    if oid not in seen:
+                        seen.add(oid)
+                        chunk.append(oid)
+                        if len(chunk) >= limit[0]:
+                            break
+                if not chunk:
+                    return
+                yield chunk
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                window: 'deque[Tuple[List[int], Future]]' = deque()
+                try:
+                    for chunk in chunks():
+                        window.append((chunk, pool.submit(fetch, chunk)))
+                        while len(window) >= 2 * max_workers:
+                            yield from self._related_groups(*window.popleft())
+                    while window:
+                        yield from self._related_groups(*window.popleft())
+                finally:
+                    for _, future in window:
+                        future.cancel()
+        except RequestException as e:
+            raise RequestException(f"Related records query failed for layer {self.id}: {e}")
+        if limit[0] < chunk_size:
+            logger.debug(f"Related record chunks shrank from {chunk_size} to {limit[0]} objectIds")
+
+    @staticmethod
+    def _related_groups(chunk: List[int], future: Future) -> Iterator[Dict]:
+        records = future.result()
+        for oid in chunk:
+            yield {'objectId': oid, 'relatedRecords': records.get(oid, [])}
+
+    def _related_pages(self, url: str, params: Dict, first: Dict) -> List[Dict]:
+        """Page through one feature's related records with resultOffset."""
+        records = [record for group in first.get('relatedRecordGroups') or []
+                   for record in group.get('relatedRecords') or []]
+        page = first
+        while page.get('exceededTransferLimit') and records:
+            page = self.client._get_json(url, dict(params, resultOffset=len(records)))
+            page_records = [record for group in page.get('relatedRecordGroups') or []
+                            for record in group.get('relatedRecords') or []]
+            if not page_records:
+                break
+            records.extend(page_records)
+        return records
+
+    @property
+    def supports_statistics(self) -> bool:
+        capabilities = self.data.get('advancedQueryCapabilities') or {}
+        return bool(capabilities.get('supportsStatistics', self.data.get('supportsStatistics')))
+
+    def statistics(self, statistics: Iterable, group_by: Optional[Iterable[str]] = None, where: str = "1=1",
+                   having: Optional[str] = None, order_by: Optional[str] = None, local: Optional[bool] = None,
+                   max_workers: int = DEFAULT_MAX_WORKERS, **kwargs) -> List[Dict]:
+        """Compute grouped statistics, on the server when it supports them.
+
+        Args:
+            statistics: outStatistics entries or ``type:field[:name]`` specs
+                (count, sum, min, max, avg, stddev, var)
+            group_by: Fields to group by
+            where: SQL where clause
+            having: SQL having clause (server-side only)
+            order_by: ``FIELD [ASC|DESC], ...`` ordering of the rows
+            local: Aggregate locally from streamed features instead of
+                sending outStatistics; by default only when the layer does
+                not advertise supportsStatistics
+            max_workers: Number of concurrent requests when aggregating locally
+            **kwargs: Additional query parameters
+
+        Returns:
+            One dictionary per group with the group fields and statistics
+
+        Raises:
+            RequestException: If a query fails
+            ValueError: If a statistic is invalid, or a having clause is
+                used with local aggregation
+        """
+        from .statistics import StatisticsAggregator, statistic_definition
+
+        definitions = [statistic_definition(statistic) for statistic in statistics]
+        if not definitions:
+            raise ValueError("At least one statistic is required")
+        group_by = list(group_by or [])
+        if local is None:
+            local = not self.supports_statistics
+        if not local:
+            params = {'where': where, 'f': 'json', 'outStatistics': json.dumps(definitions), **kwargs}
+            if group_by:
+                params['groupByFieldsForStatistics'] = ','.join(group_by)
+            if having:
+                params['havingClause'] = having
+            if order_by:
+                params['orderByFields'] = order_by
+            response = self._statistics_query(f"{self.url}/query", params)
+            return [feature.get('attributes') or {} for feature in response.get('features', [])]
+
+        if having:
+            raise ValueError("A having clause needs server-side statistics")
+        logger.debug(f"Aggregating statistics locally for layer {self.id}")
+        fields = sorted(set(group_by) | {definition['onStatisticField'] for definition in definitions})
+        aggregator = StatisticsAggregator(definitions, group_by)
+        with phase('aggregation'):
+            for page in self.iter_pages(where, 'json', max_workers, outFields=','.join(fields),
+                                        returnGeometry='false', **kwargs):
+                aggregator.extend(page.get('features', []))
+        return aggregator.rows(order_by)
+
+    def _statistics_query(self, url: str, params: Dict) -> Dict:
+        """Run an outStatistics query, following resultOffset while the server reports more groups."""
+        response = None
+        offset = int(params.get('resultOffset') or 0)
+        try:
+            while True:
+                page = self.client._get_json(url, dict(params, resultOffset=offset) if offset else params)
+                if response is None:
+                    response = page
+                else:
+                    response['features'].extend(page.get('features', []))
+                features = page.get('features', [])
+                if not page.get('exceededTransferLimit') or not features or 'resultOffset' in params:
+                    break
+                offset += len(features)
+        except RequestException as e:
+            raise RequestException(f"Statistics query failed for layer {self.id}: {e}")
+        response.pop('exceededTransferLimit', None)
+        return response
+
+    def sync(self, path: str, where: str = "1=1", format: str = "geojson",
+             max_workers: int = DEFAULT_MAX_WORKERS, **kwargs) -> Dict:
+        """Bring a local SQLite copy of the layer up to date.
+
+        Deleted features are found by diffing a ``returnIdsOnly`` query
+        against the local ids, and new ones are fetched by OBJECTID. When
+        the layer tracks edits (``editFieldsInfo.editDateField``), features
+        edited since the stored watermark are fetched as well; without edit
+        tracking only inserts and deletes can be detected. Each where clause
+        is synced as its own copy, so syncs with different filters into the
+        same file do not delete each other's features.
+
+        Args:
+            path: SQLite database file
+            where: SQL where clause limiting the synced features
+            format: Stored feature format (geojson or pjson)
+            max_workers: Number of concurrent requests
+            **kwargs: Additional query parameters (e.g. outFields, outSR)
+
+        Returns:
+            Summary with inserted, updated, deleted and total counts
+
+        Raises:
+            RequestException: If a query fails
+        """
+        from .sync import FeatureStore
+
+        oid_field = self.object_id_field
+        edit_field = (self.data.get('editFieldsInfo') or {}).get('editDateField')
+        params = {'f': format, **kwargs}
+        params['outFields'] = _with_field(params.get('outFields') or '*', oid_field)
+        if edit_field:
+            params['outFields'] = _with_field(params['outFields'], edit_field)
+
+        # Copies synced with different where clauses are kept apart
+        key = self.url if where == "1=1" else f"{self.url}?where={where}"
+        with FeatureStore(path) as store:
+            local_ids = store.object_ids(key)
+            watermark = store.get_watermark(key)
+            remote_ids = set(self.object_ids(where))
+
+            deleted = store.delete(key, local_ids - remote_ids)
+            fetch_ids = remote_ids - local_ids
+            if edit_field and watermark is not None:
+                changed_where = f"({where}) AND {edit_field} > {_sql_timestamp(watermark)}"
+                changed_ids = set(self.object_ids(changed_where)) - fetch_ids
+                logger.debug(f"{len(changed_ids)} features edited since {watermark}")
+                fetch_ids |= changed_ids
+
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                features = self._query_object_ids(pool, sorted(fetch_ids), params)
+            if edit_field:
+                # Servers comparing at coarser precision return the last edits again; skip unchanged ones
+                local_dates = store.edit_dates(key)
+                features = [f for f in features if _feature_oid(f, oid_field) not in local_dates or
+                            (f.get('attributes') or f.get('properties') or {}).get(edit_field)
+                            != local_dates[_feature_oid(f, oid_field)]]
+            store.upsert(key, features, oid_field, edit_field)
+
+            fetched_ids = {_feature_oid(feature, oid_field) for feature in features}
+            if edit_field:
+                edit_dates = [d for d in ((f.get('attributes') or f.get('properties') or {}).get(edit_field)
+                                          for f in features) if d is not None]
+                watermark = max(edit_dates + ([watermark] if watermark is not None else []), default=None)
+            store.set_watermark(key, watermark, format)
+
+            summary = {
+                'inserted': len(fetched_ids - local_ids),
+                'updated': len(fetched_ids & local_ids),
+                'deleted': deleted,
+                'total': store.count(key),
+                'watermark': watermark,
+            }
+        logger.debug(f"Sync summary: {summary}")
+        return summary
+
+    def _query_object_ids(self, pool: ThreadPoolExecutor, object_ids: List[int], params: Dict,
+                          progress: bool = False) -> List[Dict]:
+        """Fetch features by OBJECTID in concurrent chunks, in id order."""
+        url = f"{self.url}/query"
+        chunk_size = min(self.max_record_count, OBJECT_ID_CHUNK_SIZE)
+        chunks = [object_ids[i:i + chunk_size] for i in range(0, len(object_ids), chunk_size)]
+
+        def fetch(chunk):
+            chunk_params = dict(params)
+            chunk_params['objectIds'] = ','.join(str(oid) for oid in chunk)
+            return self.client._get_json(url, chunk_params).get('features', [])
+
+        features = []
+        try:
+            for chunk_features in pool.map(fetch, chunks):
+                features.extend(chunk_features)
+                if progress:
+                    print(f"Progress: {len(features)}/{len(object_ids)}")
+        except RequestException as e:
+            raise RequestException(f"Object id fetch failed for layer {self.id}: {e}")
+        return features
+
+    def _query_tiles(self, url: str, params: Dict, progress: bool, max_workers: int) -> Dict:
+        """Fetch features tile by tile over the layer extent.
+
+        The extent (or an envelope passed as ``geometry``) is cut into a
+        grid, and any tile whose ``returnCountOnly`` probe exceeds the
+        server's maxRecordCount is split into quadrants until every tile
+        fits in a single request. Features straddling tile edges are
+        returned by each tile they touch and are de-duplicated by OBJECTID.
+
+        Args:
+            url: Layer query URL
+            params: Base query parameters
+            progress: Print progress as tiles complete
+            max_workers: Number of concurrent requests
+
+        Returns:
+            Combined query response
+        """
+        root, spatial_reference = self._tile_root(params)
+        oid_field = self.object_id_field
+        base_params = {k: v for k, v in params.items()
+                       if k not in ('resultOffset', 'resultRecordCount', 'geometry', 'geometryType', 'inSR')}
+        base_params['outFields'] = _with_field(base_params.get('outFields'), oid_field)
+        base_params.setdefault('spatialRel', 'esriSpatialRelIntersects')
+
+        def tile_params(tile):
+            tile_query = dict(base_params)
+            tile_query['geometry'] = ','.join(str(c) for c in tile)
+            tile_query['geometryType'] = 'esriGeometryEnvelope'
+            if spatial_reference:
+                tile_query['inSR'] = spatial_reference
+            return tile_query
+
+        min_width = (root[2] - root[0]) / (DEFAULT_TILE_GRID * 2 ** MAX_TILE_DEPTH)
+
+        def split_tile(tile):
+            xmin, ymin, xmax, ymax = tile
+            if xmax - xmin <= min_width:
+                return []
+            xmid, ymid = (xmin + xmax) / 2, (ymin + ymax) / 2
+            return [(xmin, ymin, xmid, ymid), (xmid, ymin, xmax, ymid),
+                    (xmin, ymid, xmid, ymax), (xmid, ymid, xmax, ymax)]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            tiles = self._partition(pool, url, _grid(root, DEFAULT_TILE_GRID), tile_params, split_tile)
+            logger.debug(f"Fetching {len(tiles)} tiles holding {sum(count for _, count in tiles)} features "
+                         f"before de-duplication")
+            responses = self._fetch_partitions(pool, url, [tile_params(tile) for tile, _ in tiles], progress)
+
+        merged = _merge_responses(responses, oid_field, params['f'])
+        print(f"Total features: {len(merged['features'])}")
+        return merged
+
+    def _query_time_windows(self, url: str, params: Dict, progress: bool, max_workers: int) -> Dict:
+        """Fetch features window by window over the layer's time extent.
+
+        The time extent (or a ``time`` range passed by the caller) is cut
+        into one window per worker, and windows whose count exceeds
+        maxRecordCount are halved until each fits in a single request.
+        Unlike offset paging, the partitions stay fixed while rows are
+        inserted during a long export. Features whose time falls on a
+        window boundary are de-duplicated by OBJECTID.
+
+        Args:
+            url: Layer query URL
+            params: Base query parameters
+            progress: Print progress as windows complete
+            max_workers: Number of concurrent requests
+
+        Returns:
+            Combined query response
+        """
+        start, end = self._time_root(params)
+        oid_field = self.object_id_field
+        base_params = {k: v for k, v in params.items() if k not in ('resultOffset', 'resultRecordCount', 'time')}
+        base_params['outFields'] = _with_field(base_params.get('outFields'), oid_field)
+
+        def window_params(window):
+            window_query = dict(base_params)
+            window_query['time'] = f"{window[0]},{window[1]}"
+            return window_query
+
+        def split_window(window):
+            window_start, window_end = window
+            if window_end - window_start <= MIN_TIME_WINDOW_MS:
+                return []
+            middle = (window_start + window_end) // 2
+            return [(window_start, middle), (middle + 1, window_end)]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            partitions = self._partition(pool, url, _windows(start, end, max_workers), window_params, split_window)
+            print(f"Total features: {sum(count for _, count in partitions)}")
+            logger.debug(f"Fetching {len(partitions)} time windows")
+            responses = self._fetch_partitions(pool, url, [window_params(w) for w, _ in partitions], progress)
+
+        return _merge_responses(responses, oid_field, params['f'])
+
+    def _time_root(self, params: Dict) -> Tuple[int, int]:
+        """Return the (start, end) epoch milliseconds to partition.
+
+        Open ends (``null`` in the time parameter or the layer's timeExtent)
+        fall back to the layer's timeExtent, then to now for the end and to
+        the earliest feature time for the start.
+        """
+        time_info = self.data.get('timeInfo') or {}
+        extent_start, extent_end = time_info.get('timeExtent') or (None, None)
+        if params.get('time'):
+            start, separator, end = str(params['time']).partition(',')
+            start, end = _epoch_ms(start), _epoch_ms(end) if separator else _epoch_ms(start)
+            start = extent_start if start is None else start
+            end = extent_end if end is None else end
+        else:
+            if not time_info.get('timeExtent'):
+                raise ValueError(f"Layer {self.id} is not time-enabled")
+            start, end = extent_start, extent_end
+        if end is None:
+            end = int(time.time() * 1000)
+        if start is None:
+            start = self._earliest_time(params)
+        return int(start), int(end)
+
+    def _earliest_time(self, params: Dict) -> int:
+        """Return the smallest start time of the matching features, or 0 when it cannot be queried."""
+        field = (self.data.get('timeInfo') or {}).get('startTimeField')
+        if field:
+            statistic = {'statisticType': 'min', 'onStatisticField': field, 'outStatisticFieldName': 'EARLIEST'}
+            try:
+                response = self.client._get_json(f"{self.url}/query", {
+                    'where': params.get('where', '1=1'), 'outStatistics': json.dumps([statistic]), 'f': 'json'})
+                features = response.get('features') or []
+                attributes = features[0].get('attributes') or {} if features else {}
+                earliest = next((v for k, v in attributes.items() if k.upper() == 'EARLIEST'), None)
+                if earliest is not None:
+                    return int(earliest)
+            except RequestException as e:
+                logger.debug(f"Earliest time query failed for layer {self.id}: {e}")
+        logger.debug(f"Layer {self.id} has an open time extent start, partitioning from the epoch")
+        return 0
+
+    def _tile_root(self, params: Dict) -> Tuple[Tuple[float, float, float, float], Optional[str]]:
+        """Return the envelope to tile and its spatial reference."""
+        geometry = params.get('geometry')
+        if geometry:
+            if params.get('geometryType', 'esriGeometryEnvelope') != 'esriGeometryEnvelope':
+                raise ValueError("Tiled queries only support an envelope geometry")
+            if isinstance(geometry, str) and not geometry.lstrip().startswith('{'):
+                xmin, ymin, xmax, ymax = (float(c) for c in geometry.split(','))
+                return (xmin, ymin, xmax, ymax), params.get('inSR')
+            envelope = json.loads(geometry) if isinstance(geometry, str) else geometry
+        else:
+            envelope = self.data.get('extent')
+            if not envelope:
+                raise ValueError(f"Layer {self.id} has no extent to tile")
+        root = (float(envelope['xmin']), float(envelope['ymin']), float(envelope['xmax']), float(envelope['ymax']))
+        spatial_reference = params.get('inSR') or _spatial_reference(envelope.get('spatialReference'))
+        return root, spatial_reference
+
+    def _partition(self, pool: ThreadPoolExecutor, url: str, regions: List, region_params: Callable,
+                   split: Callable) -> List[Tuple[object, int]]:
+        """Split regions until each one fits under maxRecordCount.
+
+        Args:
+            pool: Executor used to run the count probes concurrently
+            url: Layer query URL
+            regions: Initial regions
+            region_params: Callable returning the query parameters for a region
+            split: Callable returning the sub-regions of a region, or an
+                empty list when it cannot be split any further
+
+        Returns:
+            List of (region, count) pairs for every non-empty leaf region
+        """
+        limit = self.max_record_count
+        leaves = []
+        pending = regions
+        while pending:
+            counts = pool.map(lambda region: self._count(url, region_params(region)), pending)
+            next_pending = []
+            for region, count in zip(pending, counts):
+                if count == 0:
+                    continue
+                children = split(region) if count > limit else []
+                if children:
+                    next_pending.extend(children)
+                else:
+                    if count > limit:
+                        logger.warning(f"Partition {region} still has {count} features, results may be truncated")
+                    leaves.append((region, count))
+            pending = next_pending
+        return leaves
+
+    def _count(self, url: str, params: Dict) -> int:
+        count_params = dict(params)
+        count_params['returnCountOnly'] = 'true'
+        with phase('count'):
+            return self.client._get_json(url, count_params).get('count', 0)
+
+    def _fetch_partitions(self, pool: ThreadPoolExecutor, url: str, partitions: List[Dict],
+                          progress: bool) -> List[Dict]:
+        """Fetch one single-request partition per parameter set, in order."""
+        responses = []
+        for response in pool.map(lambda partition: self.client._get_json(url, partition), partitions):
+            if response.get('exceededTransferLimit'):
+                logger.warning("Server truncated a partition response (exceededTransferLimit)")
+            responses.append(response)
+            if progress:
+                print(f"Progress: {len(responses)}/{len(partitions)} partitions")
+        return responses
+
+
+def _grid(envelope: Tuple[float, float, float, float], size: int) -> List[Tuple[float, float, float, float]]:
+    xmin, ymin, xmax, ymax = envelope
+    width = (xmax - xmin) / size
+    height = (ymax - ymin) / size
+    return [(xmin + col * width, ymin + row * height,
+             xmax if col == size - 1 else xmin + (col + 1) * width,
+             ymax if row == size - 1 else ymin + (row + 1) * height)
+            for row in range(size) for col in range(size)]
+
+
+def _windows(start: int, end: int, count: int) -> List[Tuple[int, int]]:
+    """Cut an inclusive millisecond range into ``count`` contiguous windows."""
+    step = max((end - start + 1) // count, 1)
+    windows = []
+    window_start = start
+    while window_start <= end:
+        window_end = end if len(windows) == count - 1 else min(window_start + step - 1, end)
+        windows.append((window_start, window_end))
+        window_start = window_end + 1
+    return windows
+
+
+def _epoch_ms(value) -> Optional[int]:
+    """Parse one end of a time extent; empty and ``null`` ends are open (None)."""
+    if value is None or str(value).strip().lower() in ('', 'null', 'none'):
+        return None
+    return int(value)
+
+
+def _sql_timestamp(epoch_ms: int) -> str:
+    """Format epoch milliseconds as a standardized-query timestamp literal, keeping the milliseconds."""
+    moment = datetime.fromtimestamp(epoch_ms // 1000, tz=timezone.utc)
+    return f"timestamp '{moment.strftime('%Y-%m-%d %H:%M:%S')}.{epoch_ms % 1000:03d}'"
+
+
+def _spatial_reference(spatial_reference: Optional[Dict]) -> Optional[str]:
+    if not spatial_reference:
+        return None
+    wkid = spatial_reference.get('latestWkid') or spatial_reference.get('wkid')
+    return str(wkid) if wkid else json.dumps(spatial_reference)
+
+
+def _with_field(out_fields: Optional[str], field: str) -> str:
+    """Make sure ``field`` is part of an outFields list."""
+    if not out_fields or out_fields.strip() == '*':
+        return out_fields or field
+    fields = [f.strip() for f in out_fields.split(',')]
+    if field.lower() not in (f.lower() for f in fields):
+        fields.append(field)
+    return ','.join(fields)
+
+
+def _feature_oid(feature: Dict, oid_field: str):
+    """Return a feature's OBJECTID from Esri JSON or GeoJSON."""
+    attributes = feature.get('attributes') or feature.get('properties') or {}
+    if oid_field in attributes:
+        return attributes[oid_field]
+    return feature.get('id')
+
+
+def _merge_responses(responses: List[Dict], oid_field: str, query_format: str) -> Dict:
+    """Combine partition responses, dropping features already seen."""
+    template = next((r for r in responses if r.get('features')), None)
+    if template is None:
+        template = responses[0] if responses else {}
+        if not template and query_format == 'geojson':
+            template = {'type': 'FeatureCollection'}
+    merged = {k: v for k, v in template.items() if k != 'exceededTransferLimit'}
+
+    seen = set()
+    features = []
+    for response in responses:
+        for feature in response.get('features', []):
+            oid = _feature_oid(feature, oid_field)
+            if oid is not None:
+                if oid in seen:
+                    continue
+                seen.add(oid)
+            features.append(feature)
+    logger.debug(f"Merged {len(features)} unique features")
+    merged['features'] = features
+    return merged
@@ -0,0 +1,179 @@
+"""Bulk point-in-polygon lookups against a polygon layer.
+
+Querying a layer once per point costs one round trip per point. Instead,
+lookup_points groups the points into spatially compact clusters (a k-d
+split at the median of the wider axis), sends one envelope query per
+cluster for the polygons intersecting it, and tests the cluster's points
+against the returned polygons locally. A cluster whose response is
+truncated at the server's maxRecordCount is split in two and retried.
+"""
+import logging
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Sequence, Tuple, TYPE_CHECKING
+
+from requests.exceptions import RequestException
+
+from .layer import DEFAULT_MAX_WORKERS
+from .profiling import phase
+
+if TYPE_CHECKING:
+    from .layer import Layer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CLUSTER_POINTS = 256
+
+Point = Tuple[float, float]
+
+
+def cluster_points(points: Sequence[Point], max_points: int = DEFAULT_CLUSTER_POINTS) -> List[List[int]]:
+    """Group point indices into spatially compact clusters of at most max_points.
+
+    Args:
+        points: (x, y) coordinates
+        max_points: Largest cluster size
+
+    Returns:
+        List of clusters, each a list of indices into points
+    """
+    if max_points < 1:
+        raise ValueError("max_points must be at least 1")
+    clusters = []
+    pending = [list(range(len(points)))] if points else []
+    while pending:
+        indices = pending.pop()
+        if len(indices) <= max_points:
+            clusters.append(indices)
+        else:
+            pending.extend(_split(points, indices))
+    return clusters
+
+
+def point_in_geometry(x: float, y: float, geometry: Optional[Dict]) -> bool:
+    """Test whether a point lies inside a polygon geometry (Esri JSON rings or GeoJSON).
+
+    Rings are combined with the even-odd rule, so holes are excluded.
+    """
+    if not geometry:
+        return False
+    if 'rings' in geometry:
+        rings = geometry['rings']
+    elif geometry.get('type') == 'Polygon':
+        rings = geometry.get('coordinates') or []
+    elif geometry.get('type') == 'MultiPolygon':
+        rings = [ring for polygon in geometry.get('coordinates') or [] for ring in polygon]
+    else:
+        return False
+
+    inside = False
+    for ring in rings:
+        if not ring:
+            continue
+        x_prev, y_prev = ring[-1][0], ring[-1][1]
+        for vertex in ring:
+            x_cur, y_cur = vertex[0], vertex[1]
+            if (y_cur > y) != (y_prev > y) and x < (x_prev - x_cur) * (y - y_cur) / (y_prev - y_cur) + x_cur:
+                inside = not inside
+            x_prev, y_prev = x_cur, y_cur
+    return inside
+
+
+def lookup_points(layer: 'Layer', points: Sequence[Point], where: str = "1=1", out_fields: str = "*",
+                  in_sr: Optional[str] = "4326", max_points: int = DEFAULT_CLUSTER_POINTS,
+                  max_workers: int = DEFAULT_MAX_WORKERS, progress: bool = False, **kwargs) -> List[Optional[Dict]]:
+    """Find the polygon containing each point.
+
+    Args:
+        layer: Polygon layer to search
+        points: (x, y) coordinates in the in_sr spatial reference
+        where: SQL where clause applied to the polygons
+        out_fields: Polygon fields to return
+        in_sr: Spatial reference of the points; polygons are returned in it
+        max_points: Points per cluster query
+        max_workers: Number of concurrent cluster queries
+        progress: Print progress as clusters complete
+        **kwargs: Additional query parameters
+
+    Returns:
+        One entry per point: the attributes of the first polygon containing
+        it, or None
+
+    Raises:
+        RequestException: If a cluster query fails
+    """
+    url = f"{layer.url}/query"
+    params = {'where': where, 'f': 'json', 'outFields': out_fields, 'returnGeometry': 'true',
+              'geometryType': 'esriGeometryEnvelope', 'spatialRel': 'esriSpatialRelIntersects', **kwargs}
+    if in_sr:
+        params['inSR'] = params['outSR'] = in_sr
+
+    def query(cluster: List[int]) -> Dict:
+        cluster_params = dict(params, geometry=','.join(str(c) for c in _envelope(points, cluster)))
+        return layer.client._get_json(url, cluster_params)
+
+    matches: List[Optional[Dict]] = [None] * len(points)
+    clusters = cluster_points(points, max_points)
+    logger.debug(f"Looking up {len(points)} points in {len(clusters)} clusters")
+    done = queries = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool, phase('pagination'):
+            pending: Dict[Future, List[int]] = {pool.submit(query, cluster): cluster for cluster in clusters}
+            try:
+                while pending:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        cluster = pending.pop(future)
+                        response = future.result()
+                        queries += 1
+                        if response.get('exceededTransferLimit'):
+                            if len(cluster) > 1:
+                                for half in _split(points, cluster):
+                                    pending[pool.submit(query, half)] = half
+                                continue
+                            logger.warning(f"Polygons around point {cluster[0]} exceed maxRecordCount, "
+                                           f"results may be incomplete")
+                        _match(points, cluster, response.get('features') or [], matches)
+                        done += len(cluster)
+                        if progress:
+                            print(f"Progress: {done}/{len(points)} points")
+            finally:
+                for future in pending:
+                    future.cancel()
+    except RequestException as e:
+        raise RequestException(f"Point lookup failed for layer {layer.id}: {e}")
+
+    logger.debug(f"Matched {sum(1 for m in matches if m is not None)} of {len(points)} points "
+                 f"with {queries} queries")
+    return matches
+
+
+def _match(points: Sequence[Point], cluster: List[int], features: List[Dict], matches: List[Optional[Dict]]):
+    """Assign each point of a cluster the attributes of the first feature containing it."""
+    candidates = []
+    for feature in features:
+        geometry = feature.get('geometry')
+        vertices = [vertex for ring in (geometry or {}).get('rings') or [] for vertex in ring]
+        if vertices:
+            xs, ys = [v[0] for v in vertices], [v[1] for v in vertices]
+            candidates.append((min(xs), min(ys), max(xs), max(ys), geometry, feature.get('attributes') or {}))
+    for index in cluster:
+        x, y = points[index]
+        for xmin, ymin, xmax, ymax, geometry, attributes in candidates:
+            if xmin <= x <= xmax and ymin <= y <= ymax and point_in_geometry(x, y, geometry):
+                matches[index] = attributes
+                break
+
+
+def _envelope(points: Sequence[Point], indices: List[int]) -> Tuple[float, float, float, float]:
+    xs = [points[i][0] for i in indices]
+    ys = [points[i][1] for i in indices]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _split(points: Sequence[Point], indices: List[int]) -> List[List[int]]:
+    """Split indices in two at the median of the envelope's wider axis."""
+    xmin, ymin, xmax, ymax = _envelope(points, indices)
+    axis = 0 if xmax - xmin >= ymax - ymin else 1
+    ordered = sorted(indices, key=lambda i: points[i][axis])
+    middle = len(ordered) // 2
+    return [ordered[:middle], ordered[middle:]]
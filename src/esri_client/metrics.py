@@ -0,0 +1,128 @@
+import math
+import threading
+import time
+from typing import Dict, List, Optional
+
+URL_CLASSES = ('catalog', 'layer', 'count', 'ids', 'page', 'attachment', 'tile', 'other')
+
+
+class RequestMetric:
+    """Measurements for one EsriClient request, including its retries.
+
+    Attributes:
+        url: Requested URL
+        url_class: One of catalog, layer, count, ids, page, attachment, tile or other
+        status: Final HTTP status code, or None if no response arrived
+        latency: Seconds from the first attempt until the body was read
+        ttfb: Seconds until the response headers arrived for the last attempt
+        bytes: Response body size in bytes
+        decode_time: Seconds spent decoding the JSON body
+        retries: Number of retried attempts
+        features: Number of features in a page response
+        error: Error message if the request failed
+    """
+
+    def __init__(self, url: str, url_class: str):
+        self.url = url
+        self.url_class = url_class
+        self.status = None
+        self.latency = 0.0
+        self.ttfb = None
+        self.bytes = 0
+        self.decode_time = 0.0
+        self.retries = 0
+        self.features = 0
+        self.error = None
+
+    def to_dict(self) -> Dict:
+        return dict(vars(self))
+
+
+def classify_url(url: str, params: Dict) -> str:
+    """Classify a request as catalog, layer, count, ids, page, attachment, tile or other."""
+    path = url.rstrip('/')
+    if '/attachments/' in path:
+        return 'attachment'
+    if '/tile/' in path or path.endswith('/export'):
+        return 'tile'
+    if path.endswith('/query'):
+        if str(params.get('returnCountOnly')).lower() == 'true':
+            return 'count'
+        if str(params.get('returnIdsOnly')).lower() == 'true':
+            return 'ids'
+        return 'page'
+    last = path.rsplit('/', 1)[-1]
+    if last.startswith('query'):
+        # queryRelatedRecords, queryAttachments and other record queries
+        return 'page'
+    if last.isdigit():
+        return 'layer'
+    if '/rest/services' in path:
+        return 'catalog'
+    return 'other'
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of a list of values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(max(math.ceil(fraction * len(ordered)) - 1, 0), len(ordered) - 1)
+    return ordered[index]
+
+
+class MetricsCollector:
+    """Observer that stores request metrics and summarizes a run.
+
+    Register with ``client.add_observer(collector)``.
+    """
+
+    def __init__(self):
+        self.metrics: List[RequestMetric] = []
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def __call__(self, metric: RequestMetric):
+        with self.lock:
+            self.metrics.append(metric)
+
+    def summary(self) -> Dict:
+        with self.lock:
+            metrics = list(self.metrics)
+        elapsed = time.perf_counter() - self.started
+        latencies = [m.latency for m in metrics]
+        total_bytes = sum(m.bytes for m in metrics)
+        features = sum(m.features for m in metrics)
+        by_class = {}
+        for url_class in URL_CLASSES:
+            selected = [m for m in metrics if m.url_class == url_class]
+            if selected:
+                by_class[url_class] = {
+                    'requests': len(selected),
+                    'bytes': sum(m.bytes for m in selected),
+                    'latencySeconds': round(sum(m.latency for m in selected), 4),
+                }
+        return {
+            'requests': len(metrics),
+            'errors': sum(1 for m in metrics if m.error),
+            'retries': sum(m.retries for m in metrics),
+            'bytes': total_bytes,
+            'features': features,
+            'elapsedSeconds': round(elapsed, 4),
+            'decodeSeconds': round(sum(m.decode_time for m in metrics), 4),
+            'latency': {
+                'p50': _round(percentile(latencies, 0.50)),
+                'p95': _round(percentile(latencies, 0.95)),
+                'p99': _round(percentile(latencies, 0.99)),
+                'max': _round(max(latencies) if latencies else None),
+            },
+            'throughput': {
+                'featuresPerSecond': round(features / elapsed, 1) if elapsed else None,
+                'megabytesPerSecond': round(total_bytes / 1024 / 1024 / elapsed, 3) if elapsed else None,
+            },
+            'byClass': by_class,
+        }
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 4) if value is not None else None
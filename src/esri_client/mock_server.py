@@ -0,0 +1,700 @@
+"""Local stand-in ArcGIS REST server for offline tests and benchmarks.
+
+Serves a catalog (folders, services, layers) and a ``/query`` endpoint over
+synthetic datasets laid out on a regular grid, so counts, offsets, OBJECTID
+lists and envelope filters are computed without scanning every feature.
+Latency, maxRecordCount caps, HTTP errors and ESRI JSON errors can be
+injected to exercise pagination and retry behaviour.
+
+Run standalone with ``python -m src.esri_client.mock_server --help``.
+"""
+import argparse
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXTENT = {'xmin': -120.0, 'ymin': 25.0, 'xmax': -70.0, 'ymax': 50.0, 'spatialReference': {'wkid': 4326}}
+TIME_START = 1577836800000  # 2020-01-01T00:00:00Z
+TIME_STEP = 60000
+CATEGORIES = ['A', 'B', 'C', 'D', 'E']
+WEB_MERCATOR_EXTENT = 20037508.342789244
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+WHERE_TERM = re.compile(r'^\s*(\w+)\s*(<=|>=|<>|=|<|>)\s*(-?\d+(?:\.\d+)?)\s*$')
+OPERATORS = {
+    '=': lambda a, b: a == b,
+    '<>': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+
+
+class MockQueryError(Exception):
+    """Raised for queries the mock server rejects with an ESRI JSON error."""
+
+
+class SyntheticLayer:
+    """Deterministic synthetic feature layer laid out on a regular grid.
+
+    Feature ``i`` (OBJECTID 1..count) sits in grid cell ``i - 1`` of a square
+    grid over ``extent``. Points are cell centres; polygons are regular
+    polygons with ``vertices`` corners inscribed in the cell.
+    """
+
+    def __init__(self, name: str, count: int, geometry_type: str = 'point', vertices: int = 16,
+                 layer_id: int = 0, max_record_count: int = 1000, supports_pagination: bool = True,
+                 time_enabled: bool = False, extent: Optional[Dict] = None, supports_statistics: bool = True,
+                 attachments: int = 0, related: Optional[Dict[int, int]] = None):
+        if geometry_type not in ('point', 'polygon'):
+            raise ValueError(f"Unsupported geometry type '{geometry_type}'")
+        self.name = name
+        self.count = count
+        self.geometry_type = geometry_type
+        self.vertices = max(vertices, 3)
+        self.id = layer_id
+        self.max_record_count = max_record_count
+        self.supports_pagination = supports_pagination
+        self.supports_statistics = supports_statistics
+        self.attachments = attachments
+        # Related layer id -> related records per feature; relationship ids follow the layer ids' order
+        self.related = dict(sorted((related or {}).items()))
+        self.time_enabled = time_enabled
+        self.extent = dict(extent or DEFAULT_EXTENT)
+        self.columns = max(math.ceil(math.sqrt(count)), 1)
+        self.cell_width = (self.extent['xmax'] - self.extent['xmin']) / self.columns
+        self.cell_height = (self.extent['ymax'] - self.extent['ymin']) / self.columns
+
+    @property
+    def esri_geometry_type(self) -> str:
+        return 'esriGeometryPoint' if self.geometry_type == 'point' else 'esriGeometryPolygon'
+
+    def metadata(self) -> Dict:
+        fields = [
+            {'name': 'OBJECTID', 'type': 'esriFieldTypeOID', 'alias': 'OBJECTID'},
+            {'name': 'NAME', 'type': 'esriFieldTypeString', 'alias': 'Name', 'length': 50},
+            {'name': 'CATEGORY', 'type': 'esriFieldTypeString', 'alias': 'Category', 'length': 1},
+            {'name': 'VALUE', 'type': 'esriFieldTypeInteger', 'alias': 'Value'},
+            {'name': 'EVENT_TIME', 'type': 'esriFieldTypeDate', 'alias': 'Event time'},
+        ]
+        data = {
+            'id': self.id,
+            'name': self.name,
+            'type': 'Feature Layer',
+            'geometryType': self.esri_geometry_type,
+            'displayField': 'NAME',
+            'objectIdField': 'OBJECTID',
+            'fields': fields,
+            'extent': self.extent,
+            'maxRecordCount': self.max_record_count,
+            'supportedQueryFormats': 'JSON, geoJSON',
+            'advancedQueryCapabilities': {'supportsPagination': self.supports_pagination,
+                                          'supportsStatistics': self.supports_statistics,
+                                          'supportsOrderBy': True,
+                                          'supportsQueryAttachments': self.attachments > 0,
+                                          'supportsQueryRelatedPagination': self.supports_pagination},
+            'hasAttachments': self.attachments > 0,
+            'relationships': [{'id': relationship_id, 'name': f"{self.name}_{related_id}",
+                               'relatedTableId': related_id, 'cardinality': 'esriRelCardinalityOneToMany',
+                               'role': 'esriRelRoleOrigin', 'keyField': 'OBJECTID', 'composite': False}
+                              for relationship_id, related_id in enumerate(self.related)],
+            'editingInfo': {'lastEditDate': TIME_START},
+        }
+        if self.time_enabled:
+            data['timeInfo'] = {'startTimeField': 'EVENT_TIME',
+                                'timeExtent': [TIME_START, TIME_START + (self.count - 1) * TIME_STEP]}
+        return data
+
+    def center(self, oid: int):
+        index = oid - 1
+        column, row = index % self.columns, index // self.columns
+        return (self.extent['xmin'] + (column + 0.5) * self.cell_width,
+                self.extent['ymin'] + (row + 0.5) * self.cell_height)
+
+    def attributes(self, oid: int) -> Dict:
+        return {
+            'OBJECTID': oid,
+            'NAME': f"Feature {oid}",
+            'CATEGORY': CATEGORIES[oid % len(CATEGORIES)],
+            'VALUE': oid % 100,
+            'EVENT_TIME': TIME_START + (oid - 1) * TIME_STEP,
+        }
+
+    def ring(self, oid: int) -> List[List[float]]:
+        x, y = self.center(oid)
+        rx, ry = self.cell_width * 0.4, self.cell_height * 0.4
+        ring = [[round(x + rx * math.cos(2 * math.pi * k / self.vertices), 8),
+                 round(y + ry * math.sin(2 * math.pi * k / self.vertices), 8)] for k in range(self.vertices)]
+        ring.append(ring[0])
+        # Esri rings are clockwise
+        return ring[::-1]
+
+    def attachment_infos(self, oid: int) -> List[Dict]:
+        """Return the attachmentInfos of a feature; each feature has ``attachments`` of them."""
+        infos = []
+        for k in range(self.attachments if 1 <= oid <= self.count else 0):
+            attachment_id = (oid - 1) * self.attachments + k + 1
+            infos.append({'id': attachment_id, 'globalId': None, 'name': f"photo_{oid}_{k + 1}.jpg",
+                          'contentType': 'image/jpeg', 'size': len(self.attachment_content(oid, attachment_id)),
+                          'keywords': ''})
+        return infos
+
+    def attachment_content(self, oid: int, attachment_id: int) -> bytes:
+        return (f"attachment {attachment_id} of feature {oid};" * (10 + attachment_id % 50)).encode('utf-8')
+
+    def related_ids(self, relationship_id: int, oid: int, related: 'SyntheticLayer') -> List[int]:
+        """Return the OBJECTIDs in ``related`` of a feature's related records."""
+        per_feature = list(self.related.values())[relationship_id]
+        if not 1 <= oid <= self.count:
+            return []
+        return list(range((oid - 1) * per_feature + 1, min(oid * per_feature, related.count) + 1))
+
+    def ids_in_envelope(self, xmin: float, ymin: float, xmax: float, ymax: float) -> List[int]:
+        """Return the OBJECTIDs whose geometry intersects an envelope."""
+        pad_x = self.cell_width * 0.4 if self.geometry_type == 'polygon' else 0
+        pad_y = self.cell_height * 0.4 if self.geometry_type == 'polygon' else 0
+        first_column = max(math.ceil((xmin - pad_x - self.extent['xmin']) / self.cell_width - 0.5), 0)
+        last_column = min(math.floor((xmax + pad_x - self.extent['xmin']) / self.cell_width - 0.5), self.columns - 1)
+        first_row = max(math.ceil((ymin - pad_y - self.extent['ymin']) / self.cell_height - 0.5), 0)
+        last_row = min(math.floor((ymax + pad_y - self.extent['ymin']) / self.cell_height - 0.5), self.columns - 1)
+        ids = []
+        for row in range(first_row, last_row + 1):
+            start = row * self.columns + first_column + 1
+            end = min(row * self.columns + last_column + 1, self.count)
+            if start > self.count:
+                break
+            ids.extend(range(start, end + 1))
+        return ids
+
+    def esri_feature(self, oid: int, out_fields: Optional[List[str]], return_geometry: bool) -> Dict:
+        feature = {'attributes': _select(self.attributes(oid), out_fields)}
+        if return_geometry:
+            if self.geometry_type == 'point':
+                x, y = self.center(oid)
+                feature['geometry'] = {'x': x, 'y': y}
+            else:
+                feature['geometry'] = {'rings': [self.ring(oid)]}
+        return feature
+
+    def geojson_feature(self, oid: int, out_fields: Optional[List[str]], return_geometry: bool) -> Dict:
+        geometry = None
+        if return_geometry:
+            if self.geometry_type == 'point':
+                geometry = {'type': 'Point', 'coordinates': list(self.center(oid))}
+            else:
+                # GeoJSON exterior rings are counter-clockwise
+                geometry = {'type': 'Polygon', 'coordinates': [self.ring(oid)[::-1]]}
+        return {'type': 'Feature', 'id': oid, 'geometry': geometry,
+                'properties': _select(self.attributes(oid), out_fields)}
+
+
+class SyntheticService:
+    """Synthetic service; with ``tile_levels`` it has a Web Mercator tile cache of that many levels."""
+
+    def __init__(self, name: str, layers: Sequence[SyntheticLayer], folder: Optional[str] = None,
+                 type: str = 'MapServer', tile_levels: int = 0):
+        self.name = name
+        self.folder = folder
+        self.type = type
+        self.layers = {layer.id: layer for layer in layers}
+        self.tile_levels = tile_levels
+
+    @property
+    def path(self) -> str:
+        return f"{self.folder}/{self.name}" if self.folder else self.name
+
+    def metadata(self) -> Dict:
+        return {
+            'serviceDescription': f"Synthetic service {self.name}",
+            'layers': [{'id': layer.id, 'name': layer.name} for layer in self.layers.values()],
+            'tables': [],
+            'singleFusedMapCache': self.tile_levels > 0,
+            **({'tileInfo': self.tile_info()} if self.tile_levels else {}),
+        }
+
+    def tile_info(self) -> Dict:
+        return {
+            'rows': 256, 'cols': 256, 'dpi': 96, 'format': 'PNG32',
+            'origin': {'x': -WEB_MERCATOR_EXTENT, 'y': WEB_MERCATOR_EXTENT},
+            'spatialReference': {'wkid': 102100, 'latestWkid': 3857},
+            'lods': [{'level': level, 'resolution': 2 * WEB_MERCATOR_EXTENT / 256 / 2 ** level,
+                      'scale': 591657527.591555 / 2 ** level} for level in range(self.tile_levels)],
+        }
+
+    def tile(self, level: int, row: int, column: int) -> bytes:
+        """Return a cached tile's bytes."""
+        if not (0 <= level < self.tile_levels and 0 <= row < 2 ** level and 0 <= column < 2 ** level):
+            raise LookupError(f"{level}/{row}/{column}")
+        return PNG_SIGNATURE + f"tile {level}/{row}/{column}".encode('utf-8')
+
+    def export(self, params: Dict[str, str]) -> bytes:
+        """Return an exported map image; its bytes name the requested bbox."""
+        if not params.get('bbox'):
+            raise MockQueryError("Invalid or missing input parameters: bbox")
+        return PNG_SIGNATURE + f"export {params['bbox']} {params.get('size', '400,400')}".encode('utf-8')
+
+
+class FaultConfig:
+    """Faults injected into every response.
+
+    Args:
+        latency: Seconds to sleep before responding
+        error_rate: Fraction of requests answered with an HTTP error
+        error_codes: HTTP status codes to pick from for those errors
+        esri_error_rate: Fraction of requests answered with an ESRI JSON error
+        seed: Random seed so injected faults are reproducible
+        feature_latency: Extra seconds of latency per returned feature
+        max_response_features: Answer queries returning more features than
+            this with an ESRI transfer limit error, like a server timing out
+            on large pages
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, error_codes: Sequence[int] = (429, 503),
+                 esri_error_rate: float = 0.0, seed: int = 0, feature_latency: float = 0.0,
+                 max_response_features: Optional[int] = None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.esri_error_rate = esri_error_rate
+        self.feature_latency = feature_latency
+        self.max_response_features = max_response_features
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def draw(self) -> Optional[object]:
+        """Return an HTTP status, ``'esri'`` or None for a healthy response."""
+        with self.lock:
+            roll = self.random.random()
+            if roll < self.error_rate:
+                return self.random.choice(self.error_codes)
+            if roll < self.error_rate + self.esri_error_rate:
+                return 'esri'
+        return None
+
+
+class MockArcGISServer:
+    """Threaded HTTP server answering ArcGIS REST requests from synthetic services.
+
+    Usable as a context manager; ``url`` is the base URL to pass to EsriClient.
+    """
+
+    def __init__(self, services: Sequence[SyntheticService], host: str = '127.0.0.1', port: int = 0,
+                 faults: Optional[FaultConfig] = None):
+        self.services = {f"{s.path}/{s.type}": s for s in services}
+        self.faults = faults or FaultConfig()
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+        self.httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/arcgis"
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.request_count = 0
+            self.connection_count = 0
+            self.paths = Counter()
+
+    def start(self) -> 'MockArcGISServer':
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> 'MockArcGISServer':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def route(self, path: str, params: Dict[str, str]) -> Union[Dict, bytes]:
+        """Return the JSON document (or binary body) for a request path under /arcgis/rest/services."""
+        path = path.strip('/')
+        if path == '':
+            folders = sorted({s.folder for s in self.services.values() if s.folder})
+            services = [{'name': s.name, 'type': s.type} for s in self.services.values() if not s.folder]
+            return {'currentVersion': 11.1, 'folders': folders, 'services': services}
+        folder_services = [s for s in self.services.values() if s.folder == path]
+        if folder_services:
+            return {'currentVersion': 11.1, 'folders': [],
+                    'services': [{'name': s.path, 'type': s.type} for s in folder_services]}
+        for service_path, service in self.services.items():
+            if path == service_path:
+                return service.metadata()
+            if path.startswith(service_path + '/'):
+                rest = path[len(service_path) + 1:].split('/')
+                if rest == ['export']:
+                    return service.export(params)
+                if rest[0] == 'tile' and len(rest) == 4 and all(part.isdigit() for part in rest[1:]):
+                    return service.tile(*(int(part) for part in rest[1:]))
+                if not rest[0].isdigit() or int(rest[0]) not in service.layers:
+                    break
+                layer = service.layers[int(rest[0])]
+                if len(rest) == 1:
+                    return layer.metadata()
+                if rest[1:] == ['query']:
+                    return query_layer(layer, params)
+                if rest[1:] == ['queryAttachments']:
+                    return query_attachments(layer, params)
+                if rest[1:] == ['queryRelatedRecords']:
+                    return query_related_records(layer, service, params)
+                if len(rest) in (3, 4) and rest[1].isdigit() and rest[2] == 'attachments':
+                    return _attachment(layer, int(rest[1]), rest[3] if len(rest) == 4 else None)
+        raise LookupError(path)
+
+
+def query_layer(layer: SyntheticLayer, params: Dict[str, str]) -> Dict:
+    """Answer a /query request against a synthetic layer."""
+    query_format = params.get('f', 'json')
+    if query_format == 'pbf':
+        raise MockQueryError("pbf output is not supported by the mock server")
+    ids = _candidate_ids(layer, params)
+
+    if _true(params.get('returnCountOnly')):
+        return {'count': len(ids)}
+    if _true(params.get('returnIdsOnly')):
+        return {'objectIdFieldName': 'OBJECTID', 'objectIds': list(ids)}
+    if params.get('outStatistics'):
+        return _statistics(layer, ids, params)
+
+    offset = int(params.get('resultOffset') or 0)
+    if offset and not layer.supports_pagination:
+        raise MockQueryError("Pagination is not supported.")
+    requested = int(params.get('resultRecordCount') or layer.max_record_count)
+    page_size = min(requested, layer.max_record_count)
+    page = ids[offset:offset + page_size]
+    exceeded = offset + len(page) < len(ids)
+
+    out_fields = _out_fields(params.get('outFields'))
+    return_geometry = params.get('returnGeometry', 'true').lower() != 'false'
+    offset_tolerance = float(params.get('maxAllowableOffset') or 0)
+    if query_format == 'geojson':
+        response = {'type': 'FeatureCollection',
+                    'features': [layer.geojson_feature(oid, out_fields, return_geometry) for oid in page]}
+        _generalize(response['features'], offset_tolerance)
+        if exceeded:
+            response['properties'] = {'exceededTransferLimit': True}
+        return response
+    response = {
+        'objectIdFieldName': 'OBJECTID',
+        'geometryType': layer.esri_geometry_type,
+        'spatialReference': layer.extent['spatialReference'],
+        'features': [layer.esri_feature(oid, out_fields, return_geometry) for oid in page],
+    }
+    _generalize(response['features'], offset_tolerance)
+    if exceeded:
+        response['exceededTransferLimit'] = True
+    return response
+
+
+def query_attachments(layer: SyntheticLayer, params: Dict[str, str]) -> Dict:
+    """Answer a /queryAttachments request."""
+    if not layer.attachments:
+        raise MockQueryError("Layer does not support attachments")
+    if params.get('objectIds'):
+        ids = [int(oid) for oid in params['objectIds'].split(',') if oid.strip()]
+    else:
+        ids = _candidate_ids(layer, {'where': params.get('definitionExpression') or '1=1'})
+    groups = [{'parentObjectId': oid, 'parentGlobalId': None, 'attachmentInfos': layer.attachment_infos(oid)}
+              for oid in ids]
+    return {'fields': [], 'attachmentGroups': [group for group in groups if group['attachmentInfos']]}
+
+
+def query_related_records(layer: SyntheticLayer, service: SyntheticService, params: Dict[str, str]) -> Dict:
+    """Answer a /queryRelatedRecords request.
+
+    Records beyond the related layer's maxRecordCount are cut off with
+    exceededTransferLimit; resultOffset/resultRecordCount page through them.
+    """
+    relationship_id = int(params.get('relationshipId', -1))
+    if not 0 <= relationship_id < len(layer.related):
+        raise MockQueryError(f"Invalid relationshipId '{params.get('relationshipId')}'")
+    related = service.layers[list(layer.related)[relationship_id]]
+    ids = [int(oid) for oid in (params.get('objectIds') or '').split(',') if oid.strip()]
+    records = [(oid, related_id) for oid in ids for related_id in layer.related_ids(relationship_id, oid, related)]
+    if params.get('definitionExpression'):
+        allowed = set(_candidate_ids(related, {'where': params['definitionExpression']}))
+        records = [record for record in records if record[1] in allowed]
+
+    offset = int(params.get('resultOffset') or 0)
+    if offset and not layer.supports_pagination:
+        raise MockQueryError("Pagination is not supported.")
+    page_size = min(int(params.get('resultRecordCount') or related.max_record_count), related.max_record_count)
+    page = records[offset:offset + page_size]
+
+    out_fields = _out_fields(params.get('outFields'))
+    return_geometry = _true(params.get('returnGeometry'))
+    groups = {}
+    for oid, related_id in page:
+        groups.setdefault(oid, []).append(related.esri_feature(related_id, out_fields, return_geometry))
+    response = {'geometryType': related.esri_geometry_type, 'spatialReference': related.extent['spatialReference'],
+                'fields': [], 'relatedRecordGroups': [{'objectId': oid, 'relatedRecords': group}
+                                                      for oid, group in groups.items()]}
+    if offset + len(page) < len(records):
+        response['exceededTransferLimit'] = True
+    return response
+
+
+def _attachment(layer: SyntheticLayer, oid: int, attachment_id: Optional[str]) -> Union[Dict, bytes]:
+    """Answer a feature's attachment listing, or one attachment's bytes."""
+    infos = layer.attachment_infos(oid)
+    if attachment_id is None:
+        return {'attachmentInfos': infos}
+    if not attachment_id.isdigit() or int(attachment_id) not in {info['id'] for info in infos}:
+        raise LookupError(attachment_id)
+    return layer.attachment_content(oid, int(attachment_id))
+
+
+def _statistics(layer: SyntheticLayer, ids: Sequence[int], params: Dict[str, str]) -> Dict:
+    """Answer an outStatistics query, paging the groups like features."""
+    from .statistics import StatisticsAggregator, statistic_definition
+
+    if not layer.supports_statistics:
+        raise MockQueryError("Statistics are not supported.")
+    if params.get('havingClause'):
+        raise MockQueryError("havingClause is not supported by the mock server")
+    try:
+        definitions = [statistic_definition(d) for d in json.loads(params['outStatistics'])]
+    except (TypeError, ValueError, AttributeError):
+        raise MockQueryError("'outStatistics' parameter is invalid")
+    group_by = [f for f in (params.get('groupByFieldsForStatistics') or '').split(',') if f]
+    aggregator = StatisticsAggregator(definitions, group_by)
+    for oid in ids:
+        aggregator.add(layer.attributes(oid))
+    rows = aggregator.rows(params.get('orderByFields'))
+
+    offset = int(params.get('resultOffset') or 0)
+    page_size = min(int(params.get('resultRecordCount') or layer.max_record_count), layer.max_record_count)
+    page = rows[offset:offset + page_size]
+    response = {'displayFieldName': '', 'features': [{'attributes': row} for row in page]}
+    if offset + len(page) < len(rows):
+        response['exceededTransferLimit'] = True
+    return response
+
+
+def _generalize(features: List[Dict], tolerance: float):
+    """Apply maxAllowableOffset to polygon rings like the server's generalization."""
+    if tolerance <= 0:
+        return
+    from .simplify import geometry_lines, simplify_line
+
+    for feature in features:
+        for ring in geometry_lines(feature.get('geometry')):
+            ring[:] = simplify_line(ring, tolerance)
+
+
+def _true(value: Optional[str]) -> bool:
+    return str(value).lower() == 'true'
+
+
+def _select(attributes: Dict, out_fields: Optional[List[str]]) -> Dict:
+    if out_fields is None:
+        return attributes
+    return {k: v for k, v in attributes.items() if k.upper() in out_fields}
+
+
+def _out_fields(out_fields: Optional[str]) -> Optional[List[str]]:
+    if out_fields is None or out_fields.strip() == '*':
+        return None
+    fields = [f.strip().upper() for f in out_fields.split(',') if f.strip()]
+    return fields + ['OBJECTID']
+
+
+def _envelope(params: Dict[str, str]):
+    geometry = params.get('geometry')
+    if not geometry:
+        return None
+    if not geometry.lstrip().startswith('{'):
+        return tuple(float(c) for c in geometry.split(','))
+    data = json.loads(geometry)
+    if 'xmin' in data:
+        return data['xmin'], data['ymin'], data['xmax'], data['ymax']
+    if 'x' in data:
+        return data['x'], data['y'], data['x'], data['y']
+    points = [p for part in data.get('rings') or data.get('paths') or [data.get('points', [])] for p in part]
+    xs, ys = [p[0] for p in points], [p[1] for p in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _candidate_ids(layer: SyntheticLayer, params: Dict[str, str]) -> Sequence[int]:
+    """Return the sorted OBJECTIDs matching where, objectIds, geometry and time."""
+    ids: Sequence[int] = range(1, layer.count + 1)
+    predicates = []
+    where = params.get('where', '1=1')
+    for term in re.split(r'\s+AND\s+', where, flags=re.IGNORECASE):
+        term = term.strip().strip('()').strip()
+        if term in ('', '1=1'):
+            continue
+        match = WHERE_TERM.match(term)
+        if not match:
+            raise MockQueryError(f"Unable to complete operation. Unsupported where clause: {where}")
+        field, operator, value = match.group(1).upper(), match.group(2), float(match.group(3))
+        if field == 'OBJECTID' and operator in ('<', '<=', '>', '>=', '='):
+            low, high = ids[0] if ids else 1, ids[-1] if ids else 0
+            if operator == '<':
+                high = min(high, math.ceil(value) - 1)
+            elif operator == '<=':
+                high = min(high, math.floor(value))
+            elif operator == '>':
+                low = max(low, math.floor(value) + 1)
+            elif operator == '>=':
+                low = max(low, math.ceil(value))
+            else:
+                low, high = max(low, int(value)), min(high, int(value))
+            ids = range(low, high + 1)
+        else:
+            predicates.append((field, OPERATORS[operator], value))
+
+    if params.get('objectIds'):
+        wanted = {int(oid) for oid in params['objectIds'].split(',') if oid.strip()}
+        ids = _intersect(ids, wanted)
+    envelope = _envelope(params)
+    if envelope:
+        ids = _intersect(ids, layer.ids_in_envelope(*envelope))
+    if params.get('time') and layer.time_enabled:
+        start, _, end = params['time'].partition(',')
+        first = max(math.ceil((int(start) - TIME_START) / TIME_STEP) + 1, 1)
+        last = math.floor((int(end or start) - TIME_START) / TIME_STEP) + 1
+        ids = [oid for oid in ids if first <= oid <= last]
+    if predicates:
+        ids = [oid for oid in ids if all(op(layer.attributes(oid).get(f), v) for f, op, v in predicates)]
+    return ids
+
+
+def _intersect(ids: Sequence[int], other: Iterable[int]) -> List[int]:
+    """Intersect sorted ids with another id collection; membership in a range is O(1)."""
+    if isinstance(ids, range):
+        return sorted(oid for oid in set(other) if oid in ids)
+    other = set(other)
+    return [oid for oid in ids if oid in other]
+
+
+def _make_handler(server: MockArcGISServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            with server.stats_lock:
+                server.connection_count += 1
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            params = {k: v[-1] for k, v in parse_qs(parsed.query, keep_blank_values=True).items()}
+            with server.stats_lock:
+                server.request_count += 1
+                server.paths[parsed.path] += 1
+
+            if server.faults.latency:
+                time.sleep(server.faults.latency)
+            fault = server.faults.draw()
+            if isinstance(fault, int):
+                self._send(fault, {'error': {'code': fault, 'message': 'Injected HTTP error'}})
+                return
+            if fault == 'esri':
+                self._send(200, {'error': {'code': 500, 'message': 'Injected ESRI error', 'details': []}})
+                return
+
+            prefix = '/arcgis/rest/services'
+            if not parsed.path.startswith(prefix):
+                self._send(404, {'error': {'code': 404, 'message': 'Not found'}})
+                return
+            try:
+                body = server.route(parsed.path[len(prefix):], params)
+            except LookupError:
+                self._send(404, {'error': {'code': 404, 'message': 'Not found'}})
+                return
+            except (MockQueryError, ValueError) as e:
+                body = {'error': {'code': 400, 'message': str(e), 'details': []}}
+            if isinstance(body, bytes):
+                self._send_bytes(body)
+                return
+            features = body.get('features') or []
+            if server.faults.feature_latency and features:
+                time.sleep(server.faults.feature_latency * len(features))
+            limit = server.faults.max_response_features
+            if limit is not None and len(features) > limit:
+                body = {'error': {'code': 500, 'message': 'Query exceeded the transfer limit', 'details': []}}
+            self._send(200, body, pretty=params.get('f') == 'pjson')
+
+        def _send_bytes(self, payload: bytes, content_type: str = 'application/octet-stream'):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _send(self, status: int, body: Dict, pretty: bool = False):
+            payload = json.dumps(body, indent=2 if pretty else None).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return Handler
+
+
+def build_server(features: int = 10000, geometry: str = 'point', vertices: int = 16, max_record_count: int = 1000,
+                 supports_pagination: bool = True, port: int = 0, faults: Optional[FaultConfig] = None,
+                 layers: Optional[Iterable[SyntheticLayer]] = None) -> MockArcGISServer:
+    """Create a server with one ``Synthetic/MapServer`` service.
+
+    The service holds the given layers, or a single layer ``0`` built from
+    the remaining arguments plus a time-enabled point layer ``1``.
+    """
+    if layers is None:
+        layers = [
+            SyntheticLayer('features', features, geometry, vertices, layer_id=0, max_record_count=max_record_count,
+                           supports_pagination=supports_pagination),
+            SyntheticLayer('events', features, 'point', layer_id=1, max_record_count=max_record_count,
+                           supports_pagination=supports_pagination, time_enabled=True),
+        ]
+    return MockArcGISServer([SyntheticService('Synthetic', list(layers))], port=port, faults=faults)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local mock ArcGIS REST server')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--features', type=int, default=10000, help='Features per layer')
+    parser.add_argument('--geometry', choices=['point', 'polygon'], default='point', help='Geometry of layer 0')
+    parser.add_argument('--vertices', type=int, default=16, help='Vertices per polygon')
+    parser.add_argument('--maxRecordCount', type=int, default=1000, help='Server page size cap')
+    parser.add_argument('--no-pagination', action='store_true', help='Disable resultOffset support')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds of latency per request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of HTTP 429/503 responses')
+    parser.add_argument('--esri-error-rate', type=float, default=0.0, help='Fraction of ESRI JSON errors')
+    args = parser.parse_args()
+
+    faults = FaultConfig(latency=args.latency, error_rate=args.error_rate, esri_error_rate=args.esri_error_rate)
+    server = build_server(args.features, args.geometry, args.vertices, args.maxRecordCount,
+                          not args.no_pagination, args.port, faults)
+    print(f"Serving mock ArcGIS server at {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Adaptive page sizing for offset pagination.
+
+Polygon layers with heavy geometries can time out or hit transfer limits at
+the server's ``maxRecordCount``, while point layers could take much larger
+pages. AdaptivePageSize tunes ``resultRecordCount`` from how each page went:
+it halves the size after a slow, oversized or failed page and doubles it
+after a fast, small, full page, always within ``[minimum, maximum]``.
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TARGET_SECONDS = 2.0
+DEFAULT_MAX_PAGE_BYTES = 8 * 1024 * 1024
+MIN_ADAPTIVE_PAGE_SIZE = 10
+
+
+class AdaptivePageSize:
+    """Thread-safe page size controller.
+
+    Args:
+        initial: Starting page size
+        maximum: Largest page size to request, normally the layer's maxRecordCount
+        minimum: Smallest page size the controller shrinks to
+        target_seconds: Pages slower than this shrink the size; pages
+            faster than half of it may grow it
+        max_bytes: Pages larger than this shrink the size
+    """
+
+    def __init__(self, initial: int, maximum: int, minimum: int = MIN_ADAPTIVE_PAGE_SIZE,
+                 target_seconds: float = DEFAULT_TARGET_SECONDS, max_bytes: int = DEFAULT_MAX_PAGE_BYTES):
+        self.minimum = min(minimum, maximum)
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes
+        self.size = max(self.minimum, min(initial, maximum))
+        self.history = [self.size]
+        self.lock = threading.Lock()
+
+    def record(self, requested: int, records: int, seconds: float, size_bytes: int):
+        """Adjust the page size after a successful page.
+
+        Args:
+            requested: Page size that was requested
+            records: Number of features returned
+            seconds: Request latency
+            size_bytes: Response body size
+        """
+        if seconds > self.target_seconds or size_bytes > self.max_bytes:
+            self._resize(requested // 2)
+        elif records >= requested and seconds < self.target_seconds / 2 and size_bytes < self.max_bytes / 2:
+            self._resize(max(requested * 2, self.size))
+
+    def failed(self, requested: int):
+        """Shrink the page size after a page failed."""
+        self._resize(requested // 2)
+
+    def cap(self, maximum: int):
+        """Lower the maximum, e.g. when the server returned fewer records than requested."""
+        with self.lock:
+            self.maximum = max(1, min(self.maximum, maximum))
+            self.minimum = min(self.minimum, self.maximum)
+        self._resize(self.size)
+
+    def _resize(self, size: int):
+        with self.lock:
+            size = max(self.minimum, min(size, self.maximum))
+            if size != self.size:
+                logger.debug(f"Page size {self.size} -> {size}")
+                self.size = size
+                self.history.append(size)
@@ -0,0 +1,195 @@
+"""Pipelined export: threaded fetch, process-pool rendering, one ordered writer.
+
+``Layer.query`` followed by ``output_result`` downloads, decodes, converts and
+writes everything in sequence and holds the whole result in memory.
+export_layer overlaps the stages instead:
+
+* pages are downloaded by ``Layer.iter_pages`` on an I/O thread pool,
+* each page is rendered (KML placemarks or JSON features) in a process pool,
+* the calling thread writes rendered pages to the output in page order.
+
+Both hand-offs are bounded (``prefetch`` pages ahead of the renderer,
+``2 x processes`` pages ahead of the writer), so a slow stage holds back the
+earlier ones and memory stays flat regardless of the layer size.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import sys
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Optional, TextIO, Tuple, TYPE_CHECKING
+
+from .kml import KML_FOOTER, KML_HEADER, MAX_KML_VERTICES, render_placemarks
+from .layer import DEFAULT_MAX_WORKERS
+from .profiling import phase
+
+if TYPE_CHECKING:
+    from .layer import Layer
+
+logger = logging.getLogger(__name__)
+
+
+def render_page(features: List[Dict], format: str, display_field: Optional[str] = None) -> List[Tuple[str, int]]:
+    """Render one page of features as (text, vertex count) pairs; runs in a worker process."""
+    if format in ('kml', 'kmz'):
+        return render_placemarks(features, display_field)
+    return [(json.dumps(feature), 0) for feature in features]
+
+
+class JsonWriter:
+    """Streams features into one JSON document, keeping the first page's other keys."""
+
+    def __init__(self, output: Optional[str]):
+        self.output = output
+        self.stream: Optional[TextIO] = None
+        self.count = 0
+        self.files = [output] if output else []
+
+    def begin(self, page: Dict):
+        self.stream = open(self.output, 'w') if self.output else sys.stdout
+        meta = {k: v for k, v in page.items() if k not in ('features', 'exceededTransferLimit', 'properties')}
+        head = json.dumps(meta)[:-1]
+        self.stream.write(f"{head}, \"features\": [" if meta else "{\"features\": [")
+
+    def write(self, rendered: List[Tuple[str, int]]):
+        for text, _ in rendered:
+            self.stream.write(f"{',' if self.count else ''}\n{text}")
+            self.count += 1
+
+    def close(self):
+        self.stream.write("\n]}\n")
+        if self.output:
+            self.stream.close()
+
+
+class KmlWriter:
+    """Streams placemarks into KML files split at MAX_KML_VERTICES, like output_result.
+
+    Without an output path the document goes to stdout unsplit. With one,
+    placemarks go to ``<base>/<base>_partN.kml`` files; if everything fits
+    in one file it is renamed to ``<base>/<output name>.kml``.
+    """
+
+    def __init__(self, output: Optional[str]):
+        self.output = output
+        self.stream: Optional[TextIO] = None
+        self.count = 0
+        self.total_vertices = 0
+        self.files = []
+        self.part_features = 0
+        self.part_vertices = 0
+        if output:
+            self.base_name = output.rsplit('.', 1)[0]
+            os.makedirs(self.base_name, exist_ok=True)
+
+    def begin(self, page: Dict):
+        if not self.output:
+            self.stream = sys.stdout
+            self.stream.write('\n'.join(KML_HEADER))
+
+    def write(self, rendered: List[Tuple[str, int]]):
+        for text, vertices in rendered:
+            if self.output and (self.stream is None or
+                                (self.part_vertices + vertices > MAX_KML_VERTICES and self.part_features)):
+                self._next_part()
+            self.stream.write(f"\n{text}")
+            self.count += 1
+            self.part_features += 1
+            self.part_vertices += vertices
+            self.total_vertices += vertices
+
+    def close(self):
+        if self.output:
+            if self.stream is None:
+                self._next_part()
+            self._close_part()
+            if len(self.files) == 1 and self.total_vertices <= MAX_KML_VERTICES:
+                filename = os.path.join(self.base_name, os.path.basename(self.output).replace('.kmz', '.kml'))
+                os.replace(self.files[0], filename)
+                self.files = [filename]
+            else:
+                self._report_part()
+        else:
+            self.stream.write('\n' + '\n'.join(KML_FOOTER) + '\n')
+
+    def _next_part(self):
+        if self.stream is not None:
+            self._close_part()
+            self._report_part()
+        filename = os.path.join(self.base_name, f"{os.path.basename(self.base_name)}_part{len(self.files) + 1}.kml")
+        self.files.append(filename)
+        self.stream = open(filename, 'w')
+        self.stream.write('\n'.join(KML_HEADER))
+        self.part_features = 0
+        self.part_vertices = 0
+
+    def _close_part(self):
+        self.stream.write('\n' + '\n'.join(KML_FOOTER))
+        self.stream.close()
+
+    def _report_part(self):
+        print(f"Created {self.files[-1]} with {self.part_features} features and {self.part_vertices} vertices")
+
+
+def export_layer(layer: 'Layer', output: Optional[str], format: str = 'geojson', display_field: Optional[str] = None,
+                 where: str = "1=1", max_workers: int = DEFAULT_MAX_WORKERS, processes: Optional[int] = None,
+                 prefetch: Optional[int] = None, **kwargs) -> Dict:
+    """Export a layer query to a file (or stdout) through the fetch/render/write pipeline.
+
+    Args:
+        layer: Layer to query
+        output: Output file path, or None for stdout
+        format: Output format (pjson, json, geojson, kml or kmz; kmz writes
+            the KML files, the caller packages them)
+        display_field: Display field used for KML placemark names
+        where: SQL where clause
+        max_workers: Concurrent page downloads
+        processes: Rendering processes (default: CPU count); 0 renders in
+            the writer thread
+        prefetch: Pages downloaded ahead of rendering (default 2 x max_workers)
+        **kwargs: Additional query parameters
+
+    Returns:
+        Dictionary with the number of features and pages and the files written
+
+    Raises:
+        RequestException: If a request fails
+    """
+    processes = (os.cpu_count() or 1) if processes is None else processes
+    writer = KmlWriter(output) if format in ('kml', 'kmz') else JsonWriter(output)
+    pages = 0
+
+    # Worker processes are spawned rather than forked because the download
+    # threads are already running when they start
+    pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn')) if processes else None
+    pending: 'deque[Future]' = deque()
+    try:
+        for page in layer.iter_pages(where, format, max_workers, prefetch, **kwargs):
+            if not pages:
+                writer.begin(page)
+            pages += 1
+            features = page.get('features', [])
+            if pool is None:
+                with phase('render'):
+                    rendered = render_page(features, format, display_field)
+                with phase('file write'):
+                    writer.write(rendered)
+                continue
+            pending.append(pool.submit(render_page, features, format, display_field))
+            if len(pending) >= 2 * processes:
+                with phase('file write'):
+                    writer.write(pending.popleft().result())
+        while pending:
+            with phase('file write'):
+                writer.write(pending.popleft().result())
+        if not pages:
+            writer.begin({})
+        writer.close()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    logger.debug(f"Exported {writer.count} features in {pages} pages")
+    return {'features': writer.count, 'pages': pages, 'files': writer.files}
@@ -0,0 +1,111 @@
+import math
+from typing import Dict, List, Optional
+
+from .layer import DEFAULT_MAX_RECORD_COUNT, DEFAULT_MAX_WORKERS, DEFAULT_TILE_GRID, OBJECT_ID_CHUNK_SIZE
+
+
+class QueryPlan:
+    """How a layer query will be executed, as chosen by plan_query."""
+
+    def __init__(self, strategy: str, page_size: int, format: str, concurrency: int,
+                 estimated_count: Optional[int], estimated_requests: Optional[int], reasons: List[str]):
+        self.strategy = strategy
+        self.page_size = page_size
+        self.format = format
+        self.concurrency = concurrency
+        self.estimated_count = estimated_count
+        self.estimated_requests = estimated_requests
+        self.reasons = reasons
+
+    def to_dict(self) -> Dict:
+        return {
+            'strategy': self.strategy,
+            'pageSize': self.page_size,
+            'format': self.format,
+            'concurrency': self.concurrency,
+            'estimatedCount': self.estimated_count,
+            'estimatedRequests': self.estimated_requests,
+            'reasons': self.reasons,
+        }
+
+
+def _supported_formats(layer_data: Dict) -> List[str]:
+    formats = layer_data.get('supportedQueryFormats') or ''
+    return [f.strip().lower() for f in formats.split(',') if f.strip()]
+
+
+def plan_query(layer_data: Dict, total_count: Optional[int] = None, format: str = 'pjson',
+               max_workers: int = DEFAULT_MAX_WORKERS, page_size: Optional[int] = None) -> QueryPlan:
+    """Choose page size, encoding, pagination strategy and concurrency for a query.
+
+    Args:
+        layer_data: Layer JSON as returned by EsriClient.get_layer
+        total_count: Number of matching features, if known
+        format: Requested output format (pjson, json, geojson, kml, kmz)
+        max_workers: Upper bound on concurrent requests
+        page_size: Page size requested by the caller, overriding maxRecordCount
+
+    Returns:
+        QueryPlan describing how to run the query
+    """
+    reasons = []
+    max_record_count = int(layer_data.get('maxRecordCount') or DEFAULT_MAX_RECORD_COUNT)
+    advanced = layer_data.get('advancedQueryCapabilities') or {}
+    formats = _supported_formats(layer_data)
+
+    # Encoding: compact JSON instead of pretty-printed pjson, GeoJSON for KML
+    if format in ('kml', 'kmz', 'geojson'):
+        query_format = 'geojson'
+    elif format == 'pjson':
+        query_format = 'json'
+        reasons.append("requesting compact json instead of pjson; the parsed result is identical")
+    else:
+        query_format = format
+    if formats and query_format not in formats:
+        reasons.append(f"server does not list {query_format} in supportedQueryFormats ({', '.join(formats)})")
+    if advanced.get('supportsPbf') or layer_data.get('supportsPbf'):
+        reasons.append("server supports pbf, but this client decodes JSON only")
+    if advanced.get('supportsQuantization') or layer_data.get('supportsCoordinatesQuantization'):
+        reasons.append("server supports quantization; not applied so output geometry stays exact")
+
+    size = page_size or max_record_count
+    if page_size and page_size > max_record_count:
+        size = max_record_count
+        reasons.append(f"page size capped at maxRecordCount {max_record_count}")
+
+    # Pagination strategy
+    has_oid = bool(layer_data.get('objectIdField') or any(
+        field.get('type') == 'esriFieldTypeOID' for field in layer_data.get('fields') or []))
+    if total_count is not None and total_count <= size:
+        strategy = 'offset'
+        reasons.append(f"{total_count} features fit in a single page")
+    elif advanced.get('supportsPagination'):
+        strategy = 'offset'
+        reasons.append("server supports resultOffset pagination")
+    elif has_oid:
+        strategy = 'objectids'
+        size = min(max_record_count, OBJECT_ID_CHUNK_SIZE)
+        reasons.append("no pagination support; fetching returnIdsOnly results in OBJECTID chunks")
+    elif layer_data.get('extent'):
+        strategy = 'tiles'
+        reasons.append("no pagination or OBJECTID field; splitting the extent into tiles")
+    else:
+        strategy = 'offset'
+        reasons.append("no pagination, OBJECTID field or extent; results may be capped at maxRecordCount")
+
+    # Concurrency and request estimate
+    if total_count is None:
+        pages = None
+    else:
+        pages = max(math.ceil(total_count / size), 1)
+    if strategy == 'tiles':
+        estimated_requests = None if pages is None else DEFAULT_TILE_GRID ** 2 + 3 * pages
+        concurrency = max_workers
+    elif strategy == 'objectids':
+        estimated_requests = None if pages is None else 2 + pages
+        concurrency = max(min(max_workers, pages or 1), 1)
+    else:
+        estimated_requests = None if pages is None else 1 + pages
+        concurrency = max(min(max_workers, pages or 1), 1)
+
+    return QueryPlan(strategy, size, query_format, concurrency, total_count, estimated_requests, reasons)
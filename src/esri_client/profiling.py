@@ -0,0 +1,108 @@
+"""Phase-level timing for the query and export pipeline.
+
+Library code marks its phases with ``phase('name')``; the timings are only
+recorded while a Profiler is active, so the markers cost next to nothing
+otherwise::
+
+    with Profiler(trace_memory=True) as profiler:
+        with phase('my export'):
+            layer.query(where="1=1")
+    print(profiler.report())
+
+Phases entered from worker threads are summed per phase, so a phase that
+runs concurrently can report more seconds than the wall time.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+_active: List['Profiler'] = []
+
+
+class Profiler:
+    """Collects phase timings, and optionally a cProfile dump and peak memory.
+
+    Args:
+        cprofile_path: Write cProfile stats for the profiled thread to this file
+        trace_memory: Track peak Python memory with tracemalloc
+    """
+
+    def __init__(self, cprofile_path: Optional[str] = None, trace_memory: bool = False):
+        self.cprofile_path = cprofile_path
+        self.trace_memory = trace_memory
+        self.phases: Dict[str, Dict] = {}
+        self.lock = threading.Lock()
+        self.elapsed = 0.0
+        self.peak_memory = None
+        self._profile = None
+        self._started = None
+
+    def __enter__(self) -> 'Profiler':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self) -> 'Profiler':
+        if self.trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+        if self.cprofile_path:
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        self._started = time.perf_counter()
+        _active.append(self)
+        return self
+
+    def stop(self):
+        _active.remove(self)
+        self.elapsed = time.perf_counter() - self._started
+        if self._profile:
+            self._profile.disable()
+            self._profile.dump_stats(self.cprofile_path)
+        if self.trace_memory:
+            import tracemalloc
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def record(self, name: str, seconds: float):
+        with self.lock:
+            entry = self.phases.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            entry['seconds'] += seconds
+            entry['calls'] += 1
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def report(self) -> Dict:
+        with self.lock:
+            phases = {name: {'seconds': round(entry['seconds'], 4), 'calls': entry['calls']}
+                      for name, entry in self.phases.items()}
+        report = {'elapsedSeconds': round(self.elapsed, 4), 'phases': phases}
+        if self.peak_memory is not None:
+            report['peakMemoryMB'] = round(self.peak_memory / 1024 / 1024, 2)
+        if self.cprofile_path:
+            report['cprofile'] = self.cprofile_path
+        return report
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Time a block against every active Profiler; a no-op when none is active."""
+    if not _active:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        for profiler in list(_active):
+            profiler.record(name, seconds)
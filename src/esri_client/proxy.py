@@ -0,0 +1,249 @@
+"""Local caching proxy in front of one or more ArcGIS servers.
+
+Each upstream is mounted under a name, so ``http://127.0.0.1:8765/<name>``
+stands in for the upstream's base URL and an EsriClient pointed at it works
+unchanged::
+
+    proxy = CachingProxy({'gis': 'https://gis.example.com/arcgis'}, port=8765).start()
+    client = EsriClient(proxy.url_for('gis'))
+
+Upstream connections are pooled and kept alive. Successful responses are
+cached in memory (catalog, service and layer metadata with its own TTL, LRU
+evicted by size; attachments and images only up to a per-entry size), and
+identical requests arriving while one is in flight wait for that response
+instead of going upstream again.
+"""
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Tuple
+from urllib.parse import parse_qsl, urlparse
+
+import requests
+from requests.exceptions import RequestException
+
+from .metrics import classify_url
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+DEFAULT_TTL = 300
+DEFAULT_METADATA_TTL = 3600
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_ENTRY_BYTES = 8 * 1024 * 1024
+DEFAULT_MAX_CONNECTIONS = 16
+# ESRI reports most errors as HTTP 200 with an error document
+ESRI_ERROR = re.compile(rb'^\s*\{\s*"error"\s*:')
+
+
+class ProxyResponse:
+    """A buffered upstream response."""
+
+    def __init__(self, status: int, content_type: str, body: bytes):
+        self.status = status
+        self.content_type = content_type
+        self.body = body
+
+    @property
+    def cacheable(self) -> bool:
+        return self.status == 200 and not ESRI_ERROR.match(self.body[:64])
+
+
+class CachingProxy:
+    """Caching, request-coalescing HTTP proxy for ArcGIS REST servers.
+
+    Args:
+        upstreams: Mapping of mount name to upstream base URL
+        host: Interface to listen on
+        port: Port to listen on (0 picks a free port)
+        ttl: Seconds to keep query, attachment and image responses
+        metadata_ttl: Seconds to keep catalog, service and layer metadata
+        max_bytes: Maximum total size of cached response bodies
+        max_connections: Upstream connection pool size per host
+        max_entry_bytes: Largest attachment or image body to cache
+    """
+
+    def __init__(self, upstreams: Dict[str, str], host: str = '127.0.0.1', port: int = DEFAULT_PORT,
+                 ttl: float = DEFAULT_TTL, metadata_ttl: float = DEFAULT_METADATA_TTL,
+                 max_bytes: int = DEFAULT_MAX_BYTES, max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                 max_entry_bytes: int = DEFAULT_MAX_ENTRY_BYTES):
+        if not upstreams:
+            raise ValueError("At least one upstream is required")
+        self.upstreams = {name.strip('/'): url.rstrip('/') for name, url in upstreams.items()}
+        self.ttl = ttl
+        self.metadata_ttl = metadata_ttl
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=len(self.upstreams),
+                                                pool_maxsize=max_connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.cache: 'OrderedDict[Tuple, Tuple[float, ProxyResponse]]' = OrderedDict()
+        self.cache_bytes = 0
+        self.in_flight: Dict[Tuple, Dict] = {}
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'hits': 0, 'misses': 0, 'coalesced': 0, 'upstreamErrors': 0}
+        self.httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url_for(self, name: str) -> str:
+        """Base URL to give an EsriClient for the named upstream."""
+        return f"{self.url}/{name}"
+
+    def start(self) -> 'CachingProxy':
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.session.close()
+
+    def __enter__(self) -> 'CachingProxy':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.cache_bytes = 0
+
+    def handle(self, path: str, query: str) -> Tuple[ProxyResponse, str]:
+        """Answer a proxied GET from the cache, an in-flight request or upstream.
+
+        Args:
+            path: Request path, starting with the upstream's mount name
+            query: Raw query string
+
+        Returns:
+            Tuple of (response, cache status: HIT, MISS or COALESCED)
+
+        Raises:
+            LookupError: If the path does not start with a known mount name
+        """
+        name, _, rest = path.strip('/').partition('/')
+        if name not in self.upstreams:
+            raise LookupError(name)
+        params = parse_qsl(query, keep_blank_values=True)
+        key = (name, rest, tuple(sorted(params)))
+
+        with self.lock:
+            self.stats['requests'] += 1
+            cached = self.cache.get(key)
+            if cached and cached[0] > time.monotonic():
+                self.cache.move_to_end(key)
+                self.stats['hits'] += 1
+                return cached[1], 'HIT'
+            waiter = self.in_flight.get(key)
+            if waiter is None:
+                self.in_flight[key] = waiter = {'done': threading.Event(), 'response': None}
+                leader = True
+                self.stats['misses'] += 1
+            else:
+                leader = False
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            waiter['done'].wait()
+            return waiter['response'] or _error_response('Upstream request failed'), 'COALESCED'
+
+        response = None
+        try:
+            response = self._fetch(f"{self.upstreams[name]}/{rest}", params)
+            url_class = classify_url(f"/{rest}", dict(params))
+            if url_class in ('attachment', 'tile') and len(response.body) > self.max_entry_bytes:
+                logger.debug(f"Not caching {len(response.body)} byte {url_class} response for {rest}")
+            elif response.cacheable:
+                self._store(key, response, self.metadata_ttl if url_class in ('catalog', 'layer') else self.ttl)
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+            waiter['response'] = response
+            waiter['done'].set()
+        return response, 'MISS'
+
+    def _fetch(self, url: str, params: Iterable[Tuple[str, str]]) -> ProxyResponse:
+        try:
+            response = self.session.get(url, params=list(params), timeout=60)
+        except RequestException as e:
+            logger.debug(f"Upstream request failed for {url}: {e}")
+            with self.lock:
+                self.stats['upstreamErrors'] += 1
+            return _error_response(f"Upstream request failed: {type(e).__name__}")
+        return ProxyResponse(response.status_code, response.headers.get('Content-Type', 'application/json'),
+                             response.content)
+
+    def _store(self, key: Tuple, response: ProxyResponse, ttl: float):
+        size = len(response.body)
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.cache.pop(key, None)
+            if previous:
+                self.cache_bytes -= len(previous[1].body)
+            self.cache[key] = (time.monotonic() + ttl, response)
+            self.cache_bytes += size
+            while self.cache_bytes > self.max_bytes:
+                _, (_, evicted) = self.cache.popitem(last=False)
+                self.cache_bytes -= len(evicted.body)
+
+
+def _error_response(message: str, status: int = 502) -> ProxyResponse:
+    body = json.dumps({'error': {'code': status, 'message': message, 'details': []}})
+    return ProxyResponse(status, 'application/json', body.encode('utf-8'))
+
+
+def _make_handler(proxy: CachingProxy):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            try:
+                response, status = proxy.handle(parsed.path, parsed.query)
+            except LookupError:
+                response = _error_response('Unknown upstream', 404)
+                status = 'MISS'
+            self.send_response(response.status)
+            self.send_header('Content-Type', response.content_type)
+            self.send_header('Content-Length', str(len(response.body)))
+            self.send_header('X-Cache', status)
+            self.end_headers()
+            self.wfile.write(response.body)
+
+    return Handler
+
+
+def parse_upstreams(values: Iterable[str]) -> Dict[str, str]:
+    """Parse ``name=URL`` upstream definitions.
+
+    Raises:
+        ValueError: If a definition has no name or URL
+    """
+    upstreams = {}
+    for value in values:
+        name, _, url = value.partition('=')
+        if not name or not url:
+            raise ValueError(f"Upstream '{value}' must look like name=https://server/arcgis")
+        upstreams[name] = url
+    return upstreams
@@ -0,0 +1,190 @@
+"""Regionated KMZ output: a quadtree of KML files loaded by level of detail.
+
+Features are sorted largest first and inserted into a quadtree over their
+extent: each node keeps up to ``node_features`` of them and passes the rest
+to the child quadrant holding their centre. Every node becomes its own KML
+file with a ``<Region>`` and ``<Lod>``, and parents link to their children
+with ``onRegion`` NetworkLinks, so a viewer only loads and draws the nodes in
+view at a sufficient size. Geometries are drawn simplified to the node's
+resolution; features that lost vertices get a second, full-detail
+placemark that only appears once the node is large on screen.
+"""
+import copy
+import os
+import zipfile
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .kml import KML_FOOTER, KML_HEADER, create_kml_placemark
+from .simplify import geometry_lines, simplify_line
+
+DEFAULT_NODE_FEATURES = 1000
+MAX_DEPTH = 12
+# A node's region becomes active at MIN_LOD_PIXELS on screen; the simplified
+# geometry is drawn up to DETAIL_LOD_PIXELS, the full geometry beyond it
+MIN_LOD_PIXELS = 128
+DETAIL_LOD_PIXELS = 1024
+
+BBox = Tuple[float, float, float, float]
+
+
+class RegionNode:
+    """Quadtree node holding features drawn at its level of detail."""
+
+    def __init__(self, bbox: BBox, name: str, depth: int):
+        self.bbox = bbox
+        self.name = name
+        self.depth = depth
+        self.features: List[Dict] = []
+        self.children: Dict[int, 'RegionNode'] = {}
+
+    def child(self, quadrant: int) -> 'RegionNode':
+        if quadrant not in self.children:
+            west, south, east, north = self.bbox
+            mid_x, mid_y = (west + east) / 2, (south + north) / 2
+            bounds = [(west, south, mid_x, mid_y), (mid_x, south, east, mid_y),
+                      (west, mid_y, mid_x, north), (mid_x, mid_y, east, north)]
+            self.children[quadrant] = RegionNode(bounds[quadrant], f"{self.name}{quadrant}", self.depth + 1)
+        return self.children[quadrant]
+
+    def quadrant(self, x: float, y: float) -> int:
+        west, south, east, north = self.bbox
+        return (1 if x >= (west + east) / 2 else 0) + (2 if y >= (south + north) / 2 else 0)
+
+    def walk(self) -> Iterator['RegionNode']:
+        yield self
+        for quadrant in sorted(self.children):
+            yield from self.children[quadrant].walk()
+
+
+def feature_bbox(feature: Dict) -> Optional[BBox]:
+    """Bounding box of a GeoJSON feature's geometry, or None without coordinates."""
+    xs, ys = [], []
+    for x, y in _positions((feature.get('geometry') or {}).get('coordinates')):
+        xs.append(x)
+        ys.append(y)
+    if not xs:
+        return None
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def build_quadtree(features: Sequence[Dict], node_features: int = DEFAULT_NODE_FEATURES,
+                   max_depth: int = MAX_DEPTH) -> Optional[RegionNode]:
+    """Build the region quadtree for GeoJSON features; None if none has a geometry."""
+    boxed = [(bbox, feature) for feature in features for bbox in [feature_bbox(feature)] if bbox]
+    if not boxed:
+        return None
+    west = min(b[0] for b, _ in boxed)
+    south = min(b[1] for b, _ in boxed)
+    east = max(b[2] for b, _ in boxed)
+    north = max(b[3] for b, _ in boxed)
+    root = RegionNode((west, south, east, north), 'r', 0)
+
+    # Largest first, so coarse levels show the features that matter at that scale
+    boxed.sort(key=lambda item: (item[0][2] - item[0][0]) * (item[0][3] - item[0][1]), reverse=True)
+    for (x_min, y_min, x_max, y_max), feature in boxed:
+        node = root
+        x, y = (x_min + x_max) / 2, (y_min + y_max) / 2
+        while len(node.features) >= node_features and node.depth < max_depth:
+            node = node.child(node.quadrant(x, y))
+        node.features.append(feature)
+    return root
+
+
+def region_kml(bbox: BBox, min_pixels: int = MIN_LOD_PIXELS, max_pixels: int = -1) -> List[str]:
+    west, south, east, north = bbox
+    return [
+        '<Region>',
+        f'<LatLonAltBox><north>{north}</north><south>{south}</south><east>{east}</east><west>{west}</west></LatLonAltBox>',
+        f'<Lod><minLodPixels>{min_pixels}</minLodPixels><maxLodPixels>{max_pixels}</maxLodPixels></Lod>',
+        '</Region>',
+    ]
+
+
+def node_kml(node: RegionNode, display_field: Optional[str] = None, href_prefix: str = '') -> str:
+    """Render one quadtree node: its region, placemarks and links to its children."""
+    west, south, east, north = node.bbox
+    tolerance = max(east - west, north - south) / DETAIL_LOD_PIXELS
+    lines = list(KML_HEADER) + [f'<name>{node.name}</name>'] + region_kml(node.bbox)
+
+    for feature in node.features:
+        simplified = _simplified(feature, tolerance)
+        if simplified is feature:
+            lines.extend(create_kml_placemark(feature, display_field) or [])
+            continue
+        lines.extend(_with_region(create_kml_placemark(simplified, display_field),
+                                  region_kml(node.bbox, MIN_LOD_PIXELS, DETAIL_LOD_PIXELS)))
+        lines.extend(_with_region(create_kml_placemark(feature, display_field),
+                                  region_kml(node.bbox, DETAIL_LOD_PIXELS, -1)))
+
+    for quadrant in sorted(node.children):
+        child = node.children[quadrant]
+        lines.extend(['<NetworkLink>', f'<name>{child.name}</name>'] + region_kml(child.bbox) + [
+            '<Link>',
+            f'<href>{href_prefix}{child.name}.kml</href>',
+            '<viewRefreshMode>onRegion</viewRefreshMode>',
+            '</Link>',
+            '</NetworkLink>',
+        ])
+    lines.extend(KML_FOOTER)
+    return '\n'.join(lines)
+
+
+def write_regionated_kmz(features: Sequence[Dict], path: str, display_field: Optional[str] = None,
+                         node_features: int = DEFAULT_NODE_FEATURES) -> Dict:
+    """Write a regionated KMZ: ``doc.kml`` is the root node and the others live in ``regions/``.
+
+    Args:
+        features: GeoJSON features in WGS84
+        path: KMZ file to write
+        display_field: Display field used for placemark names
+        node_features: Maximum features drawn by one node
+
+    Returns:
+        Dictionary with the number of nodes, the tree depth and the feature count
+    """
+    root = build_quadtree(features, node_features)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    nodes = list(root.walk()) if root else []
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as kmz:
+        if root is None:
+            kmz.writestr('doc.kml', '\n'.join(KML_HEADER + KML_FOOTER))
+        for node in nodes:
+            if node is root:
+                kmz.writestr('doc.kml', node_kml(node, display_field, href_prefix='regions/'))
+            else:
+                kmz.writestr(f'regions/{node.name}.kml', node_kml(node, display_field))
+    return {
+        'nodes': len(nodes),
+        'depth': max((node.depth for node in nodes), default=0),
+        'features': sum(len(node.features) for node in nodes),
+    }
+
+
+def _positions(coords) -> Iterator[Tuple[float, float]]:
+    if not coords:
+        return
+    if isinstance(coords[0], (int, float)):
+        yield coords[0], coords[1]
+        return
+    for part in coords:
+        yield from _positions(part)
+
+
+def _simplified(feature: Dict, tolerance: float) -> Dict:
+    """Copy of the feature simplified to the tolerance, or the feature itself if nothing changes."""
+    simplified_lines = [simplify_line(line, tolerance) for line in geometry_lines(feature.get('geometry'))]
+    if all(len(new) == len(line) for new, line in zip(simplified_lines, geometry_lines(feature.get('geometry')))):
+        return feature
+    simplified = dict(feature, geometry=copy.deepcopy(feature['geometry']))
+    for line, new in zip(geometry_lines(simplified['geometry']), simplified_lines):
+        line[:] = new
+    return simplified
+
+
+def _with_region(placemark: Optional[List[str]], region: List[str]) -> List[str]:
+    """Insert a Region after a placemark's name and description."""
+    if not placemark:
+        return []
+    return placemark[:3] + region + placemark[3:]
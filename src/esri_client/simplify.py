@@ -0,0 +1,129 @@
+"""Vertex-budget simplification of line and polygon geometries.
+
+Douglas-Peucker is run once per line or ring to give every vertex an
+importance: the distance at which the algorithm would first keep it, capped
+by its parent's importance so that keeping a vertex keeps the vertices it
+depends on. Simplifying to a vertex budget is then a matter of keeping the
+highest-importance vertices, which is the same as running Douglas-Peucker
+with the largest tolerance that fits the budget. Line end points and the two
+most important vertices of each ring are always kept, so rings stay valid
+polygons; points are never simplified.
+"""
+import math
+from typing import Dict, List, Optional, Sequence
+
+INFINITY = float('inf')
+
+
+def vertex_importance(coords: Sequence[Sequence[float]]) -> List[float]:
+    """Douglas-Peucker importance of each vertex of a line or closed ring."""
+    n = len(coords)
+    importance = [0.0] * n
+    if n == 0:
+        return importance
+    importance[0] = importance[-1] = INFINITY
+    stack = [(0, n - 1, INFINITY)]
+    while stack:
+        first, last, parent = stack.pop()
+        if last - first < 2:
+            continue
+        index, distance = _farthest(coords, first, last)
+        importance[index] = min(distance, parent)
+        stack.append((first, index, importance[index]))
+        stack.append((index, last, importance[index]))
+    if n > 3 and coords[0] == coords[-1]:
+        # Keep a triangle so a ring never collapses
+        for index in sorted(range(1, n - 1), key=importance.__getitem__)[-2:]:
+            importance[index] = INFINITY
+    return importance
+
+
+def simplify_line(coords: Sequence[Sequence[float]], tolerance: float) -> List:
+    """Douglas-Peucker simplification of one line or ring with a distance tolerance."""
+    return [c for c, weight in zip(coords, vertex_importance(coords)) if weight > tolerance]
+
+
+def geometry_lines(geometry: Optional[Dict]) -> List[List]:
+    """Return the coordinate lists (lines and rings) of a GeoJSON or Esri JSON geometry."""
+    if not geometry:
+        return []
+    # Esri JSON polygons and polylines
+    if 'rings' in geometry or 'paths' in geometry:
+        return list(geometry.get('rings') or geometry.get('paths') or [])
+    geometry_type = geometry.get('type')
+    coords = geometry.get('coordinates') or []
+    if geometry_type == 'LineString':
+        return [coords]
+    if geometry_type in ('Polygon', 'MultiLineString'):
+        return list(coords)
+    if geometry_type == 'MultiPolygon':
+        return [ring for polygon in coords for ring in polygon]
+    return []
+
+
+def count_vertices(features: Sequence[Dict]) -> int:
+    """Count the vertices of the lines and rings of features."""
+    return sum(len(line) for feature in features for line in geometry_lines(feature.get('geometry')))
+
+
+def simplify_features(features: List[Dict], max_vertices: int) -> Dict:
+    """Simplify features in place so their lines and rings total at most max_vertices.
+
+    Vertices that are always kept (line ends, ring triangles) count toward
+    the budget, so it cannot be met when they alone exceed it.
+
+    Args:
+        features: GeoJSON or Esri JSON features; their coordinates are replaced
+        max_vertices: Vertex budget over all lines and rings
+
+    Returns:
+        Dictionary with verticesBefore, verticesAfter, verticesRemoved and
+        the equivalent Douglas-Peucker tolerance (None if nothing was removed)
+    """
+    lines = [line for feature in features for line in geometry_lines(feature.get('geometry'))]
+    before = sum(len(line) for line in lines)
+    report = {'verticesBefore': before, 'verticesAfter': before, 'verticesRemoved': 0, 'tolerance': None}
+    if before <= max_vertices:
+        return report
+
+    importances = [vertex_importance(line) for line in lines]
+    optional = sorted((w for weights in importances for w in weights if w != INFINITY), reverse=True)
+    keep = max_vertices - (before - len(optional))
+    if keep <= 0:
+        tolerance = optional[0] if optional else INFINITY
+    elif keep >= len(optional):
+        return report
+    else:
+        tolerance = optional[keep]
+
+    for line, weights in zip(lines, importances):
+        line[:] = [c for c, weight in zip(line, weights) if weight > tolerance or weight == INFINITY]
+
+    after = sum(len(line) for line in lines)
+    report.update(verticesAfter=after, verticesRemoved=before - after, tolerance=tolerance)
+    return report
+
+
+def geometry_precision(tolerance: float) -> int:
+    """Decimal places needed to keep coordinates accurate to a tenth of the tolerance."""
+    if tolerance <= 0:
+        return 8
+    return max(0, math.ceil(-math.log10(tolerance)) + 1)
+
+
+def _farthest(coords: Sequence[Sequence[float]], first: int, last: int):
+    ax, ay = coords[first][0], coords[first][1]
+    bx, by = coords[last][0], coords[last][1]
+    dx, dy = bx - ax, by - ay
+    length_squared = dx * dx + dy * dy
+    best_index, best_distance = first + 1, -1.0
+    for index in range(first + 1, last):
+        px, py = coords[index][0], coords[index][1]
+        if length_squared == 0:
+            distance = math.hypot(px - ax, py - ay)
+        else:
+            t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length_squared))
+            distance = math.hypot(px - ax - t * dx, py - ay - t * dy)
+        if distance > best_distance:
+            best_index, best_distance = index, distance
+    return best_index, best_distance
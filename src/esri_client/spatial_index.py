@@ -0,0 +1,362 @@
+"""Offline spatial index for containment and nearest-feature lookups.
+
+build_index writes a layer's features to a single file holding an
+STR-packed R-tree over their bounding boxes and the exact geometries and
+attributes; SpatialIndex memory-maps the file, so opening it only reads
+the header and lookups touch just the pages they need.
+
+File layout (little-endian, sections aligned to 8 bytes)::
+
+    header     magic, node capacity, level count, feature count,
+               metadata offset and length
+    metadata   JSON (spatial reference, source)
+    levels     (entry count, box offset) per tree level, leaves first
+    boxes      xmin, ymin, xmax, ymax doubles per entry, per level
+    offsets    feature count + 1 record offsets
+    records    per feature: kind, part count, attribute length, vertex
+               count per part, x/y doubles, attribute JSON
+
+Leaves are the features in STR order (sorted into vertical slices by x,
+then by y within each slice), and entry ``i`` of a level groups entries
+``i * capacity`` up to ``(i + 1) * capacity`` of the level below, so the
+tree needs no child pointers.
+"""
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'ESRIIDX1'
+HEADER = struct.Struct('<8sIIQQQ')
+LEVEL = struct.Struct('<QQ')
+RECORD = struct.Struct('<III')
+DEFAULT_NODE_CAPACITY = 16
+
+POINT, LINE, POLYGON = 0, 1, 2
+
+
+def build_index(features: Iterable[Dict], path: str, node_capacity: int = DEFAULT_NODE_CAPACITY,
+                metadata: Optional[Dict] = None, temp_dir: Optional[str] = None) -> Dict:
+    """Write a spatial index file for GeoJSON or Esri JSON features.
+
+    Features are streamed to a temporary file as they arrive, so only their
+    bounding boxes are held in memory; features without coordinates are
+    skipped.
+
+    Args:
+        features: Features, e.g. from ``Layer.iter_pages`` pages
+        path: Index file to write
+        node_capacity: Entries per tree node
+        metadata: JSON-serializable metadata stored with the index
+        temp_dir: Directory for the temporary record file
+
+    Returns:
+        Dictionary with the number of indexed and skipped features, the
+        tree depth and the file size
+
+    Raises:
+        ValueError: If node_capacity is less than 2
+    """
+    if node_capacity < 2:
+        raise ValueError("node_capacity must be at least 2")
+    boxes = array('d')
+    spans = array('Q')
+    skipped = 0
+    with tempfile.TemporaryFile(dir=temp_dir) as records:
+        for feature in features:
+            kind, parts = geometry_parts(feature.get('geometry'))
+            if not any(parts):
+                skipped += 1
+                continue
+            xs = [vertex[0] for part in parts for vertex in part]
+            ys = [vertex[1] for part in parts for vertex in part]
+            boxes.extend((min(xs), min(ys), max(xs), max(ys)))
+            record = _encode_record(kind, parts, feature.get('properties', feature.get('attributes')) or {})
+            spans.extend((records.tell(), len(record)))
+            records.write(record)
+
+        count = len(spans) // 2
+        order = _str_order(boxes, count, node_capacity)
+        levels = [array('d', (boxes[4 * i + k] for i in order for k in range(4)))]
+        while len(levels[-1]) > 4 * node_capacity:
+            levels.append(_parent_boxes(levels[-1], node_capacity))
+
+        meta = json.dumps(metadata or {}).encode('utf-8')
+        offset = _align(HEADER.size + len(meta))
+        level_table = []
+        offset += LEVEL.size * len(levels)
+        for level in levels:
+            level_table.append((len(level) // 4, offset))
+            offset += len(level) * 8
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'wb') as out:
+            out.write(HEADER.pack(MAGIC, node_capacity, len(levels), count, HEADER.size, len(meta)))
+            out.write(meta)
+            out.write(b'\0' * (_align(HEADER.size + len(meta)) - HEADER.size - len(meta)))
+            for entries, box_offset in level_table:
+                out.write(LEVEL.pack(entries, box_offset))
+            for level in levels:
+                level.tofile(out)
+            record_offsets = array('Q', [0])
+            for i in order:
+                record_offsets.append(record_offsets[-1] + spans[2 * i + 1])
+            record_offsets.tofile(out)
+            for i in order:
+                records.seek(spans[2 * i])
+                out.write(records.read(spans[2 * i + 1]))
+            size = out.tell()
+    logger.debug(f"Indexed {count} features in {len(levels)} levels ({size} bytes), skipped {skipped}")
+    return {'features': count, 'skipped': skipped, 'levels': len(levels), 'bytes': size}
+
+
+class SpatialIndex:
+    """Read-only, memory-mapped view of an index written by build_index.
+
+    Distances are in the units of the features' coordinates.
+
+    Args:
+        path: Index file
+
+    Raises:
+        ValueError: If the file is not a spatial index
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.levels = []
+        self.offsets = self._view = None
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"{path} is not a spatial index")
+        if len(self._mmap) < HEADER.size or self._mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a spatial index")
+        _, self.node_capacity, level_count, self.count, meta_offset, meta_length = HEADER.unpack_from(self._mmap)
+        self.metadata = json.loads(self._mmap[meta_offset:meta_offset + meta_length])
+        view = memoryview(self._mmap)
+        table = _align(meta_offset + meta_length)
+        for level in range(level_count):
+            entries, box_offset = LEVEL.unpack_from(self._mmap, table + level * LEVEL.size)
+            self.levels.append(view[box_offset:box_offset + entries * 32].cast('d'))
+            end = box_offset + entries * 32
+        offsets_start = end if level_count else table
+        self.offsets = view[offsets_start:offsets_start + 8 * (self.count + 1)].cast('Q')
+        self.records_start = offsets_start + 8 * (self.count + 1)
+        self._view = view
+
+    def __len__(self) -> int:
+        return self.count
+
+    def candidates(self, x: float, y: float) -> Iterator[int]:
+        """Yield the features whose bounding box contains the point."""
+        if not self.levels:
+            return
+        capacity = self.node_capacity
+        top = len(self.levels) - 1
+        stack = [(top, i) for i in range(len(self.levels[top]) // 4 - 1, -1, -1)]
+        while stack:
+            level, i = stack.pop()
+            boxes = self.levels[level]
+            j = 4 * i
+            if boxes[j] <= x <= boxes[j + 2] and boxes[j + 1] <= y <= boxes[j + 3]:
+                if level == 0:
+                    yield i
+                else:
+                    below = len(self.levels[level - 1]) // 4
+                    stack.extend((level - 1, child) for child in
+                                 range(min((i + 1) * capacity, below) - 1, i * capacity - 1, -1))
+
+    def containing(self, x: float, y: float) -> List[int]:
+        """Return the polygon features containing the point."""
+        return [i for i in self.candidates(x, y) if self._contains(i, x, y)]
+
+    def contains(self, x: float, y: float) -> Optional[int]:
+        """Return the first polygon feature containing the point, or None."""
+        return next((i for i in self.candidates(x, y) if self._contains(i, x, y)), None)
+
+    def nearest(self, x: float, y: float, k: int = 1) -> List[Tuple[int, float]]:
+        """Return the k features closest to the point as (feature, distance), nearest first.
+
+        The distance is 0 inside a polygon and otherwise the distance to the
+        closest vertex or segment.
+        """
+        if not self.levels or k < 1:
+            return []
+        capacity = self.node_capacity
+        top = len(self.levels) - 1
+        heap = [(_box_distance(self.levels[top], i, x, y), top, i) for i in range(len(self.levels[top]) // 4)]
+        heapq.heapify(heap)
+        results = []
+        while heap and len(results) < k:
+            distance, level, i = heapq.heappop(heap)
+            if level < 0:
+                results.append((i, distance))
+            elif level == 0:
+                heapq.heappush(heap, (self.distance(i, x, y), -1, i))
+            else:
+                boxes = self.levels[level - 1]
+                for child in range(i * capacity, min((i + 1) * capacity, len(boxes) // 4)):
+                    heapq.heappush(heap, (_box_distance(boxes, child, x, y), level - 1, child))
+        return results
+
+    def distance(self, feature: int, x: float, y: float) -> float:
+        """Distance from the point to a feature's geometry."""
+        kind, counts, coords = self.geometry(feature)
+        if kind == POLYGON and _in_rings(counts, coords, x, y):
+            return 0.0
+        best = math.inf
+        start = 0
+        for count in counts:
+            end = start + 2 * count
+            if count == 1 or kind == POINT:
+                for j in range(start, end, 2):
+                    best = min(best, math.hypot(coords[j] - x, coords[j + 1] - y))
+            else:
+                for j in range(start, end - 2, 2):
+                    best = min(best, _segment_distance(x, y, coords[j], coords[j + 1], coords[j + 2], coords[j + 3]))
+            start = end
+        return best
+
+    def geometry(self, feature: int) -> Tuple[int, Tuple[int, ...], List[float]]:
+        """Return a feature's kind, vertex count per part and flat x/y coordinates."""
+        offset = self.records_start + self.offsets[feature]
+        kind, part_count, _ = RECORD.unpack_from(self._mmap, offset)
+        counts = struct.unpack_from(f'<{part_count}I', self._mmap, offset + RECORD.size)
+        start = _align(offset + RECORD.size + 4 * part_count)
+        return kind, counts, self._view[start:start + 16 * sum(counts)].cast('d').tolist()
+
+    def attributes(self, feature: int) -> Dict:
+        """Return a feature's attributes."""
+        offset = self.records_start + self.offsets[feature]
+        _, part_count, length = RECORD.unpack_from(self._mmap, offset)
+        counts = struct.unpack_from(f'<{part_count}I', self._mmap, offset + RECORD.size)
+        start = _align(offset + RECORD.size + 4 * part_count) + 16 * sum(counts)
+        return json.loads(self._mmap[start:start + length])
+
+    def _contains(self, feature: int, x: float, y: float) -> bool:
+        kind, counts, coords = self.geometry(feature)
+        return kind == POLYGON and _in_rings(counts, coords, x, y)
+
+    def close(self):
+        """Release the memory map and close the file."""
+        for view in self.levels + [self.offsets, self._view]:
+            if view is not None:
+                view.release()
+        self.levels = []
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> 'SpatialIndex':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def geometry_parts(geometry: Optional[Dict]) -> Tuple[int, List[Sequence[Sequence[float]]]]:
+    """Return the kind (POINT, LINE or POLYGON) and vertex lists of a GeoJSON or Esri JSON geometry."""
+    if not geometry:
+        return POINT, []
+    if 'rings' in geometry:
+        return POLYGON, geometry['rings'] or []
+    if 'paths' in geometry:
+        return LINE, geometry['paths'] or []
+    if 'points' in geometry:
+        return POINT, [[point] for point in geometry['points'] or []]
+    if 'x' in geometry:
+        return POINT, [[(geometry['x'], geometry['y'])]] if geometry['x'] is not None else []
+    coords = geometry.get('coordinates') or []
+    geometry_type = geometry.get('type')
+    if geometry_type == 'Point':
+        return POINT, [[coords]] if coords else []
+    if geometry_type == 'MultiPoint':
+        return POINT, [[point] for point in coords]
+    if geometry_type == 'LineString':
+        return LINE, [coords]
+    if geometry_type == 'MultiLineString':
+        return LINE, list(coords)
+    if geometry_type == 'Polygon':
+        return POLYGON, list(coords)
+    if geometry_type == 'MultiPolygon':
+        return POLYGON, [ring for polygon in coords for ring in polygon]
+    return POINT, []
+
+
+def _encode_record(kind: int, parts: List[Sequence[Sequence[float]]], attributes: Dict) -> bytes:
+    attribute_bytes = json.dumps(attributes, separators=(',', ':')).encode('utf-8')
+    head = RECORD.pack(kind, len(parts), len(attribute_bytes)) + array('I', [len(part) for part in parts]).tobytes()
+    coords = array('d', (float(c) for part in parts for vertex in part for c in vertex[:2]))
+    record = head + b'\0' * (_align(len(head)) - len(head)) + coords.tobytes() + attribute_bytes
+    return record + b'\0' * (_align(len(record)) - len(record))
+
+
+def _str_order(boxes: array, count: int, capacity: int) -> List[int]:
+    """Sort-Tile-Recursive order: vertical slices by x centre, each sorted by y centre."""
+    leaves = math.ceil(count / capacity)
+    slice_size = capacity * max(math.ceil(math.sqrt(leaves)), 1)
+    by_x = sorted(range(count), key=lambda i: boxes[4 * i] + boxes[4 * i + 2])
+    order = []
+    for start in range(0, count, slice_size):
+        order.extend(sorted(by_x[start:start + slice_size], key=lambda i: boxes[4 * i + 1] + boxes[4 * i + 3]))
+    return order
+
+
+def _parent_boxes(boxes: array, capacity: int) -> array:
+    parents = array('d')
+    entries = len(boxes) // 4
+    for first in range(0, entries, capacity):
+        last = min(first + capacity, entries)
+        parents.extend((min(boxes[4 * i] for i in range(first, last)),
+                        min(boxes[4 * i + 1] for i in range(first, last)),
+                        max(boxes[4 * i + 2] for i in range(first, last)),
+                        max(boxes[4 * i + 3] for i in range(first, last))))
+    return parents
+
+
+def _in_rings(counts: Sequence[int], coords: List[float], x: float, y: float) -> bool:
+    """Even-odd point-in-polygon test over all rings."""
+    inside = False
+    start = 0
+    for count in counts:
+        end = start + 2 * count
+        if count:
+            x_prev, y_prev = coords[end - 2], coords[end - 1]
+            for j in range(start, end, 2):
+                x_cur, y_cur = coords[j], coords[j + 1]
+                if (y_cur > y) != (y_prev > y) and x < (x_prev - x_cur) * (y - y_cur) / (y_prev - y_cur) + x_cur:
+                    inside = not inside
+                x_prev, y_prev = x_cur, y_cur
+        start = end
+    return inside
+
+
+def _box_distance(boxes, i: int, x: float, y: float) -> float:
+    j = 4 * i
+    dx = max(boxes[j] - x, 0.0, x - boxes[j + 2])
+    dy = max(boxes[j + 1] - y, 0.0, y - boxes[j + 3])
+    return math.hypot(dx, dy)
+
+
+def _segment_distance(x: float, y: float, ax: float, ay: float, bx: float, by: float) -> float:
+    dx, dy = bx - ax, by - ay
+    length_squared = dx * dx + dy * dy
+    t = 0.0 if length_squared == 0 else max(0.0, min(1.0, ((x - ax) * dx + (y - ay) * dy) / length_squared))
+    return math.hypot(x - ax - t * dx, y - ay - t * dy)
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
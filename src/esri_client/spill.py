@@ -0,0 +1,97 @@
+"""Feature lists that spill to disk past a memory budget.
+
+SpillingFeatureList collects query pages in memory until their estimated
+size passes ``max_bytes``; later pages are appended to an anonymous temporary
+file as length-prefixed compact JSON records and read back one page at a time
+when the list is iterated. Output code streams through ``iter_pages()``
+instead of holding the whole result.
+"""
+import json
+import logging
+import struct
+import tempfile
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Decoded features take several times their compact JSON size in memory
+MEMORY_PER_JSON_BYTE = 4
+RECORD_HEADER = struct.Struct('<Q')
+
+
+class SpillingFeatureList:
+    """Append-only feature sequence with a memory budget.
+
+    Args:
+        max_bytes: Approximate memory budget for features held in memory
+        directory: Directory for the spill file (default: the system temp dir)
+    """
+
+    def __init__(self, max_bytes: int, directory: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.memory_pages: List[List[Dict]] = []
+        self.memory_bytes = 0
+        self.spilled_pages = 0
+        self.spilled_bytes = 0
+        self.count = 0
+        self._file = None
+
+    @property
+    def spilled(self) -> bool:
+        return self._file is not None
+
+    def extend(self, features: List[Dict]):
+        """Append a page of features, spilling it to disk if it would exceed the budget."""
+        if not features:
+            return
+        self.count += len(features)
+        encoded = json.dumps(features, separators=(',', ':')).encode('utf-8')
+        size = len(encoded) * MEMORY_PER_JSON_BYTE
+        if not self.spilled and self.memory_bytes + size <= self.max_bytes:
+            self.memory_pages.append(features)
+            self.memory_bytes += size
+            return
+        if not self.spilled:
+            self._file = tempfile.TemporaryFile(dir=self.directory)
+            logger.debug(f"Memory budget of {self.max_bytes} bytes reached after {self.count - len(features)} "
+                         f"features, spilling to disk")
+        self._file.seek(0, 2)
+        self._file.write(RECORD_HEADER.pack(len(encoded)))
+        self._file.write(encoded)
+        self.spilled_pages += 1
+        self.spilled_bytes += len(encoded)
+
+    def iter_pages(self) -> Iterator[List[Dict]]:
+        """Yield the features page by page: in-memory pages, then spilled pages read back from disk."""
+        yield from self.memory_pages
+        if not self.spilled:
+            return
+        position = 0
+        for _ in range(self.spilled_pages):
+            self._file.seek(position)
+            (length,) = RECORD_HEADER.unpack(self._file.read(RECORD_HEADER.size))
+            page = json.loads(self._file.read(length))
+            position += RECORD_HEADER.size + length
+            yield page
+
+    def __iter__(self) -> Iterator[Dict]:
+        for page in self.iter_pages():
+            yield from page
+
+    def __len__(self) -> int:
+        return self.count
+
+    def close(self):
+        """Delete the spill file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.memory_pages = []
+        self.spilled_pages = 0
+
+    def __enter__(self) -> 'SpillingFeatureList':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
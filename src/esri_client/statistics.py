@@ -0,0 +1,130 @@
+"""Layer statistics: outStatistics definitions and local aggregation.
+
+Statistics are described as ArcGIS ``outStatistics`` entries
+(``statisticType``, ``onStatisticField``, ``outStatisticFieldName``), built
+from ``type:field[:name]`` specs by statistic_definition. When a server
+cannot compute them, StatisticsAggregator computes the same rows from the
+features as they stream past, keeping only one running total per group
+and statistic.
+"""
+import math
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+
+STATISTIC_TYPES = ('count', 'sum', 'min', 'max', 'avg', 'stddev', 'var')
+
+
+def statistic_definition(spec: Union[str, Dict]) -> Dict:
+    """Build an outStatistics entry from a ``type:field[:name]`` spec or a dictionary.
+
+    Args:
+        spec: e.g. ``"sum:POPULATION:total_pop"``, or an outStatistics entry
+
+    Returns:
+        Dictionary with statisticType, onStatisticField and outStatisticFieldName
+
+    Raises:
+        ValueError: If the spec is malformed or the statistic type is unknown
+    """
+    if isinstance(spec, dict):
+        statistic_type, field, name = (spec.get('statisticType'), spec.get('onStatisticField'),
+                                       spec.get('outStatisticFieldName'))
+    else:
+        parts = spec.split(':')
+        if len(parts) not in (2, 3):
+            raise ValueError(f"Invalid statistic '{spec}', expected TYPE:FIELD[:NAME]")
+        statistic_type, field, name = parts[0], parts[1], parts[2] if len(parts) == 3 else None
+    statistic_type = (statistic_type or '').lower()
+    if statistic_type not in STATISTIC_TYPES:
+        raise ValueError(f"Unknown statistic type '{statistic_type}', expected one of {', '.join(STATISTIC_TYPES)}")
+    if not field:
+        raise ValueError(f"Statistic '{statistic_type}' needs a field")
+    return {'statisticType': statistic_type, 'onStatisticField': field,
+            'outStatisticFieldName': name or f"{statistic_type}_{field}"}
+
+
+class StatisticsAggregator:
+    """Streaming group-by aggregation matching the server's outStatistics.
+
+    Null values are ignored, like SQL aggregates; ``stddev`` and ``var`` are
+    sample statistics computed with Welford's method.
+
+    Args:
+        statistics: outStatistics entries
+        group_by: Fields to group by
+    """
+
+    def __init__(self, statistics: Sequence[Dict], group_by: Optional[Sequence[str]] = None):
+        self.statistics = list(statistics)
+        self.group_by = list(group_by or [])
+        self.groups: Dict[tuple, List[List[float]]] = {}
+
+    def add(self, attributes: Dict):
+        """Add one feature's attributes."""
+        key = tuple(attributes.get(field) for field in self.group_by)
+        totals = self.groups.get(key)
+        if totals is None:
+            # count, sum, min, max, mean, M2 per statistic
+            totals = self.groups[key] = [[0, 0, None, None, 0.0, 0.0] for _ in self.statistics]
+        for statistic, total in zip(self.statistics, totals):
+            value = attributes.get(statistic['onStatisticField'])
+            if value is None:
+                continue
+            total[0] += 1
+            if statistic['statisticType'] == 'count':
+                continue
+            if statistic['statisticType'] in ('min', 'max'):
+                total[2] = value if total[2] is None or value < total[2] else total[2]
+                total[3] = value if total[3] is None or value > total[3] else total[3]
+                continue
+            total[1] += value
+            delta = value - total[4]
+            total[4] += delta / total[0]
+            total[5] += delta * (value - total[4])
+
+    def extend(self, features: Iterable[Dict]):
+        """Add Esri JSON or GeoJSON features."""
+        for feature in features:
+            self.add(feature.get('attributes', feature.get('properties')) or {})
+
+    def rows(self, order_by: Optional[str] = None) -> List[Dict]:
+        """Return one row per group with the group fields and statistics.
+
+        Args:
+            order_by: Optional ``FIELD [ASC|DESC], ...`` ordering
+        """
+        rows = []
+        for key, totals in self.groups.items():
+            row = dict(zip(self.group_by, key))
+            for statistic, total in zip(self.statistics, totals):
+                row[statistic['outStatisticFieldName']] = _result(statistic['statisticType'], total)
+            rows.append(row)
+        for field, descending in reversed(_order_fields(order_by)):
+            rows.sort(key=lambda row: (row.get(field) is None, row.get(field)), reverse=descending)
+        return rows
+
+
+def _result(statistic_type: str, total: List) -> Optional[float]:
+    count, value_sum, minimum, maximum, mean, m2 = total
+    if statistic_type == 'count':
+        return count
+    if statistic_type == 'min':
+        return minimum
+    if statistic_type == 'max':
+        return maximum
+    if not count:
+        return None
+    if statistic_type == 'sum':
+        return value_sum
+    if statistic_type == 'avg':
+        return mean
+    variance = m2 / (count - 1) if count > 1 else 0.0
+    return variance if statistic_type == 'var' else math.sqrt(variance)
+
+
+def _order_fields(order_by: Optional[str]) -> List[tuple]:
+    fields = []
+    for item in (order_by or '').split(','):
+        parts = item.split()
+        if parts:
+            fields.append((parts[0], len(parts) > 1 and parts[1].upper() == 'DESC'))
+    return fields
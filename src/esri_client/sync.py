@@ -0,0 +1,86 @@
+import json
+import logging
+import sqlite3
+from typing import Dict, Iterable, Iterator, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS features (
+    layer TEXT NOT NULL,
+    oid INTEGER NOT NULL,
+    edit_date INTEGER,
+    feature TEXT NOT NULL,
+    PRIMARY KEY (layer, oid)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    layer TEXT PRIMARY KEY,
+    watermark INTEGER,
+    format TEXT
+);
+"""
+
+
+class FeatureStore:
+    """Local SQLite copy of one or more layers, keyed by layer URL and OBJECTID."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self) -> 'FeatureStore':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def get_watermark(self, layer: str) -> Optional[int]:
+        row = self.connection.execute("SELECT watermark FROM sync_state WHERE layer = ?", (layer,)).fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, layer: str, watermark: Optional[int], format: str):
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO sync_state (layer, watermark, format) VALUES (?, ?, ?) "
+                "ON CONFLICT(layer) DO UPDATE SET watermark = excluded.watermark, format = excluded.format",
+                (layer, watermark, format))
+
+    def object_ids(self, layer: str) -> Set[int]:
+        return {row[0] for row in self.connection.execute("SELECT oid FROM features WHERE layer = ?", (layer,))}
+
+    def upsert(self, layer: str, features: Iterable[Dict], oid_field: str, edit_field: Optional[str] = None) -> int:
+        """Insert or replace features, returning how many were written."""
+        rows = []
+        for feature in features:
+            attributes = feature.get('attributes') or feature.get('properties') or {}
+            oid = attributes.get(oid_field, feature.get('id'))
+            if oid is None:
+                logger.warning(f"Skipping feature without {oid_field}")
+                continue
+            edit_date = attributes.get(edit_field) if edit_field else None
+            rows.append((layer, oid, edit_date, json.dumps(feature)))
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO features (layer, oid, edit_date, feature) VALUES (?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def delete(self, layer: str, object_ids: Iterable[int]) -> int:
+        rows = [(layer, oid) for oid in object_ids]
+        with self.connection:
+            self.connection.executemany("DELETE FROM features WHERE layer = ? AND oid = ?", rows)
+        return len(rows)
+
+    def iter_features(self, layer: str) -> Iterator[Dict]:
+        cursor = self.connection.execute("SELECT feature FROM features WHERE layer = ? ORDER BY oid", (layer,))
+        for (feature,) in cursor:
+            yield json.loads(feature)
+
+    def edit_dates(self, layer: str) -> Dict[int, Optional[int]]:
+        return dict(self.connection.execute("SELECT oid, edit_date FROM features WHERE layer = ?", (layer,)))
+
+    def count(self, layer: str) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM features WHERE layer = ?", (layer,)).fetchone()[0]
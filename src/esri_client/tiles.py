@@ -0,0 +1,281 @@
+"""Offline basemaps: MapServer tiles packaged into MBTiles.
+
+download_tiles enumerates the Web Mercator (XYZ) tiles covering a lon/lat
+bounding box over a zoom range and fetches them on a bounded thread pool
+sharing the client's connections. Cached services are read from their
+``tile/{level}/{row}/{col}`` endpoint; services without a cache, or whose
+tiling scheme is not the standard Web Mercator grid, are rendered tile by
+tile through ``export``. Tiles already in the MBTiles file are skipped, and
+new ones are inserted in batches, one transaction per batch.
+"""
+import logging
+import math
+import sqlite3
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple, TYPE_CHECKING
+
+from requests.exceptions import RequestException
+
+from .layer import DEFAULT_MAX_WORKERS
+
+if TYPE_CHECKING:
+    from .service import Service
+
+logger = logging.getLogger(__name__)
+
+WEB_MERCATOR_WKIDS = (102100, 102113, 900913, 3857)
+WEB_MERCATOR_EXTENT = 20037508.342789244
+MAX_LATITUDE = 85.0511287798066
+TILE_SIZE = 256
+DEFAULT_BATCH_SIZE = 500
+IMAGE_FORMATS = ('png', 'jpg')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS tiles (
+    zoom_level INTEGER NOT NULL,
+    tile_column INTEGER NOT NULL,
+    tile_row INTEGER NOT NULL,
+    tile_data BLOB NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row);
+"""
+
+
+class MBTiles:
+    """MBTiles SQLite file; rows are stored flipped (TMS) as the format requires."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self) -> 'MBTiles':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def existing(self, zoom: int, xmin: int, ymin: int, xmax: int, ymax: int) -> Set[Tuple[int, int]]:
+        """Return the (x, y) XYZ tiles of a range already stored at a zoom level."""
+        flip = (1 << zoom) - 1
+        cursor = self.connection.execute(
+            "SELECT tile_column, tile_row FROM tiles WHERE zoom_level = ? "
+            "AND tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?",
+            (zoom, xmin, xmax, flip - ymax, flip - ymin))
+        return {(column, flip - row) for column, row in cursor}
+
+    def put(self, tiles: Sequence[Tuple[int, int, int, bytes]]):
+        """Insert or replace (zoom, x, y, data) XYZ tiles in one transaction."""
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+                [(z, x, (1 << z) - 1 - y, sqlite3.Binary(data)) for z, x, y, data in tiles])
+
+    def metadata(self) -> Dict[str, str]:
+        return dict(self.connection.execute("SELECT name, value FROM metadata"))
+
+    def set_metadata(self, values: Dict[str, object]):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
+                                        [(name, str(value)) for name, value in values.items()])
+
+
+def tile_range(bbox: Sequence[float], zoom: int) -> Tuple[int, int, int, int]:
+    """Return the (xmin, ymin, xmax, ymax) XYZ tiles covering a lon/lat bbox at a zoom level."""
+    west, south, east, north = bbox
+    n = 1 << zoom
+
+    def column(lon: float) -> int:
+        return min(max(int((lon + 180.0) / 360.0 * n), 0), n - 1)
+
+    def row(lat: float) -> int:
+        lat = math.radians(min(max(lat, -MAX_LATITUDE), MAX_LATITUDE))
+        y = (1.0 - math.log(math.tan(lat) + 1.0 / math.cos(lat)) / math.pi) / 2.0
+        return min(max(int(y * n), 0), n - 1)
+
+    return column(west), row(north), column(east), row(south)
+
+
+def tile_bounds(zoom: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """Return the Web Mercator (xmin, ymin, xmax, ymax) of an XYZ tile."""
+    size = 2 * WEB_MERCATOR_EXTENT / (1 << zoom)
+    xmin = -WEB_MERCATOR_EXTENT + x * size
+    ymax = WEB_MERCATOR_EXTENT - y * size
+    return xmin, ymax - size, xmin + size, ymax
+
+
+def cache_levels(service_data: Dict) -> Optional[Dict[int, int]]:
+    """Map zoom levels to the service's cache levels, or None if it has no Web Mercator XYZ cache.
+
+    The cache must use 256 pixel tiles in Web Mercator with the standard
+    origin, each level's resolution matching one zoom level.
+    """
+    tile_info = service_data.get('tileInfo')
+    if not tile_info or service_data.get('singleFusedMapCache') is False:
+        return None
+    reference = tile_info.get('spatialReference') or {}
+    origin = tile_info.get('origin') or {}
+    if (reference.get('latestWkid') or reference.get('wkid')) not in WEB_MERCATOR_WKIDS:
+        return None
+    if tile_info.get('rows') != TILE_SIZE or tile_info.get('cols') != TILE_SIZE:
+        return None
+    if not (math.isclose(origin.get('x', 0), -WEB_MERCATOR_EXTENT, rel_tol=1e-6) and
+            math.isclose(origin.get('y', 0), WEB_MERCATOR_EXTENT, rel_tol=1e-6)):
+        return None
+    levels = {}
+    for lod in tile_info.get('lods') or []:
+        zoom = math.log2(2 * WEB_MERCATOR_EXTENT / (lod['resolution'] * TILE_SIZE))
+        if abs(zoom - round(zoom)) < 1e-3:
+            levels[round(zoom)] = lod['level']
+    return levels or None
+
+
+def download_tiles(service: 'Service', path: str, bbox: Sequence[float], min_zoom: int, max_zoom: int,
+                   max_workers: int = DEFAULT_MAX_WORKERS, export: Optional[bool] = None,
+                   image_format: str = 'png', batch_size: int = DEFAULT_BATCH_SIZE,
+                   progress: bool = False) -> Dict:
+    """Download a service's tiles over a bbox and zoom range into an MBTiles file.
+
+    Args:
+        service: MapServer service
+        path: MBTiles file, created or extended
+        bbox: (west, south, east, north) in longitude/latitude
+        min_zoom: First zoom level
+        max_zoom: Last zoom level
+        max_workers: Number of concurrent requests
+        export: Render tiles with ``export`` instead of reading the cache;
+            by default only when the service has no Web Mercator cache
+        image_format: png or jpg, for exported tiles
+        batch_size: Tiles inserted per transaction
+        progress: Print progress after each batch
+
+    Returns:
+        Dictionary with the number of tiles in range, downloaded, skipped,
+        missing (no tile on the server) and failed ones, the bytes
+        downloaded and the source (cache or export)
+
+    Raises:
+        ValueError: If the bbox, zoom range or image format is invalid, or
+            the cache is requested but the service has none
+    """
+    west, south, east, north = bbox
+    if west >= east or south >= north:
+        raise ValueError(f"Invalid bbox {','.join(str(v) for v in bbox)}, expected west,south,east,north")
+    if not 0 <= min_zoom <= max_zoom:
+        raise ValueError(f"Invalid zoom range {min_zoom}-{max_zoom}")
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format '{image_format}', expected one of {', '.join(IMAGE_FORMATS)}")
+    levels = cache_levels(service.data)
+    if export is None:
+        export = levels is None
+    elif not export and levels is None:
+        raise ValueError(f"Service {service.path} has no Web Mercator tile cache")
+    if not export:
+        tile_format = str(service.data['tileInfo'].get('format', 'PNG')).upper()
+        image_format = 'jpg' if tile_format.startswith('JP') else 'png'
+        zooms = [zoom for zoom in range(min_zoom, max_zoom + 1) if zoom in levels]
+        if len(zooms) <= max_zoom - min_zoom:
+            logger.warning(f"Service {service.path} has no cache levels for zoom "
+                           f"{sorted(set(range(min_zoom, max_zoom + 1)) - set(zooms))}")
+    else:
+        zooms = list(range(min_zoom, max_zoom + 1))
+
+    service_url = f"{service.client.base_url}/rest/services/{service.path}"
+    export_params = {'bboxSR': 102100, 'imageSR': 102100, 'size': f"{TILE_SIZE},{TILE_SIZE}", 'dpi': 96,
+                     'format': 'png32' if image_format == 'png' else 'jpg', 'transparent': 'true', 'f': 'image'}
+
+    def fetch(zoom: int, x: int, y: int) -> Optional[bytes]:
+        if export:
+            bounds = ','.join(repr(v) for v in tile_bounds(zoom, x, y))
+            return service.client._get_bytes(f"{service_url}/export", dict(export_params, bbox=bounds))
+        return service.client._get_bytes(f"{service_url}/tile/{levels[zoom]}/{y}/{x}")
+
+    summary = {'tiles': 0, 'downloaded': 0, 'skipped': 0, 'missing': 0, 'failed': 0, 'bytes': 0,
+               'source': 'export' if export else 'cache'}
+    with MBTiles(path) as store, ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending: 'deque[Tuple[Tuple[int, int, int], Future]]' = deque()
+        batch: List[Tuple[int, int, int, bytes]] = []
+
+        def record(tile: Tuple[int, int, int], future: Future):
+            try:
+                data = future.result()
+            except RequestException as e:
+                logger.warning(f"Tile {'/'.join(str(v) for v in tile)} failed: {e}")
+                summary['failed'] += 1
+                return
+            if data is None:
+                summary['missing'] += 1
+                return
+            batch.append((*tile, data))
+            summary['downloaded'] += 1
+            summary['bytes'] += len(data)
+            if len(batch) >= batch_size:
+                flush()
+
+        def flush():
+            store.put(batch)
+            batch.clear()
+            if progress:
+                print(f"Progress: {summary['downloaded'] + summary['skipped']} tiles, "
+                      f"{summary['downloaded']} downloaded, {summary['skipped']} skipped")
+
+        try:
+            for zoom, x, y, present in _enumerate(store, bbox, zooms):
+                summary['tiles'] += 1
+                if present:
+                    summary['skipped'] += 1
+                    continue
+                pending.append(((zoom, x, y), pool.submit(fetch, zoom, x, y)))
+                if len(pending) >= 2 * max_workers:
+                    record(*pending.popleft())
+            while pending:
+                record(*pending.popleft())
+        finally:
+            for _, future in pending:
+                future.cancel()
+            if batch:
+                flush()
+        store.set_metadata(_metadata(store.metadata(), service, bbox, zooms, image_format))
+
+    logger.debug(f"Tiles: {summary}")
+    return summary
+
+
+def _enumerate(store: MBTiles, bbox: Sequence[float], zooms: Sequence[int]) -> Iterator[Tuple[int, int, int, bool]]:
+    """Yield (zoom, x, y, already stored) for every tile in range, row by row."""
+    for zoom in zooms:
+        xmin, ymin, xmax, ymax = tile_range(bbox, zoom)
+        existing = store.existing(zoom, xmin, ymin, xmax, ymax)
+        for y in range(ymin, ymax + 1):
+            for x in range(xmin, xmax + 1):
+                yield zoom, x, y, (x, y) in existing
+
+
+def _metadata(previous: Dict[str, str], service: 'Service', bbox: Sequence[float], zooms: Sequence[int],
+              image_format: str) -> Dict[str, object]:
+    """MBTiles metadata covering this download and any earlier ones into the same file."""
+    bounds = list(bbox)
+    min_zoom, max_zoom = (min(zooms), max(zooms)) if zooms else (None, None)
+    if previous.get('bounds'):
+        old = [float(v) for v in previous['bounds'].split(',')]
+        bounds = [min(old[0], bounds[0]), min(old[1], bounds[1]), max(old[2], bounds[2]), max(old[3], bounds[3])]
+    if previous.get('minzoom'):
+        min_zoom = min(int(previous['minzoom']), min_zoom if min_zoom is not None else int(previous['minzoom']))
+        max_zoom = max(int(previous['maxzoom']), max_zoom if max_zoom is not None else int(previous['maxzoom']))
+    metadata = {
+        'name': previous.get('name') or service.path.rsplit('/', 1)[0],
+        'format': image_format,
+        'bounds': ','.join(str(v) for v in bounds),
+        'type': 'baselayer',
+        'version': '1.0',
+        'description': service.data.get('serviceDescription') or service.data.get('description') or '',
+    }
+    if min_zoom is not None:
+        metadata.update(minzoom=min_zoom, maxzoom=max_zoom,
+                        center=f"{(bounds[0] + bounds[2]) / 2},{(bounds[1] + bounds[3]) / 2},{min_zoom}")
+    return metadata
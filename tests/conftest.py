@@ -0,0 +1,9 @@
+import pytest
+from src.esri_client.mock_server import build_server
+
+
+@pytest.fixture
+def mock_arcgis_server():
+    """Local mock ArcGIS server with a 250-feature polygon layer (0) and time-enabled point layer (1)."""
+    with build_server(features=250, geometry='polygon', vertices=8, max_record_count=100) as server:
+        yield server
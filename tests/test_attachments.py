@@ -0,0 +1,131 @@
+import json
+import os
+from unittest.mock import patch
+
+import pytest
+from requests.exceptions import RequestException
+
+from src.esri_client import EsriClient
+from src.esri_client.attachments import attachment_filename, download_attachments
+from src.esri_client.metrics import MetricsCollector
+from src.esri_client.mock_server import SyntheticLayer, build_server
+
+
+@pytest.fixture
+def attachment_server():
+    synthetic = SyntheticLayer('inspections', 30, attachments=2, max_record_count=100)
+    with build_server(layers=[synthetic]) as server:
+        server.synthetic = synthetic
+        yield server
+
+
+def read_manifest(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+class TestIterAttachments:
+    def test_batched_and_per_feature_listing_agree(self, attachment_server):
+        layer = EsriClient(attachment_server.url).get_layer('Synthetic/MapServer', 0)
+        attachment_server.reset_stats()
+        batched = list(layer.iter_attachments(chunk_size=8))
+        assert attachment_server.paths['/arcgis/rest/services/Synthetic/MapServer/0/queryAttachments'] == 4
+
+        layer.data['advancedQueryCapabilities']['supportsQueryAttachments'] = False
+        per_feature = list(layer.iter_attachments())
+
+        assert len(batched) == 60
+        assert batched == per_feature
+        assert batched[0]['url'].endswith('/0/1/attachments/1')
+
+    def test_layer_without_attachments(self, mock_arcgis_server):
+        layer = EsriClient(mock_arcgis_server.url).get_layer('Synthetic/MapServer', 0)
+
+        with pytest.raises(ValueError):
+            list(layer.iter_attachments())
+
+
+class TestDownloadAttachments:
+    def test_download_and_resume(self, attachment_server, tmp_path):
+        layer = EsriClient(attachment_server.url).get_layer('Synthetic/MapServer', 0)
+        summary = download_attachments(layer, str(tmp_path), max_workers=4)
+
+        assert (summary['attachments'], summary['downloaded'], summary['failed']) == (60, 60, 0)
+        manifest = read_manifest(tmp_path / 'manifest.jsonl')
+        assert len(manifest) == 60 and all(entry['sha256'] for entry in manifest)
+        entry = manifest[0]
+        content = (tmp_path / entry['path']).read_bytes()
+        assert content == attachment_server.synthetic.attachment_content(entry['objectId'], entry['id'])
+        assert summary['bytes'] == sum(entry['size'] for entry in manifest)
+
+        attachment_server.reset_stats()
+        summary = download_attachments(layer, str(tmp_path), max_workers=4)
+        assert (summary['skipped'], summary['downloaded']) == (60, 0)
+        assert not any('/attachments/' in path for path in attachment_server.paths)
+
+    def test_checksum_detects_corrupt_file(self, attachment_server, tmp_path):
+        layer = EsriClient(attachment_server.url).get_layer('Synthetic/MapServer', 0)
+        download_attachments(layer, str(tmp_path), object_ids=[1, 2])
+        path = tmp_path / '1' / attachment_filename({'id': 1, 'name': 'photo_1_1.jpg'})
+        path.write_bytes(b'x' * path.stat().st_size)
+
+        assert download_attachments(layer, str(tmp_path), object_ids=[1, 2])['downloaded'] == 0
+        summary = download_attachments(layer, str(tmp_path), object_ids=[1, 2], verify='checksum')
+        assert (summary['downloaded'], summary['skipped']) == (1, 3)
+        assert path.read_bytes() == attachment_server.synthetic.attachment_content(1, 1)
+
+    def test_downloads_reported_to_observers(self, attachment_server, tmp_path):
+        client = EsriClient(attachment_server.url)
+        layer = client.get_layer('Synthetic/MapServer', 0)
+        collector = MetricsCollector()
+        client.add_observer(collector)
+
+        summary = download_attachments(layer, str(tmp_path), object_ids=[1, 2])
+
+        downloads = [m for m in collector.metrics if m.url_class == 'attachment']
+        assert len(downloads) == 4
+        assert all(m.status == 200 and m.error is None for m in downloads)
+        assert sum(m.bytes for m in downloads) == summary['bytes']
+
+    def test_failed_downloads_recorded(self, attachment_server, tmp_path):
+        layer = EsriClient(attachment_server.url).get_layer('Synthetic/MapServer', 0)
+        download = layer.client._download
+
+        def flaky(url, path, *args, **kwargs):
+            if url.endswith('/attachments/3'):
+                raise RequestException("boom")
+            return download(url, path, *args, **kwargs)
+
+        with patch.object(layer.client, '_download', side_effect=flaky):
+            summary = download_attachments(layer, str(tmp_path), object_ids=[1, 2])
+
+        assert (summary['downloaded'], summary['failed']) == (3, 1)
+        failed = [entry for entry in read_manifest(tmp_path / 'manifest.jsonl') if entry['status'] == 'failed']
+        assert failed[0]['id'] == 3 and 'boom' in failed[0]['error']
+        assert not any(name.endswith('.part') for _, _, files in os.walk(tmp_path) for name in files)
+
+    def test_resume_after_interrupted_runs(self, attachment_server, tmp_path):
+        layer = EsriClient(attachment_server.url).get_layer('Synthetic/MapServer', 0)
+        download = layer.client._download
+        calls = []
+
+        def interrupted(url, path, *args, **kwargs):
+            calls.append(url)
+            if len(calls) > 10:
+                raise KeyboardInterrupt
+            return download(url, path, *args, **kwargs)
+
+        with patch.object(layer.client, '_download', side_effect=interrupted), pytest.raises(KeyboardInterrupt):
+            download_attachments(layer, str(tmp_path), max_workers=1, verify='checksum')
+        assert not (tmp_path / 'manifest.jsonl').exists()
+        # A second run interrupted before it records anything keeps the first run's entries
+        with patch.object(layer, 'iter_attachments', side_effect=KeyboardInterrupt), \
+                pytest.raises(KeyboardInterrupt):
+            download_attachments(layer, str(tmp_path), max_workers=1, verify='checksum')
+
+        summary = download_attachments(layer, str(tmp_path), max_workers=1, verify='checksum')
+
+        assert (summary['skipped'], summary['downloaded']) == (10, 50)
+        manifest = read_manifest(tmp_path / 'manifest.jsonl')
+        assert len(manifest) == 60 and all(entry['sha256'] for entry in manifest)
+        assert not (tmp_path / 'manifest.jsonl.part').exists()
@@ -0,0 +1,74 @@
+import os
+from unittest.mock import Mock, patch
+
+import pytest
+from src.esri_client import Layer
+from src.esri_client.cache import QueryCache
+
+
+class TestQueryCache:
+    def test_key_normalizes_params(self, tmp_path):
+        cache = QueryCache(str(tmp_path))
+        a = cache.key('https://example.com/0/query', {'where': ' 1=1 ', 'outFields': '', 'f': 'json'})
+        b = cache.key('https://example.com/0/query/', {'f': 'json', 'where': '1=1', 'geometry': None})
+        assert a == b
+
+    def test_stale_entry_is_dropped(self, tmp_path):
+        cache = QueryCache(str(tmp_path))
+        cache.put('k', 1, {'features': [1]})
+        assert cache.get('k', 1) == {'features': [1]}
+        assert cache.get('k', 2) is None
+        assert not os.path.exists(tmp_path / 'k.json')
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        cache = QueryCache(str(tmp_path), max_bytes=150)
+        cache.put('old', 1, {'features': ['x' * 50]})
+        os.utime(tmp_path / 'old.json', (0, 0))
+        cache.put('new', 1, {'features': ['y' * 50]})
+        assert cache.get('old', 1) is None
+        assert cache.get('new', 1) is not None
+
+    def test_entries_removed_by_another_process(self, tmp_path):
+        cache = QueryCache(str(tmp_path), max_bytes=150)
+        cache.put('k', 1, {'features': [1]})
+        with patch('src.esri_client.cache.os.utime', side_effect=FileNotFoundError):
+            assert cache.get('k', 1) == {'features': [1]}
+        with patch('src.esri_client.cache.os.remove', side_effect=FileNotFoundError):
+            assert cache.get('k', 2) is None
+            cache.put('a', 1, {'features': ['x' * 100]})
+            cache.put('b', 1, {'features': ['y' * 100]})
+        with patch('src.esri_client.cache.os.stat', side_effect=FileNotFoundError):
+            cache.evict()
+
+    def test_failed_write_leaves_no_temporary_file(self, tmp_path):
+        cache = QueryCache(str(tmp_path))
+        with pytest.raises(TypeError):
+            cache.put('k', 1, {'features': [object()]})
+        assert os.listdir(tmp_path) == []
+
+
+class TestLayerQueryCache:
+    def test_query_reuses_cached_result(self, tmp_path):
+        mock_client = Mock()
+        mock_client.base_url = 'https://example.com'
+        mock_client._get_json.side_effect = [{'count': 1}, {'features': [{'id': 1}]}]
+        layer = Layer({'editingInfo': {'lastEditDate': 10}}, mock_client, 'service/path', 0)
+        cache = QueryCache(str(tmp_path))
+
+        with patch('builtins.print'):
+            first = layer.query(cache=cache)
+            second = layer.query(cache=cache)
+
+        assert first == second == {'features': [{'id': 1}]}
+        assert mock_client._get_json.call_count == 2
+
+    def test_query_without_last_edit_date_is_not_cached(self, tmp_path):
+        mock_client = Mock()
+        mock_client.base_url = 'https://example.com'
+        mock_client._get_json.side_effect = [{'count': 0}, {'features': []}]
+        layer = Layer({}, mock_client, 'service/path', 0)
+
+        with patch('builtins.print'):
+            layer.query(cache=QueryCache(str(tmp_path)))
+
+        assert os.listdir(tmp_path) == []
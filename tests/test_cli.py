@@ -2,6 +2,7 @@ import pytest
 from unittest.mock import Mock, patch, mock_open
 import sys
 import json
+import os
 from io import StringIO
 from cli import main
 
@@ -593,4 +594,343 @@ class TestCLI:
             main()
             
         output = mock_stdout.getvalue()
-        assert 'Service nonexistent not found' in output
\ No newline at end of file
+        assert 'Service nonexistent not found' in output
+
+    @patch('cli.EsriClient')
+    @patch('sys.argv', ['cli.py', 'query', '--service', 'test_service', '--id', '0', '--explain', '--url', 'https://example.com'])
+    def test_query_explain_prints_plan(self, mock_client_class):
+        mock_client = Mock()
+        mock_client_class.return_value = mock_client
+
+        mock_services = Mock()
+        mock_services.data = {'services': [{'name': 'test_service', 'type': 'MapServer'}]}
+        mock_client.get_services.return_value = mock_services
+
+        mock_service = Mock()
+        mock_service.layers = [Mock(id=0, name='layer0')]
+        mock_client.get_service.return_value = mock_service
+
+        mock_layer = Mock()
+        mock_layer.plan.return_value.to_dict.return_value = {'strategy': 'offset', 'estimatedRequests': 2}
+        mock_client.get_layer.return_value = mock_layer
+
+        with patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            main()
+
+        output = json.loads(mock_stdout.getvalue())
+        assert output == {'strategy': 'offset', 'estimatedRequests': 2}
+        mock_layer.query.assert_not_called()
+
+    def test_query_explain_applies_strategy(self, mock_arcgis_server):
+        argv = ['cli.py', 'query', '--service', 'Synthetic', '--id', '0', '--strategy', 'tiles', '--explain',
+                '--url', mock_arcgis_server.url]
+
+        with patch('sys.argv', argv), patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            main()
+
+        plan = json.loads(mock_stdout.getvalue())
+        assert plan['strategy'] == 'tiles'
+        assert 'strategy tiles requested instead of the planned offset' in plan['reasons']
+
+    def test_batch_command(self, mock_arcgis_server, tmp_path):
+        manifest = {
+            'url': mock_arcgis_server.url,
+            'concurrency': 2,
+            'defaults': {'service': 'Synthetic', 'format': 'geojson'},
+            'jobs': [
+                {'name': 'all', 'id': 0, 'output': str(tmp_path / 'all.geojson')},
+                {'name': 'some', 'id': 0, 'where': 'OBJECTID <= 10', 'outFields': ['OBJECTID', 'NAME'],
+                 'output': str(tmp_path / 'some.geojson')},
+                {'name': 'missing', 'id': 9, 'output': str(tmp_path / 'missing.geojson')},
+            ],
+        }
+        manifest_path = tmp_path / 'manifest.json'
+        manifest_path.write_text(json.dumps(manifest))
+
+        summary_path = tmp_path / 'summary.json'
+
+        with patch('sys.argv', ['cli.py', 'batch', str(manifest_path), '--summary', str(summary_path)]), \
+                patch('sys.stdout', new_callable=StringIO), pytest.raises(SystemExit):
+            main()
+
+        summary = json.loads(summary_path.read_text())
+        jobs = {job['name']: job for job in summary['jobs']}
+        assert summary['succeeded'] == 2 and summary['failed'] == 1
+        assert jobs['all']['features'] == 250
+        assert jobs['some']['features'] == 10
+        assert 'not found' in jobs['missing']['error']
+        assert len(json.loads((tmp_path / 'some.geojson').read_text())['features']) == 10
+        # The catalog and service are fetched once and shared by every job
+        assert mock_arcgis_server.paths['/arcgis/rest/services'] == 1
+
+    def test_batch_explain_and_exiting_jobs(self, mock_arcgis_server, tmp_path):
+        manifest = {
+            'url': mock_arcgis_server.url,
+            'defaults': {'service': 'Synthetic', 'id': 0},
+            'jobs': [
+                {'name': 'plan', 'explain': True, 'output': str(tmp_path / 'plan.json')},
+                {'name': 'exits', 'output': str(tmp_path / 'exits.json')},
+            ],
+        }
+        manifest_path = tmp_path / 'manifest.json'
+        manifest_path.write_text(json.dumps(manifest))
+        summary_path = tmp_path / 'summary.json'
+
+        import cli
+        real_handler = cli.handle_query_command
+
+        def handler(args, client):
+            if args.output.endswith('exits.json'):
+                sys.exit(1)
+            return real_handler(args, client)
+
+        with patch('sys.argv', ['cli.py', 'batch', str(manifest_path), '--summary', str(summary_path)]), \
+                patch('cli.handle_query_command', side_effect=handler), \
+                patch('sys.stdout', new_callable=StringIO), pytest.raises(SystemExit):
+            main()
+
+        jobs = {job['name']: job for job in json.loads(summary_path.read_text())['jobs']}
+        assert jobs['plan']['status'] == 'ok' and jobs['plan']['plan']['strategy']
+        assert jobs['exits'] == dict(jobs['exits'], status='error', error='Job exited with status 1')
+
+    def test_batch_pipeline_job(self, mock_arcgis_server, tmp_path):
+        manifest = {'url': mock_arcgis_server.url,
+                    'jobs': [{'service': 'Synthetic', 'id': 0, 'format': 'geojson', 'pipeline': True,
+                              'processes': 0, 'output': str(tmp_path / 'out.geojson')}]}
+        manifest_path = tmp_path / 'manifest.json'
+        manifest_path.write_text(json.dumps(manifest))
+        summary_path = tmp_path / 'summary.json'
+
+        with patch('sys.argv', ['cli.py', 'batch', str(manifest_path), '--summary', str(summary_path)]), \
+                patch('sys.stdout', new_callable=StringIO):
+            main()
+
+        job = json.loads(summary_path.read_text())['jobs'][0]
+        assert job['status'] == 'ok' and job['features'] == 250
+
+    def test_batch_yaml_manifest(self, mock_arcgis_server, tmp_path):
+        pytest.importorskip('yaml')
+        manifest_path = tmp_path / 'manifest.yaml'
+        manifest_path.write_text(f"url: {mock_arcgis_server.url}\n"
+                                 f"jobs:\n"
+                                 f"  - service: Synthetic\n"
+                                 f"    id: 0\n"
+                                 f"    returnGeometry: false\n"
+                                 f"    output: {tmp_path / 'out.json'}\n")
+        summary_path = tmp_path / 'summary.json'
+
+        with patch('sys.argv', ['cli.py', 'batch', str(manifest_path), '--summary', str(summary_path)]), \
+                patch('sys.stdout', new_callable=StringIO):
+            main()
+
+        summary = json.loads(summary_path.read_text())
+        assert summary['jobs'][0]['status'] == 'ok'
+        assert summary['jobs'][0]['features'] == 250
+
+    def test_query_pipeline_export(self, mock_arcgis_server, tmp_path):
+        output = tmp_path / 'out.geojson'
+        argv = ['cli.py', 'query', '--service', 'Synthetic', '--id', '0', '--format', 'geojson', '--pipeline',
+                '--processes', '0', '--output', str(output), '--url', mock_arcgis_server.url]
+
+        with patch('sys.argv', argv), patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            main()
+
+        assert 'Exported 250 features' in mock_stdout.getvalue()
+        assert len(json.loads(output.read_text())['features']) == 250
+
+    def test_query_max_memory_kml_matches_in_memory_output(self, mock_arcgis_server, tmp_path):
+        outputs = {}
+        for name, extra in (('memory', []), ('spilled', ['--max-memory', '0.05'])):
+            output = tmp_path / f'{name}.kml'
+            argv = ['cli.py', 'query', '--service', 'Synthetic', '--id', '0', '--format', 'kml',
+                    '--output', str(output), '--url', mock_arcgis_server.url] + extra
+            with patch('sys.argv', argv), patch('sys.stdout', new_callable=StringIO):
+                main()
+            outputs[name] = (tmp_path / name / f'{name}.kml').read_text()
+
+        assert outputs['spilled'] == outputs['memory']
+        assert outputs['spilled'].count('<Placemark>') == 250
+
+    def test_query_simplify_to_vertex_budget(self, mock_arcgis_server, tmp_path):
+        from src.esri_client.client import EsriClient
+        from src.esri_client.kml import count_kml_vertices
+
+        output = tmp_path / 'out.kml'
+        argv = ['cli.py', 'query', '--service', 'Synthetic', '--id', '0', '--format', 'kml', '--simplify', '1500',
+                '--output', str(output), '--url', mock_arcgis_server.url]
+
+        with patch('sys.argv', argv), patch('sys.stdout', new_callable=StringIO) as mock_stdout, \
+                patch.object(EsriClient, '_get_json', autospec=True, side_effect=EsriClient._get_json) as get_json:
+            main()
+
+        sent = [c.args[2] for c in get_json.call_args_list if len(c.args) > 2 and c.args[2]]
+        assert sent and not any('format' in params for params in sent)
+        assert 'maxAllowableOffset' in mock_stdout.getvalue()
+        assert 'Simplified geometries' in mock_stdout.getvalue()
+        kml = (tmp_path / 'out' / 'out.kml').read_text()
+        assert kml.count('<Placemark>') == 250
+        assert count_kml_vertices(kml) <= 1500
+
+    def test_lookup_writes_row_per_point(self, mock_arcgis_server, tmp_path):
+        import csv
+        from src.esri_client.mock_server import SyntheticLayer
+
+        synthetic = SyntheticLayer('features', 250, 'polygon', 8)
+        points = tmp_path / 'points.csv'
+        with open(points, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['id', 'lon', 'lat', 'NAME'])
+            for oid in (5, 17, 250):
+                writer.writerow([oid, *synthetic.center(oid), f"address {oid}"])
+            writer.writerow([0, '', '', 'no coordinates'])
+        output = tmp_path / 'matches.csv'
+        argv = ['cli.py', 'lookup', '--service', 'Synthetic', '--id', '0', '--points', str(points),
+                '--outFields', 'OBJECTID,NAME', '--output', str(output), '--url', mock_arcgis_server.url]
+
+        with patch('sys.argv', argv), patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            main()
+
+        assert 'Matched 3 of 4 points' in mock_stdout.getvalue()
+        with open(output, newline='') as f:
+            rows = list(csv.DictReader(f))
+        assert [row['OBJECTID'] for row in rows] == ['5', '17', '250', '']
+        assert rows[0]['NAME'] == 'address 5' and rows[0]['match_NAME'] == 'Feature 5'
+
+    def test_index_build_and_query(self, mock_arcgis_server, tmp_path):
+        from src.esri_client.mock_server import SyntheticLayer
+
+        synthetic = SyntheticLayer('features', 250, 'polygon', 8)
+        index = tmp_path / 'layer.idx'
+        argv = ['cli.py', 'index', 'build', str(index), '--service', 'Synthetic', '--id', '0',
+                '--outFields', 'OBJECTID,NAME', '--url', mock_arcgis_server.url]
+        with patch('sys.argv', argv), patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            main()
+        assert 'Indexed 250 features' in mock_stdout.getvalue()
+
+        # Queries run offline: stop the server first
+        mock_arcgis_server.stop()
+        x, y = synthetic.center(42)
+        argv = ['cli.py', 'index', 'query', str(index), f"--point={x},{y}", '--point=-200,-200']
+        with patch('sys.argv', argv), patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            main()
+        results = json.loads(mock_stdout.getvalue())
+        assert results[0]['matches'] == [{'OBJECTID': 42, 'NAME': 'Feature 42'}]
+        assert results[1]['matches'] == []
+
+        argv = ['cli.py', 'index', 'query', str(index), '--point=-200,-200', '--nearest', '2']
+        with patch('sys.argv', argv), patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            main()
+        nearest = json.loads(mock_stdout.getvalue())[0]['matches']
+        assert nearest[0]['OBJECTID'] == 1 and nearest[0]['distance'] <= nearest[1]['distance']
+
+    def test_stats_command(self, mock_arcgis_server):
+        argv = ['cli.py', 'stats', '--service', 'Synthetic', '--id', '0', '--stat', 'count:OBJECTID:n',
+                '--stat', 'sum:VALUE', '--group-by', 'CATEGORY', '--order-by', 'n DESC', '--url',
+                mock_arcgis_server.url]
+
+        with patch('sys.argv', argv), patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            main()
+
+        rows = json.loads(mock_stdout.getvalue())
+        assert sum(row['n'] for row in rows) == 250
+        assert [row['n'] for row in rows] == sorted((row['n'] for row in rows), reverse=True)
+
+    def test_stats_invalid_statistic(self, mock_arcgis_server):
+        argv = ['cli.py', 'stats', '--service', 'Synthetic', '--id', '0', '--stat', 'median:VALUE',
+                '--url', mock_arcgis_server.url]
+
+        with patch('sys.argv', argv), patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            with pytest.raises(SystemExit):
+                main()
+
+        assert 'Unknown statistic type' in mock_stdout.getvalue()
+
+    def test_query_with_related(self, tmp_path):
+        from src.esri_client.mock_server import SyntheticLayer, build_server
+
+        layers = [SyntheticLayer('parcels', 50, related={1: 3}),
+                  SyntheticLayer('inspections', 150, layer_id=1, max_record_count=100)]
+        output = tmp_path / 'parcels.json'
+        with build_server(layers=layers) as server:
+            argv = ['cli.py', 'query', '--service', 'Synthetic', '--id', '0', '--outFields', 'NAME',
+                    '--with-related', 'parcels_1', '--related-fields', 'OBJECTID', '--format', 'geojson',
+                    '--output', str(output), '--url', server.url]
+            with patch('sys.argv', argv), patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+                main()
+
+        features = json.loads(output.read_text())['features']
+        assert 'Exported 50 features with 150 related records' in mock_stdout.getvalue()
+        assert [r['OBJECTID'] for r in features[1]['relatedRecords']['parcels_1']] == [4, 5, 6]
+
+    def test_batch_with_related(self, tmp_path):
+        from src.esri_client.mock_server import SyntheticLayer, build_server
+
+        layers = [SyntheticLayer('parcels', 50, related={1: 3}),
+                  SyntheticLayer('inspections', 150, layer_id=1, max_record_count=100)]
+        with build_server(layers=layers) as server:
+            manifest = {
+                'url': server.url,
+                'defaults': {'service': 'Synthetic', 'id': 0, 'format': 'geojson', 'with_related': 'parcels_1'},
+                'jobs': [
+                    {'name': 'joined', 'output': str(tmp_path / 'joined.geojson')},
+                    {'name': 'spilled', 'max_memory': 10, 'output': str(tmp_path / 'spilled.geojson')},
+                ],
+            }
+            manifest_path = tmp_path / 'manifest.json'
+            manifest_path.write_text(json.dumps(manifest))
+            summary_path = tmp_path / 'summary.json'
+
+            with patch('sys.argv', ['cli.py', 'batch', str(manifest_path), '--summary', str(summary_path)]), \
+                    patch('sys.stdout', new_callable=StringIO) as mock_stdout, pytest.raises(SystemExit):
+                main()
+
+        jobs = {job['name']: job for job in json.loads(summary_path.read_text())['jobs']}
+        assert jobs['joined']['status'] == 'ok' and jobs['joined']['features'] == 50
+        assert jobs['spilled']['status'] == 'error'
+        assert '--with-related cannot be combined with --max-memory' in mock_stdout.getvalue()
+
+    def test_tiles_command(self, tmp_path):
+        from src.esri_client.mock_server import MockArcGISServer, SyntheticLayer, SyntheticService
+
+        output = tmp_path / 'basemap.mbtiles'
+        services = [SyntheticService('Basemap', [SyntheticLayer('features', 10)], tile_levels=4)]
+        with MockArcGISServer(services) as server:
+            argv = ['cli.py', 'tiles', '--service', 'Basemap', '--bbox=-10,-10,10,10', '--max-zoom', '2',
+                    '--output', str(output), '--url', server.url]
+            with patch('sys.argv', argv), patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+                main()
+
+        assert 'Downloaded 9 of 9 tiles' in mock_stdout.getvalue()
+        assert 'from the cache' in mock_stdout.getvalue()
+        assert output.exists()
+
+    def test_attachments_command(self, tmp_path):
+        from src.esri_client.mock_server import SyntheticLayer, build_server
+
+        layers = [SyntheticLayer('inspections', 10, attachments=1)]
+        output = tmp_path / 'photos'
+        with build_server(layers=layers) as server:
+            argv = ['cli.py', 'attachments', '--service', 'Synthetic', '--id', '0', '--where', 'OBJECTID <= 4',
+                    '--output', str(output), '--url', server.url]
+            with patch('sys.argv', argv), patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+                main()
+
+        assert 'Downloaded 4 of 4 attachments' in mock_stdout.getvalue()
+        assert sorted(os.listdir(output)) == ['1', '2', '3', '4', 'manifest.jsonl']
+
+    def test_query_regionated_kmz(self, mock_arcgis_server, tmp_path):
+        import zipfile
+
+        output = tmp_path / 'out.kmz'
+        argv = ['cli.py', 'query', '--service', 'Synthetic', '--id', '0', '--format', 'kmz', '--regionate', '50',
+                '--output', str(output), '--url', mock_arcgis_server.url]
+
+        with patch('sys.argv', argv), patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            main()
+
+        assert 'Created regionated KMZ file' in mock_stdout.getvalue()
+        with zipfile.ZipFile(output) as kmz:
+            names = kmz.namelist()
+            doc = kmz.read('doc.kml').decode()
+        assert names[0] == 'doc.kml' and len(names) > 1
+        assert '<NetworkLink>' in doc and '<Region>' in doc
@@ -1,3 +1,6 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 from unittest.mock import Mock, patch
 from src.esri_client import EsriClient
@@ -18,4 +21,41 @@ class TestEsriClient:
         result = client._get_json("test_url")
         
         assert result == {"test": "data"}
-        mock_session.return_value.get.assert_called_once_with("test_url", params={'f': 'pjson'}, timeout=30)
\ No newline at end of file
+        mock_session.return_value.get.assert_called_once_with("test_url", params={'f': 'pjson'}, timeout=30)
+
+    def test_metadata_cache(self, mock_arcgis_server):
+        client = EsriClient(mock_arcgis_server.url, cache_metadata=True)
+        client.get_layer('Synthetic/MapServer', 0)
+        layer = client.get_layer('Synthetic/MapServer', 0)
+
+        assert layer.name
+        assert mock_arcgis_server.request_count == 1
+
+    def test_metadata_cache_fetches_urls_concurrently(self):
+        client = EsriClient("https://example.com", cache_metadata=True)
+        # Both fetches must be in flight at once to pass the barrier
+        barrier = threading.Barrier(2, timeout=5)
+        calls = []
+
+        def fetch(url, params=None):
+            calls.append(url)
+            barrier.wait()
+            return {'url': url}
+
+        urls = ['https://example.com/a', 'https://example.com/b'] * 2
+        with patch.object(client, '_get_json', side_effect=fetch), ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(client._get_metadata, urls))
+
+        assert [result['url'] for result in results] == urls
+        assert sorted(calls) == ['https://example.com/a', 'https://example.com/b']
+
+        with patch.object(client, '_get_json', side_effect=[RuntimeError('boom'), {'url': 'c'}]):
+            with pytest.raises(RuntimeError):
+                client._get_metadata('https://example.com/c')
+            assert client._get_metadata('https://example.com/c') == {'url': 'c'}
+
+    def test_max_connections(self):
+        client = EsriClient("https://example.com", max_connections=8)
+        adapter = client.session.get_adapter("https://example.com")
+        assert adapter._pool_maxsize == 8
+        assert adapter._pool_block is True
@@ -0,0 +1,88 @@
+from src.esri_client.kml import (PlacemarkRenderer, convert_json_to_kml, count_kml_vertices, create_kml_placemark,
+                                 format_ring, geometry_kml, render_placemarks)
+
+
+def features():
+    ring = [[-77.1, 38.9], [-77.0, 38.9], [-77.0, 39.0], [-77.1, 38.9]]
+    return [
+        {'geometry': {'type': 'Point', 'coordinates': [-77.05, 38.95]},
+         'properties': {'NAME': 'A & B', 'Count': 0, 'Note': None, '<key>': '"quoted"'}},
+        {'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+         'properties': {'NAME': 'A & B', 'Count': 3, 'Note': 'x', '<key>': '<v>'}},
+        {'geometry': {'type': 'Polygon', 'coordinates': [ring]}, 'properties': {'name': None, 'Title': 'T'}},
+        {'geometry': {'type': 'Polygon', 'coordinates': [[]]}, 'properties': {}},
+        {'geometry': {'type': 'LineString', 'coordinates': ring}, 'properties': {'NAME': 'line'}},
+        {'geometry': {'type': 'Polygon', 'coordinates': [ring, ring[:3] + ring[:1]]}, 'properties': {'NAME': 'hole'}},
+        {'geometry': {'type': 'MultiPolygon', 'coordinates': [[ring], [ring, ring]]}, 'properties': {'NAME': 'multi'}},
+        {'geometry': {'type': 'MultiPoint', 'coordinates': [[1, 2], [3, 4]]}, 'properties': {'NAME': 'points'}},
+        {'geometry': {'type': 'MultiLineString', 'coordinates': [ring, [[1, 2]]]}, 'properties': {'NAME': 'lines'}},
+        {'geometry': {'type': 'GeometryCollection', 'geometries': [{'type': 'Point', 'coordinates': [1, 2]}]},
+         'properties': {}},
+        {'geometry': {'type': 'MultiPoint', 'coordinates': []}, 'properties': {'NAME': 'skipped'}},
+        {'geometry': None, 'properties': {'NAME': 'skipped'}},
+    ]
+
+
+class TestPlacemarkRenderer:
+    def test_matches_placemark_functions(self):
+        for display_field in (None, 'Title', 'Count', 'Missing'):
+            renderer = PlacemarkRenderer(display_field)
+            for feature in features():
+                expected = create_kml_placemark(feature, display_field)
+                rendered = renderer.render(feature)
+                if expected is None:
+                    assert rendered is None
+                else:
+                    text = '\n'.join(expected)
+                    assert rendered == (text, count_kml_vertices(text))
+
+    def test_schemas_compiled_once(self):
+        renderer = PlacemarkRenderer('NAME')
+        render_placemarks(features()[:2] * 10, 'NAME')
+        for feature in features()[:2] * 10:
+            renderer.render(feature)
+
+        assert len(renderer.schemas) == 1
+
+    def test_convert_json_to_kml(self):
+        kml = convert_json_to_kml({'features': features()}, 'NAME')
+
+        assert kml.count('<Placemark>') == 10
+        assert '<name>A &amp; B</name>' in kml
+        assert '<td>&lt;key&gt;</td><td>&lt;v&gt;</td>' in kml
+
+    def test_format_ring(self):
+        assert format_ring([[1, 2], [3.5, -4.25]]) == '1,2,0 3.5,-4.25,0'
+        assert format_ring([]) == ''
+
+
+class TestGeometryKml:
+    def test_polygon_holes(self):
+        outer = [[0, 0], [10, 0], [10, 10], [0, 0]]
+        hole = [[1, 1], [2, 1], [2, 2], [1, 1]]
+        text, vertices = geometry_kml({'type': 'Polygon', 'coordinates': [outer, hole]})
+
+        assert vertices == 8 == count_kml_vertices(text)
+        assert text.count('<innerBoundaryIs>') == 1
+        assert text.index('<outerBoundaryIs>') < text.index('<innerBoundaryIs>')
+
+    def test_multipolygon(self):
+        square = [[0, 0], [1, 0], [1, 1], [0, 0]]
+        text, vertices = geometry_kml({'type': 'MultiPolygon', 'coordinates': [[square], [square, square], []]})
+
+        assert text.startswith('<MultiGeometry>') and text.endswith('</MultiGeometry>')
+        assert text.count('<Polygon>') == 2
+        assert vertices == 12 == count_kml_vertices(text)
+
+    def test_lines_and_points(self):
+        text, vertices = geometry_kml({'type': 'LineString', 'coordinates': [[0, 0], [1, 1], [2, 0]]})
+        assert text == '<LineString>\n<coordinates>0,0,0 1,1,0 2,0,0</coordinates>\n</LineString>'
+        assert vertices == 3
+
+        text, vertices = geometry_kml({'type': 'MultiPoint', 'coordinates': [[0, 0], [1, 1]]})
+        assert text.count('<Point>') == 2 and vertices == 2
+
+    def test_empty_or_unknown(self):
+        assert geometry_kml({'type': 'MultiPolygon', 'coordinates': [[]]}) is None
+        assert geometry_kml({'type': 'LineString', 'coordinates': [[0, 0]]}) is None
+        assert geometry_kml({'type': 'Circle', 'coordinates': [0, 0]}) is None
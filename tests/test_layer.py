@@ -1,5 +1,8 @@
+import pytest
+from requests.exceptions import RequestException
 from unittest.mock import Mock, patch
-from src.esri_client import Layer
+from src.esri_client import EsriClient, Layer
+from src.esri_client.mock_server import FaultConfig, SyntheticLayer, build_server
 
 
 class TestLayer:
@@ -40,4 +43,249 @@ class TestLayer:
         data_call = mock_client._get_json.call_args_list[1]
         expected_data_params = {'where': 'test=1', 'f': 'pjson', 'resultRecordCount': 100, 'resultOffset': 0}
         assert data_call[0][0] == expected_url
-        assert data_call[0][1] == expected_data_params
\ No newline at end of file
+        assert data_call[0][1] == expected_data_params
+
+def make_point_client(points, max_record_count=2):
+    """Mock client answering envelope queries over a list of (oid, x, y) points."""
+    mock_client = Mock()
+    mock_client.base_url = 'https://example.com'
+
+    def get_json(url, params):
+        xmin, ymin, xmax, ymax = (float(c) for c in params['geometry'].split(','))
+        hits = [p for p in points if xmin <= p[1] <= xmax and ymin <= p[2] <= ymax]
+        if params.get('returnCountOnly') == 'true':
+            return {'count': len(hits)}
+        return {'type': 'FeatureCollection', 'features': [
+            {'id': oid, 'geometry': {'type': 'Point', 'coordinates': [x, y]}, 'properties': {'OBJECTID': oid}}
+            for oid, x, y in hits[:max_record_count]]}
+
+    mock_client._get_json.side_effect = get_json
+    return mock_client
+
+
+class TestLayerTiles:
+    def test_tiles_split_dense_areas_and_dedupe(self):
+        # Point 1 sits on the shared corner of all four top-level tiles
+        points = [(1, 5, 5), (2, 1, 1), (3, 2, 2), (4, 3, 3), (5, 9, 9)]
+        mock_client = make_point_client(points)
+        data = {'maxRecordCount': 2, 'objectIdField': 'OBJECTID',
+                'extent': {'xmin': 0, 'ymin': 0, 'xmax': 10, 'ymax': 10, 'spatialReference': {'wkid': 4326}}}
+        layer = Layer(data, mock_client, 'service/path', 0)
+
+        with patch('builtins.print') as mock_print:
+            result = layer.query(format='geojson', strategy='tiles', max_workers=2)
+
+        assert sorted(f['id'] for f in result['features']) == [1, 2, 3, 4, 5]
+        mock_print.assert_any_call("Total features: 5")
+        assert result['type'] == 'FeatureCollection'
+        page_calls = [c[0][1] for c in mock_client._get_json.call_args_list if 'returnCountOnly' not in c[0][1]]
+        assert all('resultOffset' not in params for params in page_calls)
+        assert all(params['inSR'] == '4326' for params in page_calls)
+
+    def test_tiles_use_envelope_geometry(self):
+        mock_client = make_point_client([(1, 1, 1), (2, 8, 8)])
+        layer = Layer({'maxRecordCount': 10}, mock_client, 'service/path', 0)
+
+        with patch('builtins.print'):
+            result = layer.query(format='geojson', strategy='tiles', geometry='0,0,4,4')
+
+        assert [f['id'] for f in result['features']] == [1]
+
+    def test_tiles_require_extent(self):
+        layer = Layer({}, Mock(base_url='https://example.com'), 'service/path', 0)
+        with pytest.raises(ValueError, match='no extent'):
+            layer.query(strategy='tiles')
+
+
+class TestLayerTimeWindows:
+    def test_time_windows_split_until_under_limit(self):
+        times = {1: 0, 2: 1000, 3: 5000, 4: 6500, 5: 8000, 6: 9999}
+        mock_client = Mock()
+        mock_client.base_url = 'https://example.com'
+
+        def get_json(url, params):
+            start, end = (int(t) for t in params['time'].split(','))
+            hits = [oid for oid, t in times.items() if start <= t <= end]
+            if params.get('returnCountOnly') == 'true':
+                return {'count': len(hits)}
+            return {'features': [{'attributes': {'OBJECTID': oid}} for oid in hits]}
+
+        mock_client._get_json.side_effect = get_json
+        data = {'maxRecordCount': 2, 'timeInfo': {'timeExtent': [0, 9999]}}
+        layer = Layer(data, mock_client, 'service/path', 0)
+
+        with patch('builtins.print'):
+            result = layer.query(strategy='time', max_workers=2)
+
+        assert sorted(f['attributes']['OBJECTID'] for f in result['features']) == [1, 2, 3, 4, 5, 6]
+        page_calls = [c[0][1] for c in mock_client._get_json.call_args_list if 'returnCountOnly' not in c[0][1]]
+        assert all(get_json(None, dict(p, returnCountOnly='true'))['count'] <= 2 for p in page_calls)
+
+    def test_open_time_extents(self):
+        mock_client = Mock(base_url='https://example.com')
+        mock_client._get_json.return_value = {'features': [{'attributes': {'EARLIEST': 500}}]}
+        data = {'timeInfo': {'startTimeField': 'EVENT_TIME', 'timeExtent': [None, 9999]}}
+        layer = Layer(data, mock_client, 'service/path', 0)
+
+        assert layer._time_root({}) == (500, 9999)
+        assert layer._time_root({'time': 'null,123'}) == (500, 123)
+        assert layer._time_root({'time': '100,null'}) == (100, 9999)
+        assert layer._time_root({'time': '100'}) == (100, 100)
+        mock_client._get_json.side_effect = RequestException('boom')
+        assert layer._time_root({})[0] == 0
+
+    def test_time_windows_require_time_info(self):
+        layer = Layer({}, Mock(base_url='https://example.com'), 'service/path', 0)
+        with pytest.raises(ValueError, match='not time-enabled'):
+            layer.query(strategy='time')
+
+
+class TestLayerAdaptivePaging:
+    def test_failed_pages_are_split(self):
+        faults = FaultConfig(max_response_features=40)
+        with build_server(features=250, max_record_count=200, faults=faults) as server:
+            layer = EsriClient(server.url).get_layer('Synthetic/MapServer', 0)
+            with patch('builtins.print'):
+                result = layer.query(format='geojson', strategy='offset', resultRecordCount=200,
+                                     adaptive=True, max_workers=2)
+
+        assert [f['id'] for f in result['features']] == list(range(1, 251))
+
+    def test_fast_pages_grow(self, mock_arcgis_server):
+        layer = EsriClient(mock_arcgis_server.url).get_layer('Synthetic/MapServer', 0)
+        with patch('builtins.print'):
+            result = layer.query(format='geojson', strategy='offset', resultRecordCount=10,
+                                 adaptive=True, max_workers=1)
+
+        assert [f['id'] for f in result['features']] == list(range(1, 251))
+        # 10 + 20 + 40 + 80 + 100 fetches the first 250 in 5 full or short pages
+        assert mock_arcgis_server.paths['/arcgis/rest/services/Synthetic/MapServer/0/query'] <= 7
+
+
+class TestLayerIterPages:
+    def test_offset_pages_in_order(self, mock_arcgis_server):
+        layer = EsriClient(mock_arcgis_server.url).get_layer('Synthetic/MapServer', 0)
+        pages = list(layer.iter_pages(format='geojson', max_workers=3, prefetch=2))
+
+        assert [len(page['features']) for page in pages] == [100, 100, 50]
+        assert [f['id'] for page in pages for f in page['features']] == list(range(1, 251))
+
+    def test_object_id_chunks_without_pagination(self):
+        with build_server(features=120, max_record_count=50, supports_pagination=False) as server:
+            layer = EsriClient(server.url).get_layer('Synthetic/MapServer', 0)
+            pages = list(layer.iter_pages(format='geojson'))
+
+        assert [len(page['features']) for page in pages] == [50, 50, 20]
+        assert [f['id'] for page in pages for f in page['features']] == list(range(1, 121))
+
+
+class TestLayerSpilling:
+    def test_query_spills_past_memory_budget(self, mock_arcgis_server):
+        layer = EsriClient(mock_arcgis_server.url).get_layer('Synthetic/MapServer', 0)
+        with patch('builtins.print'):
+            expected = layer.query(format='geojson')
+            result = layer.query(format='geojson', max_memory=100000)
+
+        assert result['features'].spilled
+        assert list(result['features']) == expected['features']
+        result['features'].close()
+
+    def test_query_spilling_honours_strategy_and_statistics(self, mock_arcgis_server):
+        layer = EsriClient(mock_arcgis_server.url).get_layer('Synthetic/MapServer', 0)
+        with patch('builtins.print'), patch.object(layer, 'object_ids', wraps=layer.object_ids) as object_ids:
+            result = layer.query(format='geojson', strategy='objectids', max_memory=100000)
+            stats = layer.query(outStatistics='[{"statisticType": "count", "onStatisticField": "OBJECTID"}]',
+                                max_memory=100000)
+
+        assert object_ids.called
+        assert len(result['features']) == 250
+        result['features'].close()
+        assert stats['features'] == [{'attributes': {'count_OBJECTID': 250}}]
+
+
+class TestLayerStatistics:
+    STATS = ['count:OBJECTID', 'sum:VALUE', 'avg:VALUE:mean', 'max:VALUE']
+
+    def expected(self, count):
+        synthetic = SyntheticLayer('features', count)
+        rows = {}
+        for oid in range(1, count + 1):
+            attributes = synthetic.attributes(oid)
+            rows.setdefault(attributes['CATEGORY'], []).append(attributes['VALUE'])
+        return {category: (len(values), sum(values), max(values)) for category, values in rows.items()}
+
+    def test_server_side_single_request(self, mock_arcgis_server):
+        layer = EsriClient(mock_arcgis_server.url).get_layer('Synthetic/MapServer', 0)
+        mock_arcgis_server.reset_stats()
+        rows = layer.statistics(self.STATS, ['CATEGORY'], order_by='CATEGORY')
+
+        assert mock_arcgis_server.request_count == 1
+        assert [row['CATEGORY'] for row in rows] == sorted(self.expected(250))
+        assert {row['CATEGORY']: (row['count_OBJECTID'], row['sum_VALUE'], row['max_VALUE'])
+                for row in rows} == self.expected(250)
+
+    def test_local_fallback_matches_server(self, mock_arcgis_server):
+        layers = [SyntheticLayer('features', 250, 'polygon', max_record_count=100, supports_statistics=False)]
+        server_rows = EsriClient(mock_arcgis_server.url).get_layer('Synthetic/MapServer', 0).statistics(
+            self.STATS, ['CATEGORY'], order_by='CATEGORY')
+        with build_server(layers=layers) as server:
+            layer = EsriClient(server.url).get_layer('Synthetic/MapServer', 0)
+            local_rows = layer.statistics(self.STATS, ['CATEGORY'], order_by='CATEGORY')
+            with pytest.raises(ValueError):
+                layer.statistics(self.STATS, having='SUM(VALUE) > 10')
+
+        assert local_rows == server_rows
+
+    def test_groups_paged(self, mock_arcgis_server):
+        layer = EsriClient(mock_arcgis_server.url).get_layer('Synthetic/MapServer', 0)
+        rows = layer.statistics(['count:OBJECTID'], ['NAME'])
+
+        assert len(rows) == 250
+
+    def test_query_with_out_statistics_skips_pagination(self, mock_arcgis_server):
+        layer = EsriClient(mock_arcgis_server.url).get_layer('Synthetic/MapServer', 0)
+        mock_arcgis_server.reset_stats()
+        result = layer.query(outStatistics='[{"statisticType": "count", "onStatisticField": "OBJECTID"}]')
+
+        assert mock_arcgis_server.request_count == 1
+        assert result['features'] == [{'attributes': {'count_OBJECTID': 250}}]
+
+
+class TestLayerQueryRelated:
+    def related_server(self, per_feature=3, related_max_record_count=100, supports_pagination=True):
+        layers = [SyntheticLayer('parcels', 50, related={1: per_feature}, supports_pagination=supports_pagination),
+                  SyntheticLayer('inspections', 50 * per_feature, layer_id=1,
+                                 max_record_count=related_max_record_count)]
+        return build_server(layers=layers)
+
+    def test_groups_in_object_id_order(self):
+        with self.related_server() as server:
+            layer = EsriClient(server.url).get_layer('Synthetic/MapServer', 0)
+            groups = list(layer.query_related('parcels_1', [5, 1, 999, 5], out_fields='OBJECTID'))
+
+        assert [group['objectId'] for group in groups] == [5, 1, 999]
+        assert [r['attributes']['OBJECTID'] for r in groups[0]['relatedRecords']] == [13, 14, 15]
+        assert groups[2]['relatedRecords'] == []
+
+    def test_truncated_chunks_are_split(self):
+        with self.related_server() as server:
+            layer = EsriClient(server.url).get_layer('Synthetic/MapServer', 0)
+            server.reset_stats()
+            groups = list(layer.query_related(0, iter(range(1, 51)), max_workers=2))
+
+        # 150 records against a 100 record limit: the first chunk splits, later ones start smaller
+        assert [len(group['relatedRecords']) for group in groups] == [3] * 50
+        assert server.request_count <= 4
+
+    def test_single_feature_paged(self):
+        with self.related_server(related_max_record_count=2) as server:
+            layer = EsriClient(server.url).get_layer('Synthetic/MapServer', 0)
+            groups = list(layer.query_related(0, range(1, 5)))
+
+        assert [len(group['relatedRecords']) for group in groups] == [3] * 4
+
+    def test_unknown_relationship(self, mock_arcgis_server):
+        layer = EsriClient(mock_arcgis_server.url).get_layer('Synthetic/MapServer', 0)
+
+        with pytest.raises(ValueError):
+            list(layer.query_related(7, [1]))
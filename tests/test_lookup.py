@@ -0,0 +1,80 @@
+import random
+from unittest.mock import patch
+
+import pytest
+from requests.exceptions import RequestException
+
+from src.esri_client import EsriClient
+from src.esri_client.lookup import cluster_points, lookup_points, point_in_geometry
+from src.esri_client.mock_server import SyntheticLayer
+
+
+class TestClusterPoints:
+    def test_clusters_cover_points_within_size(self):
+        rng = random.Random(1)
+        points = [(rng.uniform(0, 100), rng.uniform(0, 10)) for _ in range(1000)]
+        clusters = cluster_points(points, 64)
+
+        assert sorted(i for cluster in clusters for i in cluster) == list(range(1000))
+        assert all(len(cluster) <= 64 for cluster in clusters)
+        # Splits follow the wider axis, so clusters are narrow in x
+        assert max(max(points[i][0] for i in c) - min(points[i][0] for i in c) for c in clusters) < 20
+
+    def test_empty(self):
+        assert cluster_points([]) == []
+
+
+class TestPointInGeometry:
+    square = [[0, 0], [0, 10], [10, 10], [10, 0], [0, 0]]
+    hole = [[4, 4], [6, 4], [6, 6], [4, 6], [4, 4]]
+
+    def test_polygon_with_hole(self):
+        geometry = {'rings': [self.square, self.hole]}
+
+        assert point_in_geometry(1, 1, geometry)
+        assert not point_in_geometry(5, 5, geometry)
+        assert not point_in_geometry(11, 5, geometry)
+
+    def test_geojson(self):
+        assert point_in_geometry(5, 5, {'type': 'Polygon', 'coordinates': [self.square]})
+        assert point_in_geometry(25, 5, {'type': 'MultiPolygon', 'coordinates': [
+            [self.square], [[[c[0] + 20, c[1]] for c in self.square]]]})
+        assert not point_in_geometry(5, 5, {'type': 'Point', 'coordinates': [5, 5]})
+
+
+class TestLookupPoints:
+    def test_points_resolve_to_containing_polygon(self, mock_arcgis_server):
+        layer = EsriClient(mock_arcgis_server.url).get_layer('Synthetic/MapServer', 0)
+        synthetic = SyntheticLayer('features', 250, 'polygon', 8)
+        # Cell centres fall inside their polygon, cell corners outside every polygon
+        points = [synthetic.center(oid) for oid in range(1, 251)]
+        corner = (synthetic.extent['xmin'] + synthetic.cell_width, synthetic.extent['ymin'] + synthetic.cell_height)
+
+        mock_arcgis_server.reset_stats()
+        matches = lookup_points(layer, points + [corner], out_fields='OBJECTID,NAME', max_points=40, max_workers=4)
+
+        assert [match['OBJECTID'] for match in matches[:-1]] == list(range(1, 251))
+        assert matches[-1] is None
+        assert mock_arcgis_server.request_count < len(points) / 10
+
+    def test_truncated_clusters_are_split(self, mock_arcgis_server):
+        layer = EsriClient(mock_arcgis_server.url).get_layer('Synthetic/MapServer', 0)
+        synthetic = SyntheticLayer('features', 250, 'polygon', 8)
+        points = [synthetic.center(oid) for oid in range(1, 251)]
+
+        # One cluster covers all 250 polygons, more than maxRecordCount (100)
+        matches = lookup_points(layer, points, max_points=1000)
+
+        assert [match['OBJECTID'] for match in matches] == list(range(1, 251))
+
+    def test_failure_cancels_queued_clusters(self, mock_arcgis_server):
+        layer = EsriClient(mock_arcgis_server.url).get_layer('Synthetic/MapServer', 0)
+        synthetic = SyntheticLayer('features', 250, 'polygon', 8)
+        points = [synthetic.center(oid) for oid in range(1, 251)]
+
+        with patch.object(layer.client, '_get_json', side_effect=RequestException('boom')) as get_json:
+            with pytest.raises(RequestException, match='Point lookup failed'):
+                lookup_points(layer, points, max_points=10, max_workers=1)
+
+        # The single worker may pick up one more cluster before the rest are cancelled
+        assert get_json.call_count <= 2
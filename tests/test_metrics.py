@@ -0,0 +1,63 @@
+import json
+from unittest.mock import patch
+from src.esri_client import EsriClient
+from src.esri_client.metrics import MetricsCollector, RequestMetric, classify_url, percentile
+
+
+class TestMetrics:
+    def test_classify_url(self):
+        base = 'https://example.com/rest/services'
+        assert classify_url(base, {}) == 'catalog'
+        assert classify_url(f'{base}/Svc/MapServer', {}) == 'catalog'
+        assert classify_url(f'{base}/Svc/MapServer/0', {}) == 'layer'
+        assert classify_url(f'{base}/Svc/MapServer/0/query', {'returnCountOnly': 'true'}) == 'count'
+        assert classify_url(f'{base}/Svc/MapServer/0/query', {'returnIdsOnly': 'true'}) == 'ids'
+        assert classify_url(f'{base}/Svc/MapServer/0/query', {'returnCountOnly': 'false'}) == 'page'
+        assert classify_url(f'{base}/Svc/MapServer/0/queryRelatedRecords', {}) == 'page'
+        assert classify_url(f'{base}/Svc/MapServer/0/12/attachments/3', {}) == 'attachment'
+        assert classify_url(f'{base}/Svc/MapServer/tile/3/2/1', {}) == 'tile'
+        assert classify_url(f'{base}/Svc/MapServer/export', {'bbox': '0,0,1,1'}) == 'tile'
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        assert percentile(values, 0.5) == 50
+        assert percentile(values, 0.99) == 99
+        assert percentile([], 0.5) is None
+
+    def test_summary(self):
+        collector = MetricsCollector()
+        for latency, features in [(0.1, 0), (0.2, 10), (0.3, 10)]:
+            metric = RequestMetric('url', 'page')
+            metric.latency, metric.features, metric.bytes = latency, features, 1024
+            collector(metric)
+
+        summary = collector.summary()
+        assert summary['requests'] == 3
+        assert summary['features'] == 20
+        assert summary['latency']['p50'] == 0.2
+        assert summary['byClass'] == {'page': {'requests': 3, 'bytes': 3072, 'latencySeconds': 0.6}}
+
+    def test_client_reports_metrics(self, mock_arcgis_server):
+        client = EsriClient(mock_arcgis_server.url)
+        collector = MetricsCollector()
+        client.add_observer(collector)
+
+        with patch('builtins.print'):
+            client.get_layer('Synthetic/MapServer', 0).query(resultRecordCount=100, max_workers=1)
+
+        classes = [m.url_class for m in collector.metrics]
+        assert classes == ['layer', 'count', 'page', 'page', 'page']
+        assert [m.features for m in collector.metrics if m.url_class == 'page'] == [100, 100, 50]
+        assert all(m.status == 200 and m.bytes > 0 and m.ttfb is not None for m in collector.metrics)
+
+    def test_cli_stats_file(self, mock_arcgis_server, tmp_path):
+        from cli import main
+        stats_path = tmp_path / 'stats.json'
+        argv = ['cli.py', 'layers', '--service', 'Synthetic', '--url', mock_arcgis_server.url,
+                '--stats', str(stats_path)]
+        with patch('sys.argv', argv), patch('builtins.print'):
+            main()
+
+        summary = json.loads(stats_path.read_text())
+        assert summary['requests'] == 2
+        assert set(summary['byClass']) == {'catalog'}
@@ -0,0 +1,46 @@
+from unittest.mock import patch
+import pytest
+from requests.exceptions import HTTPError, RequestException
+from src.esri_client import EsriClient
+from src.esri_client.mock_server import FaultConfig, SyntheticLayer, build_server, query_layer
+
+
+class TestMockServer:
+    def test_catalog_and_offset_query(self, mock_arcgis_server):
+        client = EsriClient(mock_arcgis_server.url)
+        assert [s.name for s in client.get_services().services] == ['Synthetic']
+
+        layer = client.get_layer('Synthetic/MapServer', 0)
+        with patch('builtins.print'):
+            result = layer.query(format='geojson', outFields='NAME', resultRecordCount=100, max_workers=1)
+
+        assert [f['id'] for f in result['features']] == list(range(1, 251))
+        assert result['features'][0]['geometry']['type'] == 'Polygon'
+        # One count request, three pages over a single kept-alive connection
+        assert mock_arcgis_server.paths['/arcgis/rest/services/Synthetic/MapServer/0/query'] == 4
+        assert mock_arcgis_server.connection_count == 1
+
+    def test_tiles_and_time_strategies(self, mock_arcgis_server):
+        client = EsriClient(mock_arcgis_server.url)
+        with patch('builtins.print'):
+            tiled = client.get_layer('Synthetic/MapServer', 0).query(strategy='tiles')
+            windowed = client.get_layer('Synthetic/MapServer', 1).query(strategy='time')
+
+        assert len(tiled['features']) == 250
+        assert len(windowed['features']) == 250
+
+    def test_query_filters(self):
+        layer = SyntheticLayer('points', 100, max_record_count=10)
+        assert query_layer(layer, {'where': 'OBJECTID > 90', 'returnCountOnly': 'true'}) == {'count': 10}
+        assert query_layer(layer, {'objectIds': '5,3,500', 'returnIdsOnly': 'true'})['objectIds'] == [3, 5]
+        assert query_layer(layer, {'where': 'VALUE = 7', 'returnIdsOnly': 'true'})['objectIds'] == [7]
+        page = query_layer(layer, {'where': '1=1'})
+        assert len(page['features']) == 10 and page['exceededTransferLimit']
+
+    def test_injected_errors(self):
+        with build_server(features=10, faults=FaultConfig(error_rate=1.0, error_codes=(403,))) as server:
+            with pytest.raises(HTTPError, match='Access forbidden'):
+                EsriClient(server.url).get_services()
+        with build_server(features=10, faults=FaultConfig(esri_error_rate=1.0)) as server:
+            with pytest.raises(RequestException, match='Injected ESRI error'):
+                EsriClient(server.url).get_services()
@@ -0,0 +1,35 @@
+from src.esri_client.paging import AdaptivePageSize
+
+
+class TestAdaptivePageSize:
+    def test_grows_on_fast_full_pages(self):
+        sizer = AdaptivePageSize(100, maximum=1000)
+        sizer.record(100, 100, 0.1, 1000)
+        assert sizer.size == 200
+
+        sizer.record(200, 150, 0.1, 1000)
+        assert sizer.size == 200
+
+    def test_shrinks_on_slow_large_or_failed_pages(self):
+        sizer = AdaptivePageSize(800, maximum=1000, target_seconds=1.0, max_bytes=1000)
+        sizer.record(800, 800, 1.5, 100)
+        assert sizer.size == 400
+
+        sizer.record(400, 400, 0.1, 5000)
+        assert sizer.size == 200
+
+        sizer.failed(200)
+        assert sizer.size == 100
+        assert sizer.history == [800, 400, 200, 100]
+
+    def test_bounds(self):
+        sizer = AdaptivePageSize(5000, maximum=1000, minimum=50)
+        assert sizer.size == 1000
+
+        for _ in range(10):
+            sizer.failed(sizer.size)
+        assert sizer.size == 50
+
+        sizer.cap(20)
+        assert sizer.size == 20
+        assert sizer.maximum == 20
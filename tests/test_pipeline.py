@@ -0,0 +1,58 @@
+import json
+import os
+from unittest.mock import patch
+from src.esri_client import EsriClient
+from src.esri_client.kml import convert_json_to_kml
+from src.esri_client.pipeline import export_layer
+
+
+class TestPipeline:
+    def test_geojson_export_matches_query(self, mock_arcgis_server, tmp_path):
+        layer = EsriClient(mock_arcgis_server.url).get_layer('Synthetic/MapServer', 0)
+        output = str(tmp_path / 'out.geojson')
+
+        with patch('builtins.print'):
+            expected = layer.query(format='geojson')
+        summary = export_layer(layer, output, format='geojson', processes=0)
+
+        with open(output) as f:
+            data = json.load(f)
+        assert data['type'] == 'FeatureCollection'
+        assert data['features'] == expected['features']
+        assert summary == {'features': 250, 'pages': 3, 'files': [output]}
+
+    def test_kml_export_matches_convert_json_to_kml(self, mock_arcgis_server, tmp_path):
+        layer = EsriClient(mock_arcgis_server.url).get_layer('Synthetic/MapServer', 0)
+        output = str(tmp_path / 'out.kml')
+
+        with patch('builtins.print'):
+            expected = convert_json_to_kml(layer.query(format='geojson'), 'NAME')
+        summary = export_layer(layer, output, format='kml', display_field='NAME', processes=2)
+
+        filename = os.path.join(str(tmp_path / 'out'), 'out.kml')
+        assert summary['files'] == [filename]
+        with open(filename) as f:
+            assert f.read() == expected
+
+    def test_kml_export_splits_by_vertices(self, mock_arcgis_server, tmp_path):
+        layer = EsriClient(mock_arcgis_server.url).get_layer('Synthetic/MapServer', 0)
+        output = str(tmp_path / 'out.kml')
+
+        # 250 polygons of 9 vertices
+        with patch('src.esri_client.pipeline.MAX_KML_VERTICES', 1000), patch('builtins.print'):
+            summary = export_layer(layer, output, format='kml', processes=0)
+
+        assert len(summary['files']) == 3
+        assert all(os.path.basename(f).startswith('out_part') for f in summary['files'])
+        with open(summary['files'][0]) as f:
+            assert f.read().count('<Placemark>') == 111
+
+    def test_where_and_empty_result(self, mock_arcgis_server, tmp_path):
+        layer = EsriClient(mock_arcgis_server.url).get_layer('Synthetic/MapServer', 0)
+        output = str(tmp_path / 'out.json')
+
+        summary = export_layer(layer, output, format='pjson', where='OBJECTID > 1000', processes=0)
+
+        with open(output) as f:
+            assert json.load(f)['features'] == []
+        assert summary['features'] == 0
@@ -0,0 +1,76 @@
+from unittest.mock import Mock, patch
+from src.esri_client import Layer
+from src.esri_client.planner import plan_query
+
+
+class TestPlanQuery:
+    def test_offset_when_pagination_supported(self):
+        data = {'maxRecordCount': 2000, 'advancedQueryCapabilities': {'supportsPagination': True}}
+        plan = plan_query(data, total_count=10000, format='pjson', max_workers=8)
+
+        assert plan.strategy == 'offset'
+        assert plan.page_size == 2000
+        assert plan.format == 'json'
+        assert plan.concurrency == 5
+        assert plan.estimated_requests == 6
+
+    def test_object_ids_without_pagination(self):
+        data = {'maxRecordCount': 1000, 'objectIdField': 'OBJECTID', 'extent': {}}
+        plan = plan_query(data, total_count=2000, format='kml')
+
+        assert plan.strategy == 'objectids'
+        assert plan.page_size == 500
+        assert plan.format == 'geojson'
+        assert plan.estimated_requests == 6
+
+    def test_tiles_without_pagination_or_object_ids(self):
+        plan = plan_query({'extent': {'xmin': 0}}, total_count=5000)
+        assert plan.strategy == 'tiles'
+
+    def test_single_page_when_everything_fits(self):
+        plan = plan_query({'maxRecordCount': 1000}, total_count=3)
+        assert plan.strategy == 'offset'
+        assert plan.estimated_requests == 2
+
+
+class TestLayerAutoStrategy:
+    def test_auto_uses_object_ids_without_pagination(self):
+        mock_client = Mock()
+        mock_client.base_url = 'https://example.com'
+
+        def get_json(url, params):
+            if params.get('returnCountOnly') == 'true':
+                return {'count': 3}
+            if params.get('returnIdsOnly') == 'true':
+                return {'objectIds': [3, 1, 2]}
+            return {'features': [{'attributes': {'OBJECTID': int(oid)}} for oid in params['objectIds'].split(',')]}
+
+        mock_client._get_json.side_effect = get_json
+        layer = Layer({'maxRecordCount': 2, 'objectIdField': 'OBJECTID'}, mock_client, 'service/path', 0)
+
+        with patch('builtins.print'):
+            result = layer.query(strategy='auto')
+
+        assert [f['attributes']['OBJECTID'] for f in result['features']] == [1, 2, 3]
+        fetches = [c[0][1] for c in mock_client._get_json.call_args_list if 'objectIds' in c[0][1]]
+        assert [p['objectIds'] for p in fetches] == ['1,2', '3']
+        assert all(p['f'] == 'json' for p in fetches)
+
+    def test_offset_pages_fetched_concurrently(self):
+        mock_client = Mock()
+        mock_client.base_url = 'https://example.com'
+
+        def get_json(url, params):
+            if params.get('returnCountOnly') == 'true':
+                return {'count': 5}
+            offset = params['resultOffset']
+            return {'features': [{'id': i} for i in range(offset, min(offset + 2, 5))]}
+
+        mock_client._get_json.side_effect = get_json
+        layer = Layer({}, mock_client, 'service/path', 0)
+
+        with patch('builtins.print'):
+            result = layer.query(resultRecordCount=2, max_workers=3)
+
+        assert [f['id'] for f in result['features']] == [0, 1, 2, 3, 4]
+        assert mock_client._get_json.call_count == 4
@@ -0,0 +1,48 @@
+import json
+import os
+from unittest.mock import patch
+from src.esri_client import EsriClient
+from src.esri_client.profiling import Profiler, phase
+
+
+class TestProfiling:
+    def test_phase_is_noop_without_profiler(self):
+        with phase('anything'):
+            pass
+
+    def test_nested_phases_and_memory(self, tmp_path):
+        cprofile_path = str(tmp_path / 'run.prof')
+        with Profiler(cprofile_path=cprofile_path, trace_memory=True) as profiler:
+            for _ in range(2):
+                with phase('outer'):
+                    with phase('inner'):
+                        data = [0] * 100000
+
+        report = profiler.report()
+        assert report['phases']['outer']['calls'] == 2
+        assert report['phases']['inner']['calls'] == 2
+        assert report['peakMemoryMB'] > 0.5
+        assert os.path.getsize(cprofile_path) > 0
+        assert len(data) == 100000
+
+    def test_layer_query_phases(self, mock_arcgis_server):
+        layer = EsriClient(mock_arcgis_server.url).get_layer('Synthetic/MapServer', 0)
+        with Profiler() as profiler, patch('builtins.print'):
+            layer.query(resultRecordCount=100, max_workers=1)
+
+        phases = profiler.report()['phases']
+        assert phases['count']['calls'] == 1
+        assert phases['pagination']['calls'] == 1
+        assert phases['decode']['calls'] == 4
+
+    def test_cli_profile(self, mock_arcgis_server, tmp_path):
+        from cli import main
+        profile_path = tmp_path / 'profile.json'
+        argv = ['cli.py', 'query', '--service', 'Synthetic', '--id', '0', '--format', 'kml',
+                '--output', str(tmp_path / 'out.kml'), '--url', mock_arcgis_server.url, '--profile', str(profile_path)]
+        with patch('sys.argv', argv), patch('builtins.print'):
+            main()
+
+        phases = json.loads(profile_path.read_text())['phases']
+        assert {'catalog', 'count', 'pagination', 'decode', 'kml conversion', 'vertex counting',
+                'file write'} <= set(phases)
@@ -0,0 +1,83 @@
+import threading
+import pytest
+from src.esri_client import EsriClient
+from src.esri_client.mock_server import FaultConfig, SyntheticLayer, build_server
+from src.esri_client.proxy import CachingProxy, parse_upstreams
+
+
+@pytest.fixture
+def proxy(mock_arcgis_server):
+    with CachingProxy({'mock': mock_arcgis_server.url}, port=0) as proxy:
+        yield proxy
+
+
+class TestCachingProxy:
+    def test_client_through_proxy_matches_upstream(self, mock_arcgis_server, proxy):
+        direct = EsriClient(mock_arcgis_server.url).get_layer('Synthetic/MapServer', 0).query(format='geojson')
+        proxied = EsriClient(proxy.url_for('mock')).get_layer('Synthetic/MapServer', 0).query(format='geojson')
+
+        assert proxied == direct
+
+    def test_repeated_requests_are_cached(self, mock_arcgis_server, proxy):
+        for _ in range(2):
+            EsriClient(proxy.url_for('mock')).get_layer('Synthetic/MapServer', 0).query(format='geojson')
+        first_run = proxy.stats['misses']
+
+        assert proxy.stats['hits'] == first_run
+        assert mock_arcgis_server.request_count == first_run
+
+    def test_identical_requests_are_coalesced(self):
+        with build_server(features=10, faults=FaultConfig(latency=0.2)) as server, \
+                CachingProxy({'mock': server.url}, port=0) as proxy:
+            client = EsriClient(proxy.url_for('mock'))
+            threads = [threading.Thread(target=client.get_services) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            assert server.request_count == 1
+            assert proxy.stats['misses'] == 1
+            assert proxy.stats['coalesced'] + proxy.stats['hits'] == 4
+
+    def test_errors_are_not_cached(self):
+        with build_server(features=10, faults=FaultConfig(esri_error_rate=1.0)) as server, \
+                CachingProxy({'mock': server.url}, port=0) as proxy:
+            for _ in range(2):
+                response, status = proxy.handle('/mock/rest/services', 'f=pjson')
+                assert status == 'MISS'
+            assert b'Injected ESRI error' in response.body
+            assert server.request_count == 2
+
+    def test_query_ttl_and_size_limit(self, mock_arcgis_server):
+        with CachingProxy({'mock': mock_arcgis_server.url}, port=0, ttl=0, max_bytes=10 ** 6) as proxy:
+            proxy.handle('/mock/rest/services/Synthetic/MapServer/0/query', 'where=1%3D1&f=json')
+            proxy.handle('/mock/rest/services/Synthetic/MapServer/0', 'f=json')
+
+            assert len(proxy.cache) == 1
+            assert proxy.cache_bytes <= proxy.max_bytes
+
+    def test_data_endpoints_use_query_ttl(self):
+        layers = [SyntheticLayer('parcels', 10, related={1: 2}, attachments=1),
+                  SyntheticLayer('inspections', 20, layer_id=1)]
+        with build_server(layers=layers) as server, \
+                CachingProxy({'mock': server.url}, port=0, ttl=0, max_entry_bytes=0) as proxy:
+            for _ in range(2):
+                related, _ = proxy.handle('/mock/rest/services/Synthetic/MapServer/0/queryRelatedRecords',
+                                          'relationshipId=1&objectIds=1,2&f=json')
+                attachment, _ = proxy.handle('/mock/rest/services/Synthetic/MapServer/0/1/attachments/1', '')
+                proxy.handle('/mock/rest/services/Synthetic/MapServer/0', 'f=json')
+
+            assert related.status == attachment.status == 200
+            # Only the layer metadata is cached: the related records expire
+            # on ttl and the attachment is larger than max_entry_bytes
+            assert len(proxy.cache) == 1 and proxy.stats['hits'] == 1
+
+    def test_unknown_upstream(self, proxy):
+        with pytest.raises(LookupError):
+            proxy.handle('/other/rest/services', '')
+
+    def test_parse_upstreams(self):
+        assert parse_upstreams(['gis=https://gis.example.com/arcgis']) == {'gis': 'https://gis.example.com/arcgis'}
+        with pytest.raises(ValueError):
+            parse_upstreams(['https://gis.example.com/arcgis'])
@@ -0,0 +1,72 @@
+import math
+import zipfile
+
+from src.esri_client.regionate import build_quadtree, feature_bbox, node_kml, write_regionated_kmz
+
+
+def point_feature(x, y, name):
+    return {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [x, y]}, 'properties': {'NAME': name}}
+
+
+def circle_feature(n, cx, cy, r):
+    ring = [[cx + r * math.cos(2 * math.pi * k / n), cy + r * math.sin(2 * math.pi * k / n)] for k in range(n)]
+    return {'type': 'Feature', 'geometry': {'type': 'Polygon', 'coordinates': [ring + [ring[0]]]},
+            'properties': {'NAME': 'circle'}}
+
+
+def grid(n):
+    return [point_feature(i % n, i // n, f"p{i}") for i in range(n * n)]
+
+
+class TestQuadtree:
+    def test_nodes_respect_capacity(self):
+        root = build_quadtree(grid(20), node_features=50)
+        nodes = list(root.walk())
+
+        assert sum(len(node.features) for node in nodes) == 400
+        assert all(len(node.features) <= 50 for node in nodes)
+        assert len(nodes) > 1
+        assert all(child.name.startswith(node.name) for node in nodes for child in node.children.values())
+
+    def test_largest_features_stay_at_root(self):
+        features = grid(10) + [circle_feature(64, 5, 5, 5)]
+        root = build_quadtree(features, node_features=10)
+
+        assert root.features[0]['properties']['NAME'] == 'circle'
+
+    def test_no_geometries(self):
+        assert build_quadtree([{'type': 'Feature', 'geometry': None, 'properties': {}}]) is None
+        assert feature_bbox({'geometry': {'type': 'Point', 'coordinates': [1, 2]}}) == (1, 2, 1, 2)
+
+
+class TestRegionKml:
+    def test_node_links_children_on_region(self):
+        root = build_quadtree(grid(10), node_features=10)
+        kml = node_kml(root, 'NAME', href_prefix='regions/')
+
+        assert kml.count('<Placemark>') == 10
+        assert '<minLodPixels>128</minLodPixels>' in kml
+        assert kml.count('<NetworkLink>') == len(root.children)
+        assert '<href>regions/r0.kml</href>' in kml
+        assert '<viewRefreshMode>onRegion</viewRefreshMode>' in kml
+
+    def test_detailed_geometry_shown_when_zoomed_in(self):
+        root = build_quadtree([circle_feature(2000, 0, 0, 1), point_feature(10, 10, 'far')])
+        kml = node_kml(root)
+
+        assert kml.count('<Placemark>') == 3
+        assert '<maxLodPixels>1024</maxLodPixels>' in kml
+        assert '<minLodPixels>1024</minLodPixels>' in kml
+
+    def test_write_kmz(self, tmp_path):
+        path = tmp_path / 'out.kmz'
+        summary = write_regionated_kmz(grid(20), str(path), 'NAME', node_features=50)
+
+        with zipfile.ZipFile(path) as kmz:
+            names = kmz.namelist()
+            placemarks = sum(kmz.read(name).decode().count('<Placemark>') for name in names)
+
+        assert names[0] == 'doc.kml'
+        assert all(name.startswith('regions/r') for name in names[1:])
+        assert len(names) == summary['nodes']
+        assert placemarks == summary['features'] == 400
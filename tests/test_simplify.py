@@ -0,0 +1,49 @@
+import math
+from src.esri_client.simplify import (count_vertices, geometry_precision, simplify_features, simplify_line,
+                                      vertex_importance)
+
+
+def circle(n, cx=0.0, cy=0.0, r=1.0):
+    ring = [[cx + r * math.cos(2 * math.pi * k / n), cy + r * math.sin(2 * math.pi * k / n)] for k in range(n)]
+    return ring + [ring[0]]
+
+
+def polygon_feature(ring):
+    return {'type': 'Feature', 'geometry': {'type': 'Polygon', 'coordinates': [ring]}, 'properties': {}}
+
+
+class TestSimplify:
+    def test_line_keeps_corners(self):
+        line = [[0, 0], [1, 0.01], [2, 0], [2, 1], [2.01, 2], [2, 3]]
+        assert simplify_line(line, 0.1) == [[0, 0], [2, 0], [2, 3]]
+
+    def test_ring_never_collapses(self):
+        ring = circle(32)
+        weights = vertex_importance(ring)
+        assert sum(1 for w in weights if w == float('inf')) == 4
+        assert len(simplify_line(ring, 10)) == 4
+
+    def test_features_fit_budget(self):
+        features = [polygon_feature(circle(100, cx=i * 3)) for i in range(10)]
+        report = simplify_features(features, 300)
+
+        assert report['verticesBefore'] == 1010
+        assert report['verticesAfter'] == count_vertices(features) <= 300
+        assert report['verticesRemoved'] == 1010 - report['verticesAfter']
+        assert all(len(f['geometry']['coordinates'][0]) >= 4 for f in features)
+
+    def test_within_budget_is_unchanged(self):
+        features = [polygon_feature(circle(10))]
+        report = simplify_features(features, 100)
+
+        assert report['verticesRemoved'] == 0
+        assert count_vertices(features) == 11
+
+    def test_esri_rings(self):
+        features = [{'attributes': {}, 'geometry': {'rings': [circle(50)]}}]
+        report = simplify_features(features, 20)
+        assert report['verticesAfter'] <= 20
+
+    def test_geometry_precision(self):
+        assert geometry_precision(0.001) == 4
+        assert geometry_precision(10) == 0
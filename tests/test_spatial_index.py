@@ -0,0 +1,83 @@
+import pytest
+
+from src.esri_client import EsriClient
+from src.esri_client.mock_server import SyntheticLayer
+from src.esri_client.spatial_index import SpatialIndex, build_index, geometry_parts, LINE, POINT, POLYGON
+
+
+def square(x, y, size=1.0):
+    return [[x, y], [x, y + size], [x + size, y + size], [x + size, y], [x, y]]
+
+
+@pytest.fixture
+def grid_index(tmp_path):
+    features = [{'type': 'Feature', 'geometry': {'type': 'Polygon', 'coordinates': [square(i % 30, i // 30)]},
+                 'properties': {'ID': i}} for i in range(900)]
+    features.append({'type': 'Feature', 'geometry': None, 'properties': {'ID': -1}})
+    path = tmp_path / 'grid.idx'
+    summary = build_index(iter(features), str(path), node_capacity=8, metadata={'name': 'grid'})
+    with SpatialIndex(str(path)) as index:
+        yield index, summary
+
+
+class TestBuildIndex:
+    def test_summary(self, grid_index):
+        index, summary = grid_index
+
+        assert summary['features'] == len(index) == 900
+        assert summary['skipped'] == 1
+        assert summary['levels'] == len(index.levels) > 1
+        assert index.metadata == {'name': 'grid'}
+
+    def test_geometry_parts(self):
+        assert geometry_parts({'x': 1, 'y': 2}) == (POINT, [[(1, 2)]])
+        assert geometry_parts({'paths': [[[0, 0], [1, 1]]]})[0] == LINE
+        kind, parts = geometry_parts({'type': 'MultiPolygon', 'coordinates': [[square(0, 0)], [square(5, 5)]]})
+        assert kind == POLYGON and len(parts) == 2
+
+    def test_not_an_index(self, tmp_path):
+        path = tmp_path / 'other.idx'
+        path.write_bytes(b'not an index at all, just some bytes')
+
+        with pytest.raises(ValueError):
+            SpatialIndex(str(path))
+
+
+class TestSpatialIndexQueries:
+    def test_contains(self, grid_index):
+        index, _ = grid_index
+
+        for x, y in [(0.5, 0.5), (12.25, 7.75), (29.9, 29.9)]:
+            feature = index.contains(x, y)
+            assert index.attributes(feature)['ID'] == int(y) * 30 + int(x)
+        assert index.contains(-1, 5) is None
+
+    def test_hole_excluded(self, tmp_path):
+        path = tmp_path / 'hole.idx'
+        geometry = {'rings': [square(0, 0, 10), square(4, 4, 2)]}
+        build_index([{'geometry': geometry, 'attributes': {'ID': 1}}], str(path))
+
+        with SpatialIndex(str(path)) as index:
+            assert index.containing(1, 1) == [0]
+            assert index.containing(5, 5) == []
+
+    def test_nearest(self, grid_index):
+        index, _ = grid_index
+
+        (first, distance), second = index.nearest(-2, 0.5, k=2)
+        assert index.attributes(first)['ID'] == 0 and distance == pytest.approx(2)
+        assert index.attributes(second[0])['ID'] in (1, 30)
+        assert index.nearest(3.5, 3.5)[0][1] == 0
+
+    def test_built_from_layer_pages(self, mock_arcgis_server, tmp_path):
+        layer = EsriClient(mock_arcgis_server.url).get_layer('Synthetic/MapServer', 0)
+        synthetic = SyntheticLayer('features', 250, 'polygon', 8)
+        path = tmp_path / 'layer.idx'
+
+        pages = layer.iter_pages(format='json', outFields='OBJECTID')
+        build_index((feature for page in pages for feature in page['features']), str(path))
+
+        with SpatialIndex(str(path)) as index:
+            assert len(index) == 250
+            for oid in (1, 99, 250):
+                assert index.attributes(index.contains(*synthetic.center(oid)))['OBJECTID'] == oid
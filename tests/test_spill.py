@@ -0,0 +1,29 @@
+from src.esri_client.spill import SpillingFeatureList
+
+
+def make_page(start, size):
+    return [{'type': 'Feature', 'id': i, 'properties': {'NAME': f'Feature {i}'}} for i in range(start, start + size)]
+
+
+class TestSpillingFeatureList:
+    def test_stays_in_memory_under_budget(self):
+        with SpillingFeatureList(10 ** 6) as features:
+            features.extend(make_page(0, 10))
+            features.extend(make_page(10, 10))
+
+            assert not features.spilled
+            assert len(features) == 20
+            assert [f['id'] for f in features] == list(range(20))
+
+    def test_spills_pages_past_budget(self, tmp_path):
+        with SpillingFeatureList(5000, directory=str(tmp_path)) as features:
+            for start in range(0, 100, 10):
+                features.extend(make_page(start, 10))
+
+            assert features.spilled
+            assert features.spilled_pages > 0
+            assert features.memory_bytes <= 5000
+            assert len(features) == 100
+            assert [f['id'] for f in features] == list(range(100))
+            # Pages can be read back more than once
+            assert sum(len(page) for page in features.iter_pages()) == 100
@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules only needed once a command actually runs
+HEAVY_MODULES = ['requests', 'sqlite3', 'concurrent.futures', 'http.server', 'cProfile', 'tracemalloc']
+
+# Generous budget for the cumulative import time of cli, in microseconds;
+# importing requests alone takes about this long
+IMPORT_BUDGET_US = 100000
+
+
+def run_python(*args):
+    return subprocess.run([sys.executable, *args], capture_output=True, text=True, cwd=ROOT, check=True)
+
+
+class TestStartup:
+    def test_import_does_not_load_heavy_modules(self):
+        code = f"import sys, cli; print([m for m in {HEAVY_MODULES!r} if m in sys.modules])"
+        assert run_python('-c', code).stdout.strip() == '[]'
+
+    def test_import_time_budget(self):
+        stderr = run_python('-X', 'importtime', '-c', 'import cli').stderr
+        # Lines look like "import time:  self [us] | cumulative | name"
+        cumulative = {}
+        for line in stderr.splitlines():
+            if line.startswith('import time:') and '|' in line:
+                _, total, name = line[len('import time:'):].split('|')
+                if total.strip().isdigit():
+                    cumulative[name.strip()] = int(total)
+        assert cumulative['cli'] < IMPORT_BUDGET_US
+
+    def test_only_selected_command_is_configured(self):
+        import cli
+
+        parser = cli.build_parser(['folders'])
+        args = parser.parse_args(['folders', '--url', 'https://example.com/arcgis'])
+        assert args.command == 'folders'
+        subparsers = parser._subparsers._group_actions[0].choices
+        assert not any(a.dest == 'where' for a in subparsers['query']._actions)
@@ -0,0 +1,41 @@
+import statistics as pystats
+
+import pytest
+
+from src.esri_client.statistics import StatisticsAggregator, statistic_definition
+
+
+class TestStatisticDefinition:
+    def test_spec(self):
+        assert statistic_definition('SUM:POP:total') == {
+            'statisticType': 'sum', 'onStatisticField': 'POP', 'outStatisticFieldName': 'total'}
+        assert statistic_definition('count:OBJECTID')['outStatisticFieldName'] == 'count_OBJECTID'
+
+    def test_invalid(self):
+        for spec in ('median:POP', 'sum', 'sum:', 'a:b:c:d'):
+            with pytest.raises(ValueError):
+                statistic_definition(spec)
+
+
+class TestStatisticsAggregator:
+    def test_grouped_statistics(self):
+        values = {'a': [1, 4, 9, None], 'b': [2.5]}
+        aggregator = StatisticsAggregator(
+            [statistic_definition(spec) for spec in ('count:V', 'sum:V', 'min:V', 'max:V', 'avg:V', 'stddev:V',
+                                                     'var:V')], ['G'])
+        aggregator.extend({'attributes': {'G': group, 'V': value}} for group, vs in values.items() for value in vs)
+
+        rows = aggregator.rows('G DESC')
+        assert [row['G'] for row in rows] == ['b', 'a']
+        a = rows[1]
+        assert (a['count_V'], a['sum_V'], a['min_V'], a['max_V']) == (3, 14, 1, 9)
+        assert a['avg_V'] == pytest.approx(14 / 3)
+        assert a['stddev_V'] == pytest.approx(pystats.stdev([1, 4, 9]))
+        assert a['var_V'] == pytest.approx(pystats.variance([1, 4, 9]))
+        assert rows[0]['stddev_V'] == 0.0
+
+    def test_all_null_group(self):
+        aggregator = StatisticsAggregator([statistic_definition('sum:V'), statistic_definition('count:V')])
+        aggregator.add({'V': None})
+
+        assert aggregator.rows() == [{'sum_V': None, 'count_V': 0}]
@@ -0,0 +1,91 @@
+from unittest.mock import Mock
+from src.esri_client import Layer
+from src.esri_client.sync import FeatureStore
+
+
+def make_sync_client(rows):
+    """Mock client serving returnIdsOnly and objectIds queries over {oid: edit_date}."""
+    mock_client = Mock()
+    mock_client.base_url = 'https://example.com'
+
+    def get_json(url, params):
+        if params.get('returnIdsOnly') == 'true':
+            ids = sorted(rows)
+            if '>' in params['where']:
+                # Compares at second precision, like some datastores
+                ids = [oid for oid in ids if rows[oid] // 1000 >= 1700000000]
+            return {'objectIds': ids}
+        ids = [int(oid) for oid in params['objectIds'].split(',')]
+        return {'features': [{'id': oid, 'properties': {'OBJECTID': oid, 'EDITED': rows[oid]}} for oid in ids]}
+
+    mock_client._get_json.side_effect = get_json
+    return mock_client
+
+
+class TestFeatureStore:
+    def test_upsert_delete_and_watermark(self, tmp_path):
+        with FeatureStore(str(tmp_path / 'store.db')) as store:
+            store.upsert('layer', [{'attributes': {'OBJECTID': 1}}, {'attributes': {'OBJECTID': 2}}], 'OBJECTID')
+            store.delete('layer', [1])
+            store.set_watermark('layer', 42, 'pjson')
+
+            assert store.object_ids('layer') == {2}
+            assert store.get_watermark('layer') == 42
+            assert list(store.iter_features('layer')) == [{'attributes': {'OBJECTID': 2}}]
+
+
+class TestLayerSync:
+    def test_sync_fetches_only_changes(self, tmp_path):
+        rows = {1: 1600000000000, 2: 1600000000000, 3: 1600000000000}
+        mock_client = make_sync_client(rows)
+        data = {'objectIdField': 'OBJECTID', 'editFieldsInfo': {'editDateField': 'EDITED'}}
+        layer = Layer(data, mock_client, 'service/path', 0)
+        db = str(tmp_path / 'layer.db')
+
+        first = layer.sync(db)
+        assert first == {'inserted': 3, 'updated': 0, 'deleted': 0, 'total': 3, 'watermark': 1600000000000}
+
+        del rows[1]
+        rows[2] = 1700000000000
+        rows[4] = 1700000000000
+        mock_client._get_json.reset_mock()
+        second = layer.sync(db)
+
+        assert second == {'inserted': 1, 'updated': 1, 'deleted': 1, 'total': 3, 'watermark': 1700000000000}
+        fetched = [c[0][1]['objectIds'] for c in mock_client._get_json.call_args_list if 'objectIds' in c[0][1]]
+        assert fetched == ['2,4']
+        changed_where = mock_client._get_json.call_args_list[1][0][1]['where']
+        assert changed_where == "(1=1) AND EDITED > timestamp '2020-09-13 12:26:40.000'"
+
+        # The last edits come back again but are not counted as updates
+        third = layer.sync(db)
+        assert third == {'inserted': 0, 'updated': 0, 'deleted': 0, 'total': 3, 'watermark': 1700000000000}
+
+    def test_where_clauses_kept_apart(self, tmp_path):
+        rows = {1: 0, 2: 0, 3: 0}
+        mock_client = make_sync_client(rows)
+        layer = Layer({}, mock_client, 'service/path', 0)
+        db = str(tmp_path / 'layer.db')
+
+        layer.sync(db)
+        mock_client._get_json.side_effect = lambda url, params: (
+            {'objectIds': [1]} if params.get('returnIdsOnly') == 'true'
+            else {'features': [{'id': 1, 'properties': {'OBJECTID': 1}}]})
+        filtered = layer.sync(db, where='OBJECTID = 1')
+
+        assert filtered['inserted'] == 1 and filtered['deleted'] == 0
+        with FeatureStore(db) as store:
+            assert store.count(layer.url) == 3
+
+    def test_sync_without_edit_tracking_diffs_ids(self, tmp_path):
+        rows = {1: 0, 2: 0}
+        mock_client = make_sync_client(rows)
+        layer = Layer({}, mock_client, 'service/path', 0)
+        db = str(tmp_path / 'layer.db')
+
+        layer.sync(db)
+        rows[3] = 0
+        del rows[1]
+        summary = layer.sync(db)
+
+        assert summary == {'inserted': 1, 'updated': 0, 'deleted': 1, 'total': 2, 'watermark': None}
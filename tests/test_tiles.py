@@ -0,0 +1,98 @@
+import sqlite3
+
+import pytest
+
+from src.esri_client import EsriClient, Service
+from src.esri_client.metrics import MetricsCollector
+from src.esri_client.mock_server import FaultConfig, MockArcGISServer, SyntheticLayer, SyntheticService
+from src.esri_client.tiles import cache_levels, download_tiles, tile_bounds, tile_range, WEB_MERCATOR_EXTENT
+
+BBOX = (-10.0, -10.0, 10.0, 10.0)
+
+
+@pytest.fixture
+def tile_server():
+    services = [SyntheticService('Basemap', [SyntheticLayer('features', 10)], tile_levels=6),
+                SyntheticService('Dynamic', [SyntheticLayer('features', 10)])]
+    with MockArcGISServer(services) as server:
+        yield server
+
+
+def stored_tiles(path):
+    with sqlite3.connect(path) as connection:
+        return {(z, x, y): bytes(data) for z, x, y, data in
+                connection.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles")}
+
+
+class TestTileMath:
+    def test_tile_range(self):
+        assert tile_range((-180, -85, 180, 85), 2) == (0, 0, 3, 3)
+        assert tile_range(BBOX, 3) == (3, 3, 4, 4)
+
+    def test_tile_bounds(self):
+        assert tile_bounds(0, 0, 0) == (-WEB_MERCATOR_EXTENT, -WEB_MERCATOR_EXTENT,
+                                        WEB_MERCATOR_EXTENT, WEB_MERCATOR_EXTENT)
+        assert tile_bounds(1, 1, 0) == (0, 0, WEB_MERCATOR_EXTENT, WEB_MERCATOR_EXTENT)
+
+    def test_cache_levels(self):
+        service = SyntheticService('Basemap', [], tile_levels=4)
+        assert cache_levels(service.metadata()) == {0: 0, 1: 1, 2: 2, 3: 3}
+
+        other = service.metadata()
+        other['tileInfo']['spatialReference'] = {'wkid': 2263}
+        assert cache_levels(other) is None
+        assert cache_levels(SyntheticService('Dynamic', []).metadata()) is None
+
+
+class TestDownloadTiles:
+    def test_cached_tiles_flipped_and_resumed(self, tile_server, tmp_path):
+        service = EsriClient(tile_server.url).get_service('Basemap/MapServer')
+        path = str(tmp_path / 'basemap.mbtiles')
+
+        first = download_tiles(service, path, BBOX, 0, 3, max_workers=4, batch_size=3)
+        tile_server.reset_stats()
+        second = download_tiles(service, path, BBOX, 0, 4, max_workers=4)
+
+        assert first['source'] == 'cache'
+        assert first['downloaded'] == first['tiles'] == 1 + 4 + 4 + 4
+        assert second['skipped'] == first['tiles'] and second['downloaded'] == 4
+        assert tile_server.request_count == 4
+        tiles = stored_tiles(path)
+        # XYZ row 4 of zoom 3 is TMS row 3
+        assert tiles[(3, 3, 3)].endswith(b'tile 3/4/3')
+        with sqlite3.connect(path) as connection:
+            metadata = dict(connection.execute("SELECT name, value FROM metadata"))
+        assert metadata['format'] == 'png'
+        assert (metadata['minzoom'], metadata['maxzoom']) == ('0', '4')
+
+    def test_export_fallback(self, tile_server, tmp_path):
+        service = EsriClient(tile_server.url).get_service('Dynamic/MapServer')
+        path = str(tmp_path / 'dynamic.mbtiles')
+
+        summary = download_tiles(service, path, BBOX, 1, 2, image_format='jpg')
+
+        assert summary['source'] == 'export' and summary['downloaded'] == 4 + 4
+        assert tile_server.paths['/arcgis/rest/services/Dynamic/MapServer/export'] == 8
+        assert stored_tiles(path)[(1, 1, 1)].endswith(b'export 0.0,0.0,20037508.342789244,20037508.342789244 256,256')
+        with pytest.raises(ValueError):
+            download_tiles(service, path, BBOX, 1, 2, export=False)
+
+    def test_tile_requests_reported_to_observers(self, tile_server, tmp_path):
+        client = EsriClient(tile_server.url)
+        service = client.get_service('Basemap/MapServer')
+        collector = MetricsCollector()
+        client.add_observer(collector)
+
+        summary = download_tiles(service, str(tmp_path / 'basemap.mbtiles'), BBOX, 0, 1)
+
+        tiles = [m for m in collector.metrics if m.url_class == 'tile']
+        assert len(tiles) == summary['tiles'] == 5
+        assert all(m.status == 200 and m.bytes > 0 and m.error is None for m in tiles)
+
+    def test_failed_tiles_counted(self, tmp_path):
+        services = [SyntheticService('Basemap', [SyntheticLayer('features', 10)], tile_levels=6)]
+        with MockArcGISServer(services, faults=FaultConfig(error_rate=1.0, error_codes=(403,))) as server:
+            service = Service(services[0].metadata(), EsriClient(server.url), 'Basemap/MapServer')
+            summary = download_tiles(service, str(tmp_path / 'failed.mbtiles'), BBOX, 0, 1)
+
+        assert summary['failed'] == 5 and summary['downloaded'] == 0